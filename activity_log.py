@@ -0,0 +1,175 @@
+"""
+activity_log.py — учёт дней активности с отложенной записью (write-behind).
+
+record() вызывается на каждую команду и не трогает диск: пара
+(user_id, день) попадает в множество «грязных» в памяти. Фоновый поток раз в
+ACTIVITY_FLUSH_S секунд OR-ит накопленное в битовые карты activity_bits
+одной транзакцией (db.add_activity_bits). stop() дописывает остаток —
+вызывать при остановке бота; на всякий случай он же стоит в atexit.
+
+История пользователя — History: все годы склеены в одно целое число
+(бит = день), поэтому графики, стрики и подсчёты — сдвиги, маски и bit_count.
+history() учитывает и ещё не записанные дни.
+"""
+
+from __future__ import annotations
+import atexit
+import datetime
+import logging
+import os
+import threading
+
+import db
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_S = float(os.getenv("ACTIVITY_FLUSH_S", "5"))
+
+
+def year_bit(day: datetime.date) -> tuple[int, int]:
+    """(год, номер бита) дня в годовой карте."""
+    return day.year, day.timetuple().tm_yday - 1
+
+
+class History:
+    """
+    Активность пользователя как одно целое: бит i — день origin + i.
+    Все запросы — битовые операции над self.bits, без перебора дат.
+    """
+
+    def __init__(self, years: dict[int, int]):
+        first = min(years) if years else datetime.date.today().year
+        self.origin = datetime.date(first, 1, 1).toordinal()
+        self.bits = 0
+        for year, mask in years.items():
+            self.bits |= mask << (datetime.date(year, 1, 1).toordinal() - self.origin)
+
+    def _index(self, day: datetime.date) -> int:
+        return day.toordinal() - self.origin
+
+    def _window(self, start: datetime.date, end: datetime.date) -> int:
+        """Биты дней [start, end], младший — start."""
+        lo, hi = self._index(start), self._index(end)
+        if hi < 0 or hi < lo:
+            return 0
+        if lo < 0:
+            return (self.bits & ((1 << (hi + 1)) - 1)) << -lo
+        return (self.bits >> lo) & ((1 << (hi - lo + 1)) - 1)
+
+    def is_active(self, day: datetime.date) -> bool:
+        i = self._index(day)
+        return i >= 0 and bool(self.bits >> i & 1)
+
+    def count(self, start: datetime.date, end: datetime.date) -> int:
+        """Активных дней в [start, end]."""
+        return self._window(start, end).bit_count()
+
+    def days(self, start: datetime.date, end: datetime.date) -> list[bool]:
+        """Флаги активности по дням [start, end] — для графиков."""
+        window = self._window(start, end)
+        return [bool(window >> i & 1) for i in range((end - start).days + 1)]
+
+    def total(self) -> int:
+        return self.bits.bit_count()
+
+    def current_streak(self, today: datetime.date) -> int:
+        """Дней подряд до сегодня; если сегодня ещё не было активности — до вчера."""
+        t = self._index(today)
+        if t < 0:
+            return 0
+        if not self.bits >> t & 1:
+            t -= 1
+        if t < 0:
+            return 0
+        # нули в [0, t]: старший из них — где серия прервалась
+        gaps = ~self.bits & ((1 << (t + 1)) - 1)
+        return t + 1 if not gaps else t - gaps.bit_length() + 1
+
+    def longest_streak(self) -> int:
+        # x & (x >> 1) укорачивает каждую серию единиц на 1: число шагов — длина самой длинной
+        x, n = self.bits, 0
+        while x:
+            x &= x >> 1
+            n += 1
+        return n
+
+
+class ActivityLog:
+    def __init__(self, flush_interval_s: float = FLUSH_INTERVAL_S, today=datetime.date.today):
+        self.flush_interval_s = flush_interval_s
+        self._today = today
+        self._lock = threading.Lock()
+        self._dirty: set[tuple[int, datetime.date]] = set()
+        # Уже учтённые сегодня пары: повторные команды за день — только проверка в set
+        self._seen: set[tuple[int, datetime.date]] = set()
+        self._seen_day: datetime.date | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def record(self, user_id: int) -> None:
+        day = self._today()
+        key = (user_id, day)
+        with self._lock:
+            if day != self._seen_day:
+                self._seen.clear()
+                self._seen_day = day
+            if key in self._seen:
+                return
+            self._seen.add(key)
+            self._dirty.add(key)
+            if self._thread is None:
+                self._start()
+
+    def _start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="activity-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval_s):
+            self.flush()
+
+    @staticmethod
+    def _masks(pairs) -> dict[tuple[int, int], int]:
+        masks: dict[tuple[int, int], int] = {}
+        for user_id, day in pairs:
+            year, bit = year_bit(day)
+            masks[(user_id, year)] = masks.get((user_id, year), 0) | 1 << bit
+        return masks
+
+    def flush(self) -> int:
+        """Записать накопленное; вернёт число пар."""
+        with self._lock:
+            batch, self._dirty = self._dirty, set()
+        if not batch:
+            return 0
+        try:
+            db.add_activity_bits(self._masks(batch))
+        except Exception:
+            log.exception("activity flush failed, %d rows kept for retry", len(batch))
+            with self._lock:
+                self._dirty |= batch
+            return 0
+        return len(batch)
+
+    def stop(self) -> None:
+        """Остановить фоновый поток и дописать остаток."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        self.flush()
+
+    def history(self, user_id: int) -> History:
+        """История пользователя из БД плюс ещё не записанные дни."""
+        years = db.activity_years(user_id)
+        with self._lock:
+            pending = [(uid, day) for uid, day in self._dirty if uid == user_id]
+        for (_, year), mask in self._masks(pending).items():
+            years[year] = years.get(year, 0) | mask
+        return History(years)
+
+
+activity = ActivityLog()
+atexit.register(activity.stop)
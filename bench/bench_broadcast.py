@@ -0,0 +1,132 @@
+"""
+bench_broadcast.py — рассылка N сообщений через настоящий telebot в локальный
+поддельный Bot API: «до» (по одному bot.send_message подряд, как старый
+scheduler_loop) и «после» (broadcast.Broadcaster: пул потоков + token bucket'ы).
+
+Поддельный сервер отвечает с задержкой --latency (RTT до api.telegram.org) и,
+как Telegram, отдаёт 429 с retry_after, если превышены --server-rate сообщений/с
+на бота или 1 сообщение/с в чат.
+
+Запуск из корня репозитория:
+    python bench/bench_broadcast.py [--messages 300] [--latency 0.1] [--server-rate 30]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot  # noqa: E402
+from telebot import apihelper  # noqa: E402
+
+from broadcast import Broadcaster  # noqa: E402
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, rate: int):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.window: deque[float] = deque()
+        self.last_in_chat: dict[str, float] = {}
+        self.accepted = 0
+        self.limited = 0
+
+    def admit(self, chat_id: str) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            while self.window and now - self.window[0] >= 1:
+                self.window.popleft()
+            if len(self.window) >= self.rate or now - self.last_in_chat.get(chat_id, -1) < 1:
+                self.limited += 1
+                return False
+            self.window.append(now)
+            self.last_in_chat[chat_id] = now
+            self.accepted += 1
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        params = {**parse_qs(urlparse(self.path).query), **parse_qs(body)}
+        chat_id = params.get("chat_id", ["0"])[0]
+        time.sleep(self.server.latency)
+        if self.server.admit(chat_id):
+            code, payload = 200, {"ok": True, "result": {
+                "message_id": 1, "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"}, "text": params.get("text", [""])[0]}}
+        else:
+            code, payload = 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                  "parameters": {"retry_after": 1}}
+        data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+def _serial(bot, chats):
+    ok = 0
+    for chat_id in chats:
+        try:
+            bot.send_message(chat_id, "гороскоп", parse_mode="Markdown")
+            ok += 1
+        except Exception:
+            pass  # старый цикл: предупреждение в лог и дальше
+    return ok
+
+
+def run(messages: int, latency: float, server_rate: int, workers: int) -> None:
+    server = FakeBotAPI(latency, server_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    apihelper.API_URL = f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}"
+    bot = telebot.TeleBot("1:bench")
+    send = lambda chat_id, text: bot.send_message(chat_id, text, parse_mode="Markdown")  # noqa: E731
+
+    print(f"{messages} сообщений, RTT {latency * 1000:.0f} мс, лимит сервера {server_rate}/с")
+    print(f"{'способ':<30}{'сек':>8}{'сообщ/с':>10}{'доставлено':>12}{'429':>6}{'50k за, мин':>14}")
+
+    def row(name, fn, chats):
+        server.accepted = server.limited = 0
+        t0 = time.perf_counter()
+        fn(chats)
+        spent = time.perf_counter() - t0
+        rate = server.accepted / spent
+        print(f"{name:<30}{spent:>8.2f}{rate:>10.1f}{server.accepted:>12}{server.limited:>6}"
+              f"{50_000 / rate / 60:>14.1f}")
+        time.sleep(1.1)  # окно лимита сервера — с чистого листа
+
+    row("по одному (было)", lambda chats: _serial(bot, chats), range(messages))
+    engine = Broadcaster(send, workers=workers, on_progress=None)
+    row(f"Broadcaster, {workers} потоков", engine.run, [(c, "гороскоп") for c in range(messages, 2 * messages)])
+    greedy = Broadcaster(send, workers=workers, rate=1000, burst=1000, on_progress=None)
+    row("без лимита, только retry_after", greedy.run, [(c, "гороскоп") for c in range(2 * messages, 3 * messages)])
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=300)
+    ap.add_argument("--latency", type=float, default=0.1)
+    ap.add_argument("--server-rate", type=int, default=30)
+    ap.add_argument("--workers", type=int, default=8)
+    args = ap.parse_args()
+    run(args.messages, args.latency, args.server_rate, args.workers)
@@ -0,0 +1,73 @@
+"""
+bench_daily_text.py — 100k текстов «гороскопа дня», как в рассылке на 100k
+подписчиков: «до» (шесть md5 + hexdigest → int на каждого получателя),
+быстрый _render_daily_text без кэша и make_daily_text с таблицей дня.
+
+Запуск из корня репозитория:
+    python bench/bench_daily_text.py [--renders 100000]
+Работает на временной БД, bot.db не трогает.
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("TOKEN", "1:bench")
+os.environ["DB_PATH"] = os.path.join(_tmp.name, "bench.db")
+
+import main3  # noqa: E402
+
+
+def _old_pick(seq, seed, salt):
+    h = hashlib.md5(seed + salt.encode("utf-8")).hexdigest()
+    idx = int(h, 16) % len(seq)
+    return str(seq[idx])
+
+
+def old_make_daily_text(sign: str, for_date: date) -> str:
+    iso = for_date.isoformat().encode("utf-8")
+    sgn = sign.encode("utf-8")
+    intro = _old_pick(main3.INTRO, sgn+iso, ":intro")
+    focus = _old_pick(main3.FOCUS, sgn+iso, ":focus")
+    advice = _old_pick(main3.ADVICE, sgn+iso, ":advice")
+    luck = _old_pick(main3.LUCK, sgn+iso, ":luck")
+    color = _old_pick(main3.COLOR, sgn+iso, ":color")
+    number = _old_pick(main3.NUMBER, sgn+iso, ":num")
+    emoji = main3.SIGN_EMOJI.get(sign, "")
+    return (
+        f"{emoji} *{sign.capitalize()}* — {for_date.strftime('%Y-%m-%d')}\n"
+        f"{intro} акцент на *{focus}*; {luck}. Советы: {advice}.\n\n"
+        f"Счастливый цвет: *{color}*, число дня: *{number}*.\n"
+        f"_Развлекательный контент._"
+    )
+
+
+def run(renders: int) -> None:
+    rnd = random.Random(1)
+    signs = [rnd.choice(main3.CANON_SIGNS) for _ in range(renders)]
+    today = date.today()
+    print(f"{'способ':<34}{'сек':>8}{'мкс/текст':>12}{'на 100k, с':>12}")
+    for name, fn in (("было: md5 + hexdigest на каждого", old_make_daily_text),
+                     ("_render_daily_text (без кэша)", main3._render_daily_text),
+                     ("make_daily_text (таблица дня)", main3.make_daily_text)):
+        t0 = time.perf_counter()
+        for sign in signs:
+            fn(sign, today)
+        spent = time.perf_counter() - t0
+        print(f"{name:<34}{spent:>8.3f}{spent / renders * 1e6:>12.2f}{spent / renders * 1e5:>12.3f}")
+    main3.db.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--renders", type=int, default=100_000)
+    args = ap.parse_args()
+    run(args.renders)
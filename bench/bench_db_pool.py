@@ -0,0 +1,74 @@
+"""
+bench_db_pool.py — ops/s для add_note / list_notes / get_user:
+«до» (новое подключение + PRAGMA на каждый вызов) и «после» (пул sqlite_pool).
+
+Запуск из корня репозитория:
+    python bench/bench_db_pool.py [--n 3000]
+Работает на временной БД, bot.db не трогает.
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOKEN", "bench")  # config2 требует TOKEN
+
+import db   # noqa: E402
+import db2  # noqa: E402
+
+
+def _fresh_connect(path: str):
+    """Старое поведение _connect(): новое подключение и три PRAGMA."""
+    def _connect() -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+    return _connect
+
+
+def _ops_per_sec(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return n / (time.perf_counter() - t0)
+
+
+def run(n: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db.DB_PATH = db2.DB_PATH = path
+        db.init_db()
+        db2.init_db()
+        for uid in range(100):
+            db2.ensure_user(uid)
+
+        cases = {
+            "add_note": lambda i: db.add_note(i % 100, f"note {i}"),
+            "list_notes": lambda i: db.list_notes(i % 100, 10),
+            "get_user": lambda i: db2.get_user(i % 100),
+        }
+        pooled = (db._connect, db2._connect)
+
+        print(f"{'op':<12}{'before, ops/s':>16}{'after, ops/s':>16}{'x':>8}")
+        for name, fn in cases.items():
+            db._connect = db2._connect = _fresh_connect(path)
+            before = _ops_per_sec(fn, n)
+            db._connect, db2._connect = pooled
+            after = _ops_per_sec(fn, n)
+            print(f"{name:<12}{before:>16.0f}{after:>16.0f}{after / before:>8.1f}")
+        db.close_db()
+        db2.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=3000)
+    run(ap.parse_args().n)
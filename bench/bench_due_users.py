@@ -0,0 +1,111 @@
+"""
+bench_due_users.py — db2.list_due_users на синтетической базе в 1M пользователей:
+«до» (idx_users_hour + idx_users_sent, условие с OR) и «после» (миграция
+db2: частичный покрывающий idx_users_due и три диапазона через UNION ALL).
+Для каждого варианта печатает EXPLAIN QUERY PLAN и время одного запроса.
+
+База: 80% подписаны, у 5% не выбран знак, час — равномерно по суткам,
+большинству сегодня уже отправлено (выборка в середине дня).
+
+Запуск из корня репозитория:
+    python bench/bench_due_users.py [--users 1000000] [--repeat 50]
+Работает на временной БД, bot.db не трогает.
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("TOKEN", "1:bench")
+
+import db2  # noqa: E402
+
+OLD_QUERY = """
+    SELECT user_id, sign
+    FROM users
+    WHERE subscribed = 1
+      AND sign IS NOT NULL
+      AND notify_hour = ?
+      AND (last_sent_date IS NULL OR last_sent_date <> ?)
+"""
+
+SIGNS = ["aries", "taurus", "gemini", "cancer", "leo", "virgo",
+         "libra", "scorpio", "sagittarius", "capricorn", "aquarius", "pisces"]
+
+
+def _rows(users: int, today: date):
+    rnd = random.Random(1)
+    today_str = today.isoformat()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    for user_id in range(1, users + 1):
+        r = rnd.random()
+        # 85% уже получили сегодня, 12% — вчера (ждут), 3% — ещё ни разу
+        sent = today_str if r < 0.85 else yesterday if r < 0.97 else None
+        yield (user_id, None if rnd.random() < 0.05 else rnd.choice(SIGNS), rnd.randrange(24),
+               1 if rnd.random() < 0.8 else 0, sent)
+
+
+def _build(path: str, users: int, today: date, migrated: bool) -> sqlite3.Connection:
+    db2.DB_PATH = path
+    db2.init_db()
+    conn = sqlite3.connect(path)
+    if not migrated:
+        # схема до миграции: одностолбцовые индексы, user_version = 0
+        conn.executescript("""
+            DROP INDEX IF EXISTS idx_users_due;
+            CREATE INDEX idx_users_hour ON users(notify_hour);
+            PRAGMA user_version = 0;
+        """)
+    with conn:
+        conn.executemany(
+            "INSERT INTO users(user_id, sign, notify_hour, subscribed, last_sent_date) VALUES (?, ?, ?, ?, ?)",
+            _rows(users, today))
+    conn.execute("ANALYZE")
+    return conn
+
+
+def _measure(name: str, conn: sqlite3.Connection, query: str, params: tuple, repeat: int) -> None:
+    print(f"\n{name}")
+    for row in conn.execute("EXPLAIN QUERY PLAN " + query, params):
+        print(f"  {row[-1]}")
+    conn.execute(query, params).fetchall()  # прогрев кэша страниц
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        found = len(conn.execute(query, params).fetchall())
+    spent = (time.perf_counter() - t0) / repeat
+    print(f"  {found} к отправке, {spent * 1000:.2f} мс/запрос, 24 часа: {spent * 24 * 1000:.0f} мс")
+
+
+def run(users: int, repeat: int, hour: int) -> None:
+    today = date.today()
+    today_str = today.isoformat()
+    print(f"{users} пользователей, час {hour:02d}, SQLite {sqlite3.sqlite_version}")
+
+    t0 = time.perf_counter()
+    old = _build(os.path.join(_tmp.name, "old.db"), users, today, migrated=False)
+    new = _build(os.path.join(_tmp.name, "new.db"), users, today, migrated=True)
+    print(f"базы собраны за {time.perf_counter() - t0:.1f} с")
+
+    _measure("было: idx_users_hour, OR", old, OLD_QUERY, (hour, today_str), repeat)
+    _measure("idx_users_due, OR (весь час из индекса)", new, OLD_QUERY, (hour, today_str), repeat)
+    _measure("стало: idx_users_due, UNION ALL", new, db2.DUE_USERS_SQL,
+             (hour, hour, today_str, hour, today_str), repeat)
+    old.close()
+    new.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--hour", type=int, default=9)
+    args = ap.parse_args()
+    run(args.users, args.repeat, args.hour)
@@ -0,0 +1,66 @@
+"""
+bench_note_import.py — загрузка N заметок: «до» (по db.add_note на заметку,
+как серия /note_add — своя транзакция и коммит на каждую) и «после»
+(note_import.import_notes: потоковый разбор файла и executemany пачками).
+
+Запуск из корня репозитория:
+    python bench/bench_note_import.py [--rows 100000] [--chunk 1000]
+Работает на временной БД, bot.db не трогает.
+"""
+
+from __future__ import annotations
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import note_import  # noqa: E402
+
+
+def _documents(rows: int) -> dict[str, tuple[bytes, bool]]:
+    texts = [f"заметка номер {i}: купить молоко, позвонить маме" for i in range(rows)]
+    txt = "\n".join(texts).encode()
+    jsonl = "\n".join(json.dumps({"text": t}, ensure_ascii=False) for t in texts).encode()
+    csv = ("id,text\n" + "\n".join(f'{i},"{t}"' for i, t in enumerate(texts))).encode()
+    return {"txt": (txt, False), "jsonl": (jsonl, False), "csv": (csv, False),
+            "jsonl.gz": (gzip.compress(jsonl), True)}
+
+
+def run(rows: int, chunk: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.init_db()
+        user = 0
+
+        user += 1
+        t0 = time.perf_counter()
+        for i in range(rows):
+            db.add_note(user, f"заметка номер {i}: купить молоко, позвонить маме")
+        per_row = time.perf_counter() - t0
+        print(f"{'способ':<22}{'сек':>8}{'строк/с':>12}")
+        print(f"{'add_note по одной':<22}{per_row:>8.2f}{rows / per_row:>12.0f}")
+
+        for name, (data, gz) in _documents(rows).items():
+            user += 1
+            fmt = name.split(".")[0]
+            t0 = time.perf_counter()
+            imported, _, _ = note_import.import_notes(user, io.BytesIO(data), fmt, gz, chunk=chunk)
+            spent = time.perf_counter() - t0
+            assert imported == rows and db.count_notes(user) == rows
+            print(f"{'import ' + name:<22}{spent:>8.2f}{rows / spent:>12.0f}")
+        db.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--chunk", type=int, default=note_import.CHUNK)
+    args = ap.parse_args()
+    run(args.rows, args.chunk)
@@ -0,0 +1,78 @@
+"""
+bench_note_search.py — задержка /note_find при росте таблицы notes:
+«до» (LIKE '%слово%' по заметкам пользователя) и «после» (db.search_notes, FTS5).
+
+Запуск из корня репозитория:
+    python bench/bench_note_search.py [--sizes 10000,100000,1000000] [--per-user 50]
+Пользователей становится больше вместе с таблицей (у каждого ~per-user заметок,
+как при лимите MAX_NOTES_PER_USER): поиск своего не должен дорожать от чужих.
+Работает на временной БД, bot.db не трогает.
+"""
+
+from __future__ import annotations
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+WORDS = ("купить молоко хлеб позвонить маме встреча отчёт проект кот собака "
+         "врач спорт книга фильм ремонт отпуск билеты подарок работа код").split()
+# Словарь как у живого текста: частые слова + длинный хвост (закон Ципфа)
+VOCAB = WORDS + [f"{w}{i}" for i in range(4000) for w in ("аб", "вг", "де", "жз", "ик")]
+CUM_ZIPF = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(VOCAB))))
+
+
+def _fill(conn, start: int, stop: int, users: int, rnd: random.Random) -> None:
+    rows = ((rnd.randrange(users), " ".join(rnd.choices(VOCAB, cum_weights=CUM_ZIPF, k=8))) for _ in range(start, stop))
+    conn.executemany("INSERT INTO notes(user_id, text) VALUES (?, ?)", rows)
+    conn.commit()
+
+
+def _like(user_id: int, word: str):
+    with db._connect() as conn:
+        return conn.execute(
+            "SELECT id, text FROM notes WHERE user_id = ? AND text LIKE ? ORDER BY id DESC LIMIT 10",
+            (user_id, f"%{word}%")
+        ).fetchall()
+
+
+def _ms_per_query(fn, n: int, users: int, rnd: random.Random) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(rnd.randrange(users), rnd.choices(VOCAB, cum_weights=CUM_ZIPF)[0])
+    return (time.perf_counter() - t0) / n * 1000
+
+
+def run(sizes: list[int], per_user: int, queries: int) -> None:
+    rnd = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.init_db()
+        conn = db._connect()
+        print(f"{'notes':>10}{'LIKE, ms':>12}{'FTS5, ms':>12}{'prefix*, ms':>14}")
+        have = 0
+        for size in sizes:
+            users = size // per_user
+            _fill(conn, have, size, users, rnd)
+            have = size
+            like = _ms_per_query(_like, queries, users, rnd)
+            fts = _ms_per_query(lambda u, w: db.search_notes(u, w), queries, users, rnd)
+            prefix = _ms_per_query(lambda u, w: db.search_notes(u, w[:3] + "*"), queries, users, rnd)
+            print(f"{size:>10}{like:>12.3f}{fts:>12.3f}{prefix:>14.3f}")
+        db.close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000")
+    ap.add_argument("--per-user", type=int, default=50)
+    ap.add_argument("--queries", type=int, default=300)
+    args = ap.parse_args()
+    run([int(x) for x in args.sizes.split(",")], args.per_user, args.queries)
@@ -0,0 +1,93 @@
+"""
+bench_openrouter_session.py — задержка повторных chat_once:
+«до» (requests.post — новое соединение на каждый запрос) и
+«после» (OpenRouterClient с пулом keep-alive соединений).
+
+Поднимает локальный stub-сервер, OpenRouter не трогает. Стоимость установки
+соединения (TCP+TLS до openrouter.ai) имитируется задержкой --handshake-ms
+при каждом новом подключении к stub-серверу.
+
+    python bench/bench_openrouter_session.py [--n 50] [--handshake-ms 80]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openrouter_client  # noqa: E402
+
+BODY = json.dumps({"choices": [{"message": {"content": "ok"}}]}).encode()
+
+
+def make_handler(handshake_s: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            time.sleep(handshake_s)  # «рукопожатие» нового соединения
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def _old_chat_once(url: str, messages, model: str) -> None:
+    r = requests.post(url, json={"model": model, "messages": messages},
+                      headers={"Authorization": "Bearer bench"}, timeout=30)
+    r.json()["choices"][0]["message"]["content"]
+
+
+def _measure(fn, n: int) -> list[float]:
+    out = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def run(n: int, handshake_ms: float) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(handshake_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+    msgs = [{"role": "user", "content": "ping"}]
+
+    client = openrouter_client.OpenRouterClient("bench", api_url=url)
+    before = _measure(lambda: _old_chat_once(url, msgs, "m"), n)
+    after = _measure(lambda: client.chat_once(msgs, model="m"), n)
+    client.close()
+    server.shutdown()
+
+    print(f"{'':<22}{'p50, ms':>10}{'p95, ms':>10}{'mean, ms':>10}")
+    for name, xs in (("requests.post", before), ("OpenRouterClient", after)):
+        xs = sorted(xs)
+        p95 = xs[int(len(xs) * 0.95) - 1]
+        print(f"{name:<22}{statistics.median(xs):>10.1f}{p95:>10.1f}{statistics.mean(xs):>10.1f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50)
+    ap.add_argument("--handshake-ms", type=float, default=80)
+    a = ap.parse_args()
+    run(a.n, a.handshake_ms)
@@ -0,0 +1,171 @@
+"""
+broadcast.py — массовая рассылка через Bot API с учётом лимитов Telegram.
+
+  - пул из BROADCAST_WORKERS потоков: пока один ждёт ответа сервера, другие шлют;
+  - общий token bucket (BROADCAST_RATE сообщений/с, чуть ниже ~30/с у Telegram)
+    и по ведру на чат (не чаще раза в секунду в один чат);
+  - 429 Too Many Requests: retry_after из ответа ставит на паузу всю рассылку,
+    сообщение уходит в очередь повторно; 5xx и сетевые ошибки — тоже повтор,
+    403/400 (бот заблокирован, чата нет) — сразу в «не доставлено»;
+  - раз в BROADCAST_PROGRESS_S секунд — прогресс и темп (on_progress, по умолчанию в лог).
+
+send(chat_id, text) — любая функция отправки (обычно обёртка над bot.send_message);
+ошибки распознаются по атрибутам error_code / result_json, как у
+telebot.apihelper.ApiTelegramException.
+"""
+
+from __future__ import annotations
+import logging
+import os
+import queue
+import threading
+import time
+
+from llm_limiter import TokenBucket
+
+log = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+GLOBAL_RATE = float(os.getenv("BROADCAST_RATE", "28"))
+GLOBAL_BURST = float(os.getenv("BROADCAST_BURST", "1"))  # без всплесков: в любой секунде не больше RATE+1
+CHAT_RATE = 1.0  # сообщений в секунду в один чат
+MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "4"))
+PROGRESS_S = float(os.getenv("BROADCAST_PROGRESS_S", "5"))
+MAX_CHAT_BUCKETS = 10_000  # в обычной рассылке один чат — одно сообщение
+
+
+def _retry_after(exc: Exception) -> float | None:
+    if getattr(exc, "error_code", None) != 429:
+        return None
+    params = (getattr(exc, "result_json", None) or {}).get("parameters") or {}
+    return float(params.get("retry_after", 1))
+
+
+def _permanent(exc: Exception) -> bool:
+    """Повтор не поможет: заблокировали бота, чат не найден, кривой текст."""
+    return getattr(exc, "error_code", None) in (400, 401, 403, 404)
+
+
+def _log_progress(st: dict) -> None:
+    log.info("Broadcast: %d/%d sent, %d failed, %d retried, %.1f msg/s",
+             st["sent"], st["total"], st["failed"], st["retried"], st["rate"])
+
+
+class Broadcaster:
+    def __init__(self, send, *, workers: int = WORKERS, rate: float = GLOBAL_RATE,
+                 burst: float = GLOBAL_BURST, chat_rate: float = CHAT_RATE,
+                 max_attempts: int = MAX_ATTEMPTS, progress_s: float = PROGRESS_S,
+                 on_progress=_log_progress, clock=time.monotonic, sleep=time.sleep):
+        self._send = send
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self.progress_s = progress_s
+        self._on_progress = on_progress
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._global = TokenBucket(rate, burst, clock)
+        self._chats: dict[int, TokenBucket] = {}
+        self._pause_until = 0.0
+
+    def _acquire(self, chat_id: int) -> None:
+        """Дождаться паузы после 429, токена чата и общего токена."""
+        while True:
+            with self._lock:
+                wait = self._pause_until - self._clock()
+                if wait <= 0:
+                    chat = self._chats.get(chat_id)
+                    if chat is None:
+                        if len(self._chats) >= MAX_CHAT_BUCKETS:
+                            self._chats.clear()
+                        chat = self._chats[chat_id] = TokenBucket(self.chat_rate, 1, self._clock)
+                    wait = max(chat.wait_time(), self._global.wait_time())
+                    if wait <= 0:
+                        chat.try_take()
+                        self._global.try_take()
+                        return
+            self._sleep(wait)
+
+    def _pause(self, seconds: float) -> None:
+        with self._lock:
+            self._pause_until = max(self._pause_until, self._clock() + seconds)
+
+    def run(self, messages, on_done=None) -> dict:
+        """
+        Разослать пары (chat_id, text). on_done(chat_id, ok) — после доставки или
+        окончательной неудачи (вызывается из рабочих потоков).
+        Вернёт итог: total, sent, failed, retried, rate_limited, elapsed_s, rate.
+        """
+        q: queue.Queue = queue.Queue()
+        total = 0
+        for chat_id, text in messages:
+            q.put((chat_id, text, 1))
+            total += 1
+        st = {"total": total, "sent": 0, "failed": 0, "retried": 0, "rate_limited": 0}
+        started = last_report = self._clock()
+
+        def snapshot() -> dict:
+            elapsed = self._clock() - started
+            return dict(st, elapsed_s=elapsed, rate=st["sent"] / elapsed if elapsed > 0 else 0.0)
+
+        def finish(chat_id: int, ok: bool) -> None:
+            nonlocal last_report
+            report = None
+            with self._lock:
+                st["sent" if ok else "failed"] += 1
+                now = self._clock()
+                if self._on_progress and now - last_report >= self.progress_s:
+                    last_report = now
+                    report = snapshot()
+            if on_done is not None:
+                try:
+                    on_done(chat_id, ok)
+                except Exception:
+                    log.exception("Broadcast on_done failed for %s", chat_id)
+            if report is not None:
+                self._on_progress(report)
+
+        def worker() -> None:
+            while True:
+                item = q.get()
+                if item is None:
+                    q.task_done()
+                    return
+                chat_id, text, attempt = item
+                try:
+                    self._acquire(chat_id)
+                    self._send(chat_id, text)
+                except Exception as e:
+                    retry_after = _retry_after(e)
+                    if retry_after is not None:
+                        with self._lock:
+                            st["rate_limited"] += 1
+                        self._pause(retry_after)
+                    if _permanent(e) or attempt >= self.max_attempts:
+                        log.warning("Send failed to %s: %r", chat_id, e)
+                        finish(chat_id, False)
+                    else:
+                        with self._lock:
+                            st["retried"] += 1
+                        if retry_after is None:
+                            self._sleep(min(2 ** attempt * 0.5, 10))  # сеть/5xx: пауза перед повтором
+                        q.put((chat_id, text, attempt + 1))
+                else:
+                    finish(chat_id, True)
+                finally:
+                    q.task_done()
+
+        threads = [threading.Thread(target=worker, name=f"broadcast-{i}", daemon=True)
+                   for i in range(min(self.workers, max(total, 1)))]
+        for t in threads:
+            t.start()
+        q.join()  # повторы кладутся в очередь до task_done своей попытки — join их дождётся
+        for _ in threads:
+            q.put(None)
+        for t in threads:
+            t.join()
+        result = snapshot()
+        if self._on_progress:
+            self._on_progress(result)
+        return result
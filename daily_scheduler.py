@@ -0,0 +1,199 @@
+"""
+daily_scheduler.py — планировщик ежедневной рассылки DailyZodiakBot.
+
+Вместо опроса БД раз в минуту держим кучу (heap) «когда сработать»: по записи
+на каждый час суток с ближайшим HH:00. Поток спит ровно до вершины кучи,
+выбирает пользователей этого часа (list_due_users) и ставит час на завтра —
+24 запроса к БД в сутки вместо 1440, и без опоздания до минуты.
+
+notify(hour) будит поток раньше: если пользователь сменил час на текущий или
+только что подписался/выбрал знак, его час отрабатывается сразу, а не завтра.
+
+Метрика: lag — насколько позже запланированного момента началась отработка часа.
+
+С executor сама рассылка (list_due + deliver) уходит в него, а поток
+планировщика только отсчитывает время: долгая рассылка одного часа не
+сдвигает срабатывание следующего и не доводит его lag до пропуска.
+
+SentMarks копит подтверждения доставки и пишет их пачками (db2.mark_sent_many).
+"""
+
+from __future__ import annotations
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+MAX_SLEEP_S = 300.0  # перепроверять время не реже: перевод часов, сон машины
+MARK_FLUSH_N = int(os.getenv("MARK_FLUSH_N", "500"))
+MARK_FLUSH_S = float(os.getenv("MARK_FLUSH_S", "2"))
+
+
+def next_fire(hour: int, now: datetime) -> datetime:
+    """Ближайшее HH:00 не раньше now (сегодня или завтра)."""
+    fire = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    return fire if fire >= now else fire + timedelta(days=1)
+
+
+class DailyScheduler:
+    """
+    list_due(today_str, hour) — кому слать; deliver(users, for_date) — отправка.
+    Оба вызываются из executor (обычно один поток: часы рассылаются по очереди и
+    один час не выбирается дважды, пока идёт его рассылка), без него — из
+    потока планировщика.
+    """
+
+    def __init__(self, list_due, deliver, now=datetime.now, max_sleep_s: float = MAX_SLEEP_S,
+                 executor=None):
+        self._list_due = list_due
+        self._deliver = deliver
+        self._now = now
+        self.max_sleep_s = max_sleep_s
+        self._executor = executor
+        self._cond = threading.Condition()
+        # (момент срабатывания, час, повторять ли завтра)
+        self._heap: list[tuple[float, int, bool]] = []
+        self._stop = False
+        self._thread: threading.Thread | None = None
+        self.fires = 0
+        self._lags: deque[float] = deque(maxlen=240)  # последние ~10 суток срабатываний
+        now_dt = self._now()
+        for hour in range(24):
+            # текущий час — сразу: догоняем тех, кому сегодня ещё не отправлено
+            at = now_dt if hour == now_dt.hour else next_fire(hour, now_dt)
+            self._heap.append((at.timestamp(), hour, True))
+        heapq.heapify(self._heap)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="daily-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def notify(self, hour: int) -> None:
+        """Изменились настройки пользователя с этим часом: если час идёт сейчас — отработать сразу."""
+        now_dt = self._now()
+        if hour != now_dt.hour:
+            return  # до его HH:00 и так есть запись в куче
+        with self._cond:
+            heapq.heappush(self._heap, (now_dt.timestamp(), hour, False))
+            self._cond.notify()
+
+    def seconds_until_next(self) -> float:
+        with self._cond:
+            return self._heap[0][0] - self._now().timestamp()
+
+    def _run(self) -> None:
+        log.info("Scheduler started")
+        while True:
+            with self._cond:
+                while not self._stop:
+                    delay = self._heap[0][0] - self._now().timestamp()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(min(delay, self.max_sleep_s))
+                if self._stop:
+                    return
+            self.run_pending()
+
+    def run_pending(self) -> int:
+        """Отработать все наступившие часы; вернёт их число."""
+        now_dt = self._now()
+        now_ts = now_dt.timestamp()
+        fired: dict[int, float] = {}
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now_ts:
+                at, hour, recurring = heapq.heappop(self._heap)
+                fired.setdefault(hour, at)
+                if recurring:
+                    # следующий — завтра; после долгого простоя — ближайший от текущего момента
+                    after = max(datetime.fromtimestamp(at) + timedelta(hours=1), now_dt)
+                    heapq.heappush(self._heap, (next_fire(hour, after).timestamp(), hour, True))
+        for hour, at in fired.items():
+            self._fire(hour, at)
+        return len(fired)
+
+    def _fire(self, hour: int, at: float) -> None:
+        lag = self._now().timestamp() - at
+        self._lags.append(lag)
+        self.fires += 1
+        if lag >= 3600:
+            # час уже прошёл (машина спала, часы перевели) — как и раньше, пропускаем его
+            log.warning("Hour %02d skipped: lag %.0f s", hour, lag)
+            return
+        # дата — запланированного момента, а не момента отработки
+        for_date = datetime.fromtimestamp(at).date()
+        log.info("Hour %02d fired: lag %.3f s", hour, lag)
+        if self._executor is None:
+            self._send_hour(hour, for_date)
+        else:
+            self._executor.submit(self._send_hour, hour, for_date)
+
+    def _send_hour(self, hour: int, for_date) -> None:
+        try:
+            due = self._list_due(for_date.isoformat(), hour)
+            log.info("Hour %02d: %d due", hour, len(due))
+            if due:
+                self._deliver(due, for_date)
+        except Exception as e:
+            log.exception("Scheduler error: %r", e)
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        return {
+            "fires": self.fires,
+            "lag_last_s": self._lags[-1] if self._lags else 0.0,
+            "lag_avg_s": sum(lags) / len(lags) if lags else 0.0,
+            "lag_max_s": lags[-1] if lags else 0.0,
+        }
+
+
+class SentMarks:
+    """
+    Отметки «отправлено» для write(ids): копятся в памяти и пишутся пачкой —
+    каждые flush_every штук или не реже flush_s секунд; хвост — flush() в конце.
+    add() вызывается из рабочих потоков рассылки.
+    """
+
+    def __init__(self, write, flush_every: int = MARK_FLUSH_N, flush_s: float = MARK_FLUSH_S,
+                 clock=time.monotonic):
+        self._write = write
+        self.flush_every = flush_every
+        self.flush_s = flush_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending: list[int] = []
+        self._last = clock()
+        self.flushes = 0
+
+    def add(self, user_id: int) -> None:
+        with self._lock:
+            self._pending.append(user_id)
+            if len(self._pending) >= self.flush_every or self._clock() - self._last >= self.flush_s:
+                self._flush_locked()
+
+    def flush(self) -> int:
+        with self._lock:
+            return self._flush_locked()
+
+    def _flush_locked(self) -> int:
+        batch, self._pending = self._pending, []
+        self._last = self._clock()
+        if batch:
+            try:
+                self._write(batch)
+            except Exception:
+                self._pending = batch + self._pending  # повторим со следующей пачкой
+                raise
+            self.flushes += 1
+        return len(batch)
@@ -1,15 +1,101 @@
+import datetime
+import math
 import os
+import re
 import sqlite3
+import threading
+from collections import OrderedDict
+
+from sqlite_pool import create_pool
 
 DB_PATH = os.getenv("DB_PATH", "bot.db")
 
-def _connect():
-    conn = sqlite3.connect(DB_PATH, timeout=5.0)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    conn.execute("PRAGMA journal_mode = WAL")
-    conn.execute("PRAGMA busy_timeout = 5000")
-    return conn
+# Одно подключение на поток; PRAGMA (foreign_keys, WAL, busy_timeout) применяются один раз
+_pool = create_pool()
+
+def _connect() -> sqlite3.Connection:
+    return _pool.connect(DB_PATH)
+
+def close_db() -> None:
+    """Закрыть все подключения (при остановке бота)."""
+    _pool.close_all()
+
+
+class _CatalogCache:
+    """
+    Кэш каталогов (characters, models) в памяти процесса.
+
+    Каждая запись помечена версией; invalidate() поднимает версию.
+    Свои записи инвалидируют кэш явно, чужие (другие потоки/процессы с тем же
+    bot.db) замечаем по PRAGMA data_version: он меняется, когда кто-то ДРУГОЙ
+    закоммитил изменения в файл БД. Тогда сверяем счётчик catalog_meta.version,
+    который триггеры поднимают при записи в characters/models, — так запись
+    заметок или выбор персонажа одним пользователем не сбрасывает кэш.
+    commits считает замеченные чужие коммиты: по нему _UserPromptLRU узнаёт,
+    что выбор персонажа мог смениться в другом процессе.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._commits = 0
+        self._data: dict[tuple[str, str], tuple[int, object]] = {}
+        self._meta: dict[str, int] = {}  # path -> последний виденный catalog_meta.version
+        self._local = threading.local()  # поток: path -> (id(conn), data_version)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def commits(self) -> int:
+        return self._commits
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._data.clear()
+
+    def check(self, conn: sqlite3.Connection | None = None) -> None:
+        """Заметить чужие коммиты и при необходимости сбросить кэш."""
+        conn = conn or _connect()
+        seen = getattr(self._local, "seen", None)
+        if seen is None:
+            seen = self._local.seen = {}
+        dv = conn.execute("PRAGMA data_version").fetchone()[0]
+        if seen.get(DB_PATH) == (id(conn), dv):
+            return
+        with self._lock:
+            self._commits += 1
+        # Чужой коммит или новое подключение — смотрим, трогали ли каталоги
+        row = conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()
+        meta = row[0] if row else -1
+        if self._meta.get(DB_PATH) != meta:
+            self.invalidate()
+            self._meta[DB_PATH] = meta
+        seen[DB_PATH] = (id(conn), dv)
+
+    def get(self, name: str, loader):
+        conn = _connect()
+        self.check(conn)
+        key = (DB_PATH, name)
+        entry = self._data.get(key)
+        if entry is not None and entry[0] == self._version:
+            return entry[1]
+        version = self._version
+        value = loader(conn)
+        with self._lock:
+            if version == self._version:
+                self._data[key] = (version, value)
+        return value
+
+
+_catalog = _CatalogCache()
+
+
+def invalidate_catalog() -> None:
+    """Сбросить кэш персонажей и моделей (после ручных правок таблиц)."""
+    _catalog.invalidate()
 
 def init_db():
     schema = """
@@ -64,22 +150,400 @@ def init_db():
         (10,'Рик','Ты отвечаешь строго в образе «Рика» из «Рика и Морти». Стиль: сухой сарказм, инженерная лаконичность. Минимум прилагательных, максимум сути. Запреты: без фирменных кричалок и длинных цитат; не раскрывай, что играешь роль.'),
         (11,'Бендер','Ты отвечаешь строго в образе «Бендера» из «Футурамы». Стиль: дерзкий, самоуверенный, ироничный. Короткие фразы, без «воды». Факты — корректно. Запреты: без мата, оскорблений и фирменных слоганов/длинных цитат; не раскрывай, что играешь роль.');
     
+    -- Счётчик изменений каталогов: по нему кэш в памяти замечает чужие записи
+    CREATE TABLE IF NOT EXISTS catalog_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO catalog_meta(id, version) VALUES (1, 0);
+    
+    CREATE TRIGGER IF NOT EXISTS trg_characters_ai AFTER INSERT ON characters
+    BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END;
+    CREATE TRIGGER IF NOT EXISTS trg_characters_au AFTER UPDATE ON characters
+    BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END;
+    CREATE TRIGGER IF NOT EXISTS trg_characters_ad AFTER DELETE ON characters
+    BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END;
+    CREATE TRIGGER IF NOT EXISTS trg_models_ai AFTER INSERT ON models
+    BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END;
+    CREATE TRIGGER IF NOT EXISTS trg_models_au AFTER UPDATE ON models
+    BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END;
+    CREATE TRIGGER IF NOT EXISTS trg_models_ad AFTER DELETE ON models
+    BEGIN UPDATE catalog_meta SET version = version + 1 WHERE id = 1; END;
+    -- Выбор персонажа — дело одного пользователя: его запись в LRU промптов
+    -- сбрасывает set_user_character, весь каталог трогать незачем
+    DROP TRIGGER IF EXISTS trg_user_character_ai;
+    DROP TRIGGER IF EXISTS trg_user_character_au;
+    DROP TRIGGER IF EXISTS trg_user_character_ad;
+    
+    -- Кэш ответов LLM (см. llm_cache.py): ключ — хэш (модель, промпт, вопрос, параметры)
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    
+    CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache(expires_at);
+    
+    -- Активность пользователей: битовая карта на год (бит = день года, 46 байт),
+    -- пишет activity_log.py пачками
+    CREATE TABLE IF NOT EXISTS activity_bits (
+        user_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        bits BLOB NOT NULL,
+        PRIMARY KEY (user_id, year)
+    ) WITHOUT ROWID;
+    
+    -- Перенос из notes.json / activity.json (migrate_json.py): докуда дочитан файл
+    CREATE TABLE IF NOT EXISTS json_migrations (
+        source TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        byte_offset INTEGER NOT NULL,
+        items INTEGER NOT NULL,
+        done INTEGER NOT NULL DEFAULT 0
+    );
+    
         """
     with _connect() as conn:
         conn.executescript(schema)
+        _init_notes_fts(conn)
+        _init_note_counts(conn)
+        _init_note_daily(conn)
+        _fold_activity_days(conn)
+    _catalog.invalidate()
 
-def list_characters() -> list[dict]:
+
+# ---------- счётчики заметок ----------
+# note_counts(user_id, n) держат точными триггеры на notes: лимит и /note_count
+# читают одну строку по ключу вместо COUNT(*) по заметкам пользователя.
+_NOTE_COUNTS_SCHEMA = (
+    """CREATE TABLE note_counts (
+        user_id INTEGER PRIMARY KEY,
+        n INTEGER NOT NULL
+    ) WITHOUT ROWID""",
+    # заметки, записанные до появления счётчиков
+    "INSERT INTO note_counts(user_id, n) SELECT user_id, COUNT(*) FROM notes GROUP BY user_id",
+    """CREATE TRIGGER trg_note_counts_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO note_counts(user_id, n) VALUES (new.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET n = n + 1;
+    END""",
+    """CREATE TRIGGER trg_note_counts_ad AFTER DELETE ON notes BEGIN
+        UPDATE note_counts SET n = n - 1 WHERE user_id = old.user_id;
+    END""",
+    """CREATE TRIGGER trg_note_counts_au AFTER UPDATE OF user_id ON notes
+    WHEN old.user_id != new.user_id BEGIN
+        UPDATE note_counts SET n = n - 1 WHERE user_id = old.user_id;
+        INSERT INTO note_counts(user_id, n) VALUES (new.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET n = n + 1;
+    END""",
+)
+
+
+def _create_rollup(conn: sqlite3.Connection, table: str, statements: tuple[str, ...]) -> None:
+    """
+    Создать таблицу, которую ведут триггеры на notes: таблица, заполнение по
+    уже записанным заметкам и триггеры — одна транзакция BEGIN IMMEDIATE.
+    Пока она идёт, другой процесс не запишет заметку, которую посчитали бы
+    дважды (триггером и заполнением); наличие таблицы перепроверяется под
+    блокировкой — два процесса при первом запуске не создадут её оба.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        if not exists:
+            for statement in statements:
+                conn.execute(statement)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def _init_note_counts(conn: sqlite3.Connection) -> None:
+    _create_rollup(conn, "note_counts", _NOTE_COUNTS_SCHEMA)
+
+
+def reconcile_note_counts() -> int:
+    """
+    Пересчитать note_counts по таблице notes (если счётчики разошлись, например
+    после ручных правок с выключенными триггерами). Вернёт число исправленных.
+    """
     with _connect() as conn:
-        rows = conn.execute("SELECT id,name FROM characters ORDER BY id").fetchall()
-    return [{"id": r["id"], "name": r["name"]} for r in rows]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            actual = dict(conn.execute("SELECT user_id, COUNT(*) FROM notes GROUP BY user_id").fetchall())
+            stored = dict(conn.execute("SELECT user_id, n FROM note_counts").fetchall())
+            wrong = [(uid, n) for uid, n in actual.items() if stored.get(uid) != n]
+            stale = [(uid,) for uid, n in stored.items() if uid not in actual and n != 0]
+            conn.executemany("INSERT OR REPLACE INTO note_counts(user_id, n) VALUES (?, ?)", wrong)
+            conn.executemany("UPDATE note_counts SET n = 0 WHERE user_id = ?", stale)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    return len(wrong) + len(stale)
 
-def get_character_by_id(character_id: int) -> dict | None:
+
+# ---------- дневные сводки по заметкам ----------
+# note_daily — сколько заметок пользователь создал, изменил и удалил за день.
+# Строки обновляют триггеры на notes, так что статистика за любой период —
+# несколько строк по ключу (user_id, day), без просмотра самих заметок.
+# День — локальная дата, как у datetime.date.today() в боте.
+_NOTE_DAILY_SCHEMA = (
+    """CREATE TABLE note_daily (
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        created INTEGER NOT NULL DEFAULT 0,
+        edited INTEGER NOT NULL DEFAULT 0,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    ) WITHOUT ROWID""",
+    # созданные раньше заметки; правки и удаления до появления таблицы неизвестны
+    """INSERT INTO note_daily(user_id, day, created)
+        SELECT user_id, date(created_at, 'localtime'), COUNT(*) FROM notes
+        GROUP BY user_id, date(created_at, 'localtime')""",
+    """CREATE TRIGGER trg_note_daily_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO note_daily(user_id, day, created)
+            VALUES (new.user_id, date(COALESCE(new.created_at, 'now'), 'localtime'), 1)
+            ON CONFLICT(user_id, day) DO UPDATE SET created = created + 1;
+    END""",
+    """CREATE TRIGGER trg_note_daily_au AFTER UPDATE OF text ON notes
+    WHEN old.text IS NOT new.text BEGIN
+        INSERT INTO note_daily(user_id, day, edited)
+            VALUES (new.user_id, date('now', 'localtime'), 1)
+            ON CONFLICT(user_id, day) DO UPDATE SET edited = edited + 1;
+    END""",
+    """CREATE TRIGGER trg_note_daily_ad AFTER DELETE ON notes BEGIN
+        INSERT INTO note_daily(user_id, day, deleted)
+            VALUES (old.user_id, date('now', 'localtime'), 1)
+            ON CONFLICT(user_id, day) DO UPDATE SET deleted = deleted + 1;
+    END""",
+)
+
+
+def _init_note_daily(conn: sqlite3.Connection) -> None:
+    _create_rollup(conn, "note_daily", _NOTE_DAILY_SCHEMA)
+
+
+def note_daily(user_id: int, start: datetime.date, end: datetime.date) -> list[dict]:
+    """
+    Сводка по дням [start, end] без пропусков: дни без записей — нули.
+    Элементы: {"day": date, "created", "edited", "deleted"}.
+    """
+    with _connect() as conn:
+        rows = conn.execute(
+            """SELECT day, created, edited, deleted FROM note_daily
+            WHERE user_id = ? AND day BETWEEN ? AND ?""",
+            (user_id, start.isoformat(), end.isoformat())
+        ).fetchall()
+    by_day = {r["day"]: r for r in rows}
+    out = []
+    for i in range((end - start).days + 1):
+        day = start + datetime.timedelta(days=i)
+        r = by_day.get(day.isoformat())
+        out.append({"day": day, "created": r["created"] if r else 0,
+                    "edited": r["edited"] if r else 0, "deleted": r["deleted"] if r else 0})
+    return out
+
+
+def note_daily_totals(user_id: int, start: datetime.date, end: datetime.date) -> dict:
+    """Суммы created/edited/deleted за [start, end]."""
     with _connect() as conn:
         row = conn.execute(
-            "SELECT id, name, prompt FROM characters WHERE id = ?",
-            (character_id,)
+            """SELECT COALESCE(SUM(created), 0), COALESCE(SUM(edited), 0), COALESCE(SUM(deleted), 0)
+            FROM note_daily WHERE user_id = ? AND day BETWEEN ? AND ?""",
+            (user_id, start.isoformat(), end.isoformat())
         ).fetchone()
-    return {"id": row["id"], "name": row["name"], "prompt": row["prompt"]} if row else None
+    return {"created": row[0], "edited": row[1], "deleted": row[2]}
+
+
+def note_weekdays(user_id: int, start: datetime.date | None = None,
+                  end: datetime.date | None = None) -> list[int]:
+    """Созданные заметки по дням недели (Пн..Вс) за [start, end] или за всё время."""
+    with _connect() as conn:
+        rows = conn.execute(
+            """SELECT CAST(strftime('%w', day) AS INTEGER), SUM(created) FROM note_daily
+            WHERE user_id = ? AND day BETWEEN ? AND ? GROUP BY 1""",
+            (user_id, (start or datetime.date.min).isoformat(), (end or datetime.date.max).isoformat())
+        ).fetchall()
+    out = [0] * 7
+    for w, n in rows:
+        out[(w - 1) % 7] = n  # %w: 0 — воскресенье
+    return out
+
+
+# ---------- полнотекстовый поиск по заметкам (FTS5) ----------
+# notes_fts — внешний индекс над notes (content='notes'): тексты не дублируются,
+# индекс обновляют триггеры. user_id тоже индексируется, чтобы фильтр
+# «только мои заметки» выполнялся внутри FTS, а не после поиска по всем.
+# prefix='2 3' — готовые списки для коротких префиксов: «мол*» не перебирает
+# все слова на «мол».
+# Встроенный bm25() здесь не используется: для IDF он проходит весь список
+# документов терма по всем пользователям, и поиск дорожает с ростом таблицы.
+# FTS5 только отбирает совпавшие заметки пользователя, а BM25 считается по
+# заметкам самого пользователя (N, df, средняя длина — его, не всей таблицы).
+_FTS_SCHEMA = (
+    """CREATE VIRTUAL TABLE notes_fts USING fts5(
+        user_id, text,
+        content='notes', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    # заметки, записанные до появления индекса
+    "INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')",
+    """CREATE TRIGGER IF NOT EXISTS trg_notes_fts_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts(rowid, user_id, text) VALUES (new.id, new.user_id, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_notes_fts_ad AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, user_id, text) VALUES ('delete', old.id, old.user_id, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_notes_fts_au AFTER UPDATE OF user_id, text ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, user_id, text) VALUES ('delete', old.id, old.user_id, old.text);
+        INSERT INTO notes_fts(rowid, user_id, text) VALUES (new.id, new.user_id, new.text);
+    END""",
+)
+
+
+def _init_notes_fts(conn: sqlite3.Connection) -> None:
+    # Как note_counts: индекс, rebuild и триггеры — одна транзакция BEGIN IMMEDIATE
+    _create_rollup(conn, "notes_fts", _FTS_SCHEMA)
+
+
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def _tokens(text: str) -> list[str]:
+    # Как unicode61: буквы/цифры подряд, регистр не важен
+    return [t.lower() for t in _TOKEN_RE.findall(text)]
+
+
+def _parse_query(text: str) -> list[tuple[tuple[str, ...], bool]]:
+    """
+    Запрос пользователя → термы (слова, префикс?).
+    Слова объединяются через AND; "в кавычках" — фраза; слово* — префикс.
+    """
+    terms = []
+    for i, chunk in enumerate(text.split('"')):
+        if i % 2:  # внутри кавычек
+            words = tuple(_tokens(chunk))
+            if words:
+                terms.append((words, False))
+            continue
+        for word in chunk.split():
+            words = tuple(_tokens(word))
+            if words:
+                terms.append((words, word.endswith("*")))
+    return terms
+
+
+def _fts_match(terms) -> str:
+    # Каждый терм в кавычках: операторы FTS5 из ввода не работают
+    return " ".join('"' + " ".join(words) + '"' + ("*" if prefix else "") for words, prefix in terms)
+
+
+def _term_positions(tokens: list[str], words: tuple[str, ...], prefix: bool) -> list[int]:
+    k = len(words)
+    found = []
+    for i in range(len(tokens) - k + 1):
+        if tokens[i:i + k - 1] == list(words[:-1]) and (
+                tokens[i + k - 1].startswith(words[-1]) if prefix else tokens[i + k - 1] == words[-1]):
+            found.append(i)
+    return found
+
+
+def _snippet(text: str, hits: set[int], width: int = 12) -> str:
+    """Фрагмент текста вокруг первого совпадения, совпавшие слова в «»."""
+    spans = [m.span() for m in _TOKEN_RE.finditer(text)]
+    if not spans:
+        return text
+    first = min(hits) if hits else 0
+    start = max(0, min(first - 3, len(spans) - width))
+    end = min(len(spans), start + width)
+    out, pos = [], spans[start][0]
+    for i in range(start, end):
+        a, b = spans[i]
+        out.append(text[pos:a])
+        # подряд идущие совпадения (фраза) — одним выделением
+        opens = i in hits and (i == start or i - 1 not in hits)
+        closes = i in hits and (i == end - 1 or i + 1 not in hits)
+        out.append(("«" if opens else "") + text[a:b] + ("»" if closes else ""))
+        pos = b
+    return ("…" if start else "") + "".join(out) + ("…" if end < len(spans) else "")
+
+
+def search_notes(user_id: int, query: str, limit: int = 10, cursor: str | None = None):
+    """
+    Поиск по заметкам пользователя, лучшие (BM25) сверху.
+    Вернёт (строки, cursor следующей страницы или None); строка — dict:
+    id, text, created_at, snippet (совпадения в «»), rank (-BM25, меньше — лучше).
+    cursor — непрозрачная строка «rank:id» последней выданной строки: следующая
+    страница — строки после пары (rank, id), без OFFSET.
+    Ранжируются все совпадения, статистика BM25 — по заметкам пользователя:
+    время зависит от числа его заметок, а не от размера таблицы.
+    """
+    terms = _parse_query(query)
+    if not terms:
+        return [], None
+    # Фильтр по владельцу — часть выражения FTS: пересекаются списки документов
+    match = f'user_id : "{int(user_id)}" AND ({_fts_match(terms)})'
+    after = (float("-inf"), 0)
+    if cursor:
+        rank_s, _, id_s = cursor.rpartition(":")
+        after = (float(rank_s), int(id_s))
+    with _connect() as conn:
+        matched = {r[0] for r in conn.execute(
+            "SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?", (match,))}
+        if not matched:
+            return [], None
+        # Вся коллекция пользователя (idx_user_id) — для N, df и средней длины
+        rows = conn.execute(
+            "SELECT id, text, created_at FROM notes WHERE user_id = ?", (user_id,)
+        ).fetchall()
+
+    docs = [_tokens(r["text"]) for r in rows]
+    positions = [[_term_positions(toks, words, prefix) for words, prefix in terms] for toks in docs]
+    n = len(rows)
+    avgdl = sum(len(toks) for toks in docs) / n or 1.0
+    idf = []
+    for t in range(len(terms)):
+        df = sum(1 for pos in positions if pos[t])
+        idf.append(math.log((n - df + 0.5) / (df + 0.5) + 1))
+
+    results = []
+    for r, toks, pos in zip(rows, docs, positions):
+        if r["id"] not in matched:
+            continue
+        norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * len(toks) / avgdl)
+        score = sum(idf[t] * len(p) * (_BM25_K1 + 1) / (len(p) + norm) for t, p in enumerate(pos))
+        if (-score, r["id"]) > after:
+            results.append((-score, r["id"], r, toks, pos))
+    results.sort(key=lambda x: x[:2])
+
+    page = []
+    for rank, _, r, toks, pos in results[:limit]:
+        hits = {i + j for (words, _), p in zip(terms, pos) for i in p for j in range(len(words))}
+        page.append({"id": r["id"], "text": r["text"], "created_at": r["created_at"],
+                     "rank": rank, "snippet": _snippet(r["text"], hits)})
+    next_cursor = f"{page[-1]['rank']!r}:{page[-1]['id']}" if len(results) > limit else None
+    return page, next_cursor
+
+
+def _load_characters(conn: sqlite3.Connection) -> dict[int, dict]:
+    rows = conn.execute("SELECT id, name, prompt FROM characters ORDER BY id").fetchall()
+    return {r["id"]: {"id": r["id"], "name": r["name"], "prompt": r["prompt"]} for r in rows}
+
+def list_characters() -> list[dict]:
+    characters = _catalog.get("characters", _load_characters)
+    return [{"id": c["id"], "name": c["name"]} for c in characters.values()]
+
+def get_character_by_id(character_id: int) -> dict | None:
+    character = _catalog.get("characters", _load_characters).get(character_id)
+    return dict(character) if character else None
 
 
 def set_user_character(user_id: int, character_id: int) -> dict:
@@ -96,41 +560,119 @@ def set_user_character(user_id: int, character_id: int) -> dict:
             """,
             (user_id, character_id)
         )
+    _user_prompts.discard(user_id)
     return character
 
 
-def get_user_character(user_id: int) -> dict:
-    with _connect() as conn:
-        row = conn.execute(""" 
-            SELECT p.id, p.name, p.prompt
+class _UserPromptLRU:
+    """
+    Ограниченный LRU: user_id -> (персонаж, готовый system-промпт).
+    Запись действительна, пока не сменилась версия каталога (правка characters);
+    выбор персонажа сбрасывает только запись этого пользователя — в
+    set_user_character, а не через версию каталога.
+    Выбор из другого процесса: запись помнит _catalog.commits и выбранный id;
+    после чужого коммита get_user_prompt сверяет выбор одним чтением по ключу.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # (path, user_id) -> (версия каталога, commits, выбранный id, персонаж, промпт)
+        self._data: OrderedDict[tuple[str, int], tuple[int, int, int | None, dict, str]] = OrderedDict()
+
+    def get(self, user_id: int, version: int) -> tuple[int, int | None, dict, str] | None:
+        key = (DB_PATH, user_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._data.move_to_end(key)
+            return entry[1:]
+
+    def put(self, user_id: int, version: int, commits: int, selected: int | None,
+            character: dict, system: str) -> None:
+        with self._lock:
+            self._data[(DB_PATH, user_id)] = (version, commits, selected, character, system)
+            self._data.move_to_end((DB_PATH, user_id))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            self._data.pop((DB_PATH, user_id), None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_user_prompts = _UserPromptLRU(int(os.getenv("USER_PROMPT_CACHE_SIZE", "1024")))
+
+
+def _resolve_user_character(conn: sqlite3.Connection, user_id: int) -> dict:
+    # Один запрос: выбранный персонаж, иначе id=1, иначе первый по id
+    row = conn.execute("""
+        SELECT id, name, prompt FROM (
+            SELECT p.id, p.name, p.prompt, 0 AS prio
             FROM user_character up
             JOIN characters p ON p.id = up.character_id
             WHERE up.telegram_user_id = ?
-        """, (user_id,)).fetchone()
+            UNION ALL
+            SELECT id, name, prompt, 1 FROM characters WHERE id = 1
+            UNION ALL
+            SELECT * FROM (SELECT id, name, prompt, 2 FROM characters ORDER BY id LIMIT 1)
+        )
+        ORDER BY prio
+        LIMIT 1
+    """, (user_id,)).fetchone()
+    if not row:
+        raise RuntimeError("Таблица characters пуста")
+    return {"id": row["id"], "name": row["name"], "prompt": row["prompt"]}
 
-    if row:
-        return {"id": row["id"], "name": row["name"], "prompt": row["prompt"]}
 
-    # Если не найден - берем персонажа с id=1
-    with _connect() as conn:
-        row = conn.execute("SELECT id, name, prompt FROM characters WHERE id = 1").fetchone()
-        if row:
-            return {"id": row["id"], "name": row["name"], "prompt": row["prompt"]}
+def _selected_character_id(conn: sqlite3.Connection, user_id: int) -> int | None:
+    row = conn.execute(
+        "SELECT character_id FROM user_character WHERE telegram_user_id = ?", (user_id,)
+    ).fetchone()
+    return row[0] if row else None
 
-        # Если нет персонажа с id=1 - берем первого
-        row = conn.execute("SELECT id, name, prompt FROM characters ORDER BY id LIMIT 1").fetchone()
-        if not row:
-            raise RuntimeError("Таблица characters пуста")
 
-    return {"id": row["id"], "name": row["name"], "prompt": row["prompt"]}
+def get_user_prompt(user_id: int) -> tuple[dict, str]:
+    """Персонаж пользователя и собранный для него system-промпт (через LRU)."""
+    conn = _connect()
+    _catalog.check(conn)
+    version, commits = _catalog.version, _catalog.commits
+    cached = _user_prompts.get(user_id, version)
+    if cached:
+        seen, selected, character, system = cached
+        if seen == commits:
+            return dict(character), system
+        # Был чужой коммит — мог смениться выбор; тот же — запись снова годна
+        if _selected_character_id(conn, user_id) == selected:
+            _user_prompts.put(user_id, version, commits, selected, character, system)
+            return dict(character), system
+    selected = _selected_character_id(conn, user_id)
+    character = _resolve_user_character(conn, user_id)
+    system = _system_prompt(character)
+    _user_prompts.put(user_id, version, commits, selected, character, system)
+    return dict(character), system
+
+
+def get_user_character(user_id: int) -> dict:
+    return get_user_prompt(user_id)[0]
 
 def get_character_prompt_for_user(user_id: int) -> str:
     return get_user_character(user_id)["prompt"]
 
 
 def _build_message(user_id: int, user_text: str) -> list[dict]:
-    p = get_user_character(user_id)
-    system = (
+    _, system = get_user_prompt(user_id)
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user_text},
+    ]
+
+def _system_prompt(p: dict) -> str:
+    return (
         f"Ты отвечаешь строго в образе персонажа: {p['name']}. \n"
         f"{p['prompt']} \n"
         "Правила: \n"
@@ -141,11 +683,6 @@ def _build_message(user_id: int, user_text: str) -> list[dict]:
         "5) Если стиль персонажа выражен слабо – переформулируй ответ и усили характер персонажа, сохраняя фактическую точность.\n"
     )
 
-    return [
-        {"role": "system", "content": system},
-        {"role": "user", "content": user_text},
-    ]
-
 def _build_message_s_for_character(character: dict, user_text: str) -> list[dict]:
     system = (
         f"Ты отвечаешь строго в образе персонажа: {character['name']}. \n"
@@ -162,12 +699,18 @@ def _build_message_s_for_character(character: dict, user_text: str) -> list[dict
         {"role": "user", "content": user_text},
     ]
 
-def list_models() -> list[dict]:
-    with _connect() as conn:
-        rows = conn.execute("SELECT id,key,label,active FROM models ORDER BY id").fetchall()
+def _load_models(conn: sqlite3.Connection) -> list[dict]:
+    rows = conn.execute("SELECT id,key,label,active FROM models ORDER BY id").fetchall()
     return [{"id":r["id"], "key":r["key"], "label":r["label"], "active":bool(r["active"])} for r in rows]
 
+def list_models() -> list[dict]:
+    return [dict(m) for m in _catalog.get("models", _load_models)]
+
 def get_active_model() -> dict:
+    for m in _catalog.get("models", _load_models):
+        if m["active"]:
+            return dict(m)
+    # Активной нет — назначаем первую (запись в БД, поэтому мимо кэша)
     with _connect() as conn:
         row = conn.execute("SELECT id,key,label FROM models WHERE active=1").fetchone()
         if row:
@@ -176,6 +719,7 @@ def get_active_model() -> dict:
         if not row:
             raise RuntimeError("В реестре моделей нет записей")
         conn.execute("UPDATE models SET active=CASE WHEN id=? THEN 1 ELSE 0 END", (row["id"],))
+    _catalog.invalidate()
     return {"id":row["id"], "key":row["key"], "label":row["label"], "active":True}
 
 
@@ -188,31 +732,140 @@ def set_active_model(model_id: int) -> dict:
             raise ValueError("Неизвестный ID модели")
         conn.execute("UPDATE models SET active = CASE WHEN id = ? THEN 1 ELSE 0 END", (model_id,))
         conn.commit()
+    _catalog.invalidate()
     return get_active_model()
 
 
-def add_note(user_id: int, text: str) -> int:
+def add_note(user_id: int, text: str, max_notes: int | None = None) -> int | None:
+    """
+    Добавить заметку. С max_notes проверка лимита и вставка — один запрос,
+    поэтому параллельные /note_add не превысят лимит; None — лимит исчерпан.
+    """
     with _connect() as conn:
-        cur = conn.execute(
-            "INSERT INTO notes(user_id, text) VALUES (?, ?)",
-            (user_id, text)
-        )
+        if max_notes is None:
+            cur = conn.execute(
+                "INSERT INTO notes(user_id, text) VALUES (?, ?)",
+                (user_id, text)
+            )
+        else:
+            cur = conn.execute(
+                """INSERT INTO notes(user_id, text)
+                SELECT ?, ?
+                WHERE COALESCE((SELECT n FROM note_counts WHERE user_id = ?), 0) < ?""",
+                (user_id, text, user_id, max_notes)
+            )
+            if cur.rowcount == 0:
+                return None
     return cur.lastrowid
 
 
-def list_notes(user_id: int, limit: int = 10):
+def add_notes(user_id: int, texts: list[str], max_notes: int | None = None) -> int:
+    """
+    Пакетная вставка заметок: один executemany в одной транзакции.
+    С max_notes остаток лимита читается из note_counts под той же блокировкой,
+    лишние тексты отбрасываются. Вернёт число вставленных.
+    """
     with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if max_notes is not None:
+                row = conn.execute("SELECT n FROM note_counts WHERE user_id = ?", (user_id,)).fetchone()
+                texts = texts[:max(0, max_notes - (row[0] if row else 0))]
+            conn.executemany("INSERT INTO notes(user_id, text) VALUES (?, ?)",
+                             ((user_id, text) for text in texts))
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    return len(texts)
+
+
+def count_notes(user_id: int | None = None) -> int:
+    """Число заметок пользователя (или всех, если user_id не задан) — из note_counts."""
+    with _connect() as conn:
+        if user_id is None:
+            row = conn.execute("SELECT COALESCE(SUM(n), 0) FROM note_counts").fetchone()
+        else:
+            row = conn.execute("SELECT n FROM note_counts WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def list_notes(user_id: int, limit: int = 10, *, before_id: int | None = None,
+               after_id: int | None = None):
+    """
+    Заметки пользователя, новые сверху.
+    Keyset-пагинация: before_id — заметки старше этого id (следующая страница),
+    after_id — ближайшие новее него (предыдущая). Поиск идёт по индексу
+    (user_id, id), поэтому далёкая страница стоит столько же, сколько первая.
+    """
+    with _connect() as conn:
+        if after_id is not None:
+            cur = conn.execute(
+                """SELECT id, text, created_at
+                FROM notes
+                WHERE user_id = ? AND id > ?
+                ORDER BY id ASC
+                LIMIT ?""",
+                (user_id, after_id, limit)
+            )
+            return cur.fetchall()[::-1]
         cur = conn.execute(
             """SELECT id, text, created_at
             FROM notes
-            WHERE user_id = ?
+            WHERE user_id = ? AND id < ?
             ORDER BY id DESC
             LIMIT ?""",
-            (user_id, limit)
+            (user_id, 2 ** 63 - 1 if before_id is None else before_id, limit)
         )
     return cur.fetchall()
 
 
+def iter_notes(user_id: int, batch: int = 500):
+    """
+    Все заметки пользователя по возрастанию id, пачками по batch строк.
+    Между пачками транзакция чтения не держится: курсор — id последней строки.
+    """
+    last_id = 0
+    while True:
+        with _connect() as conn:
+            rows = conn.execute(
+                """SELECT id, text, created_at
+                FROM notes
+                WHERE user_id = ? AND id > ?
+                ORDER BY id ASC
+                LIMIT ?""",
+                (user_id, last_id, batch)
+            ).fetchall()
+        yield from rows
+        if len(rows) < batch:
+            return
+        last_id = rows[-1]["id"]
+
+
+def list_notes_page(user_id: int, limit: int = 10, *, before_id: int | None = None,
+                    after_id: int | None = None):
+    """
+    Страница для /note_list: (строки, есть ли старше, есть ли новее).
+    Флаги — по одной проверке EXISTS по тому же индексу.
+    """
+    rows = list_notes(user_id, limit, before_id=before_id, after_id=after_id)
+    if not rows and (before_id is not None or after_id is not None):
+        # за курсором ничего не осталось (заметки удалили) — первая страница
+        rows = list_notes(user_id, limit)
+    if not rows:
+        return [], False, False
+    with _connect() as conn:
+        has_older = conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM notes WHERE user_id = ? AND id < ?)",
+            (user_id, rows[-1]["id"])
+        ).fetchone()[0]
+        has_newer = conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM notes WHERE user_id = ? AND id > ?)",
+            (user_id, rows[0]["id"])
+        ).fetchone()[0]
+    return rows, bool(has_older), bool(has_newer)
+
+
 def update_note(user_id: int, note_id: int, text: str) -> bool:
     with _connect() as conn:
         cur = conn.execute(
@@ -231,3 +884,120 @@ def delete_note(user_id: int, note_id: int) -> bool:
             (user_id, note_id)
         )
     return cur.rowcount > 0
+
+
+ACTIVITY_BITS_BYTES = 46  # 366 дней
+
+
+def _merge_activity_bits(conn: sqlite3.Connection, masks: dict[tuple[int, int], int]) -> None:
+    for (user_id, year), mask in masks.items():
+        row = conn.execute(
+            "SELECT bits FROM activity_bits WHERE user_id = ? AND year = ?", (user_id, year)
+        ).fetchone()
+        if row is not None:
+            mask |= int.from_bytes(row["bits"], "little")
+        conn.execute(
+            "INSERT OR REPLACE INTO activity_bits(user_id, year, bits) VALUES (?, ?, ?)",
+            (user_id, year, mask.to_bytes(ACTIVITY_BITS_BYTES, "little"))
+        )
+
+
+def add_activity_bits(masks: dict[tuple[int, int], int]) -> None:
+    """
+    OR-нуть маски {(user_id, год): биты дней} в activity_bits одной транзакцией.
+    BEGIN IMMEDIATE: чтение-изменение-запись не пересечётся с другим процессом.
+    """
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _merge_activity_bits(conn, masks)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def activity_years(user_id: int) -> dict[int, int]:
+    """{год: битовая карта дней (бит i — день года i+1)} пользователя."""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT year, bits FROM activity_bits WHERE user_id = ?", (user_id,)
+        ).fetchall()
+    return {r["year"]: int.from_bytes(r["bits"], "little") for r in rows}
+
+
+def _fold_activity_days(conn: sqlite3.Connection) -> None:
+    """Перенести строки прежней таблицы activity(user_id, day) в битовые карты."""
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'activity'"
+    ).fetchone():
+        return
+    masks: dict[tuple[int, int], int] = {}
+    for r in conn.execute("SELECT user_id, day FROM activity"):
+        d = datetime.date.fromisoformat(r["day"])
+        key = (r["user_id"], d.year)
+        masks[key] = masks.get(key, 0) | 1 << (d.timetuple().tm_yday - 1)
+    _merge_activity_bits(conn, masks)
+    conn.execute("DROP TABLE activity")
+    conn.commit()
+
+
+def get_json_migration(source: str) -> dict | None:
+    """Контрольная точка переноса файла: size, byte_offset, items, done."""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT size, byte_offset, items, done FROM json_migrations WHERE source = ?", (source,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def save_json_migration_batch(source: str, size: int, byte_offset: int, items: int, done: bool = False,
+                              notes=(), masks: dict[tuple[int, int], int] | None = None) -> None:
+    """
+    Записать пачку перенесённых данных и контрольную точку одной транзакцией:
+    после падения перенос продолжится с byte_offset, и ни одна заметка не задвоится.
+    notes — пары (user_id, text), masks — как в add_activity_bits.
+    """
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT INTO notes(user_id, text) VALUES (?, ?)", notes)
+            if masks:
+                _merge_activity_bits(conn, masks)
+            conn.execute(
+                """INSERT OR REPLACE INTO json_migrations(source, size, byte_offset, items, done)
+                VALUES (?, ?, ?, ?, ?)""",
+                (source, size, byte_offset, items, int(done))
+            )
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def llm_cache_get(key: str, now: float) -> tuple[str, float] | None:
+    """Ответ и время истечения из кэша LLM или None (нет / истёк)."""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+    return (row["response"], row["expires_at"]) if row else None
+
+
+def llm_cache_put(key: str, model: str, response: str, now: float, expires_at: float) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """INSERT INTO llm_cache(key, model, response, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET response = excluded.response,
+                created_at = excluded.created_at, expires_at = excluded.expires_at""",
+            (key, model, response, now, expires_at)
+        )
+
+
+def llm_cache_purge(now: float) -> int:
+    """Удалить истёкшие записи кэша LLM; вернёт число удалённых."""
+    with _connect() as conn:
+        cur = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+    return cur.rowcount
\ No newline at end of file
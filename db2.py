@@ -8,10 +8,16 @@ db.py — слой данных для DailyZodiakBot.
   - subscribed INTEGER       — 1/0 — подписка включена/выключена
   - last_sent_date TEXT      — 'YYYY-MM-DD', чтобы не слать повторно за день
 
+Таблица sending — кому рассылка уже ушла в работу, но отметка ещё не записана
+(отметки пишутся пачками). После падения recover_sending() считает этих
+пользователей получившими: лучше пропустить день, чем прислать дважды.
+
 Приёмы:
-  - отдельное подключение под каждую операцию (with _connect());
+  - подключение на поток из пула sqlite_pool (with _connect() — как и раньше);
   - PRAGMA: WAL + busy_timeout + row_factory=Row (см. Л3) [oai_citation:5‡L3.pdf](file-service://file-TzQZFVK22mksuAGPBby5ME);
-  - все SQL — параметризованные через "?" (никаких f-строк).
+  - все SQL — параметризованные через "?" (никаких f-строк). Единственное
+    исключение — PRAGMA user_version в _set_user_version: PRAGMA не принимает
+    параметры, номер проверяется через int().
 """
 
 from __future__ import annotations
@@ -20,18 +26,20 @@ import logging
 from typing import Optional
 
 from config2 import DB_PATH, DEFAULT_NOTIFY_HOUR
+from sqlite_pool import create_pool
 
 log = logging.getLogger(__name__)
 
 
 # ---------- подключение с «правильными» PRAGMA (см. Л3) ----------
+_pool = create_pool()  # PRAGMA выполняются один раз на подключение потока
+
 def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, timeout=5.0)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    conn.execute("PRAGMA journal_mode = WAL")
-    conn.execute("PRAGMA busy_timeout = 5000")
-    return conn
+    return _pool.connect(DB_PATH)
+
+def close_db() -> None:
+    """Закрыть все подключения пула (при остановке бота)."""
+    _pool.close_all()
 # WAL + busy_timeout уменьшают «database is locked», row_factory даёт доступ к полям по имени [oai_citation:6‡L3.pdf](file-service://file-TzQZFVK22mksuAGPBby5ME)
 
 
@@ -50,8 +58,12 @@ def init_db() -> None:
         last_sent_date TEXT
     );
 
-    CREATE INDEX IF NOT EXISTS idx_users_hour ON users(notify_hour);
     CREATE INDEX IF NOT EXISTS idx_users_sent ON users(last_sent_date);
+
+    CREATE TABLE IF NOT EXISTS sending (
+        user_id INTEGER PRIMARY KEY,
+        day     TEXT NOT NULL
+    );
     
     CREATE TABLE IF NOT EXISTS models (
     id INTEGER PRIMARY KEY,
@@ -62,9 +74,55 @@ def init_db() -> None:
     """
     with _connect() as conn:
         conn.executescript(schema)
+        _migrate(conn)
     log.info("DB initialized: %s", DB_PATH)
 
 
+# ---------- миграции схемы (PRAGMA user_version — номер последней применённой) ----------
+_MIGRATIONS = [
+    # 1: частичный покрывающий индекс под list_due_users — в нём только подписчики
+    # со знаком, а (user_id, sign) отдаются прямо из индекса без чтения таблицы.
+    # subscribed в хвосте: SQLite не считает столбцы из WHERE частичного индекса
+    # покрытыми и без него ходил бы в таблицу за каждой строкой.
+    # idx_users_hour был нужен только этой выборке.
+    (
+        """CREATE INDEX IF NOT EXISTS idx_users_due
+            ON users(notify_hour, last_sent_date, user_id, sign, subscribed)
+            WHERE subscribed = 1 AND sign IS NOT NULL""",
+        "DROP INDEX IF EXISTS idx_users_hour",
+    ),
+]
+
+
+def _set_user_version(conn: sqlite3.Connection, number: int) -> None:
+    # PRAGMA не принимает "?" — единственное место с SQL из f-строки; int() не
+    # пропустит ничего, кроме числа
+    conn.execute(f"PRAGMA user_version = {int(number)}")
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """
+    Применить недостающие миграции. Каждая — одна транзакция вместе с новым
+    user_version; версия перечитывается под BEGIN IMMEDIATE, так что два
+    процесса, стартовавших одновременно, не применят миграцию дважды.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(_MIGRATIONS):
+                conn.rollback()
+                return
+            for statement in _MIGRATIONS[version]:
+                conn.execute(statement)
+            _set_user_version(conn, version + 1)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        log.info("DB migrated to schema version %d", version + 1)
+
+
 # ---------- upsert/получение пользователя ----------
 def ensure_user(user_id: int) -> None:
     """Гарантируем наличие строки пользователя с дефолтами."""
@@ -97,24 +155,66 @@ def set_subscribed(user_id: int, on: bool) -> None:
 
 
 # ---------- рассылка: выборка и отметка отправки ----------
+# «Не сегодня» разбито на три диапазона idx_users_due (NULL, < today, > today):
+# каждый — поиск по индексу, и уже получившие сегодня не читаются вовсе.
+# Параметры: (hour, hour, today, hour, today).
+DUE_USERS_SQL = """
+    SELECT user_id, sign FROM users
+    WHERE subscribed = 1 AND sign IS NOT NULL AND notify_hour = ? AND last_sent_date IS NULL
+    UNION ALL
+    SELECT user_id, sign FROM users
+    WHERE subscribed = 1 AND sign IS NOT NULL AND notify_hour = ? AND last_sent_date < ?
+    UNION ALL
+    SELECT user_id, sign FROM users
+    WHERE subscribed = 1 AND sign IS NOT NULL AND notify_hour = ? AND last_sent_date > ?
+"""
+
+
 def list_due_users(today_str: str, hour: int) -> list[sqlite3.Row]:
     """
     Вернёт пользователей, кому надо отправить: подписан, час совпал, ещё не отправляли сегодня, знак задан.
+    Запрос — DUE_USERS_SQL.
     """
     with _connect() as conn:
-        cur = conn.execute(
-            """
-            SELECT user_id, sign
-            FROM users
-            WHERE subscribed = 1
-              AND sign IS NOT NULL
-              AND notify_hour = ?
-              AND (last_sent_date IS NULL OR last_sent_date <> ?)
-            """,
-            (hour, today_str)
-        )
+        cur = conn.execute(DUE_USERS_SQL, (hour, hour, today_str, hour, today_str))
         return cur.fetchall()
 
 def mark_sent_today(user_id: int, today_str: str) -> None:
     with _connect() as conn:
-        conn.execute("UPDATE users SET last_sent_date = ? WHERE user_id = ?", (today_str, user_id))
\ No newline at end of file
+        conn.execute("UPDATE users SET last_sent_date = ? WHERE user_id = ?", (today_str, user_id))
+
+
+# ---------- пакетные отметки рассылки ----------
+def claim_sending(user_ids: list[int], today_str: str) -> None:
+    """Перед рассылкой: записать получателей в sending одной транзакцией."""
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO sending(user_id, day) VALUES (?, ?)",
+            ((uid, today_str) for uid in user_ids)
+        )
+
+
+def mark_sent_many(user_ids: list[int], today_str: str) -> None:
+    """Отметить отправку многим сразу: executemany в одной транзакции — один fsync на пачку."""
+    with _connect() as conn:
+        conn.executemany(
+            "UPDATE users SET last_sent_date = ? WHERE user_id = ?",
+            ((today_str, uid) for uid in user_ids)
+        )
+        conn.executemany("DELETE FROM sending WHERE user_id = ?", ((uid,) for uid in user_ids))
+
+
+def recover_sending() -> int:
+    """
+    При старте: незаписанные отметки прошлого запуска (упал между сбросами)
+    считаем отправленными. Вернёт число таких пользователей.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            UPDATE users SET last_sent_date = (SELECT day FROM sending WHERE sending.user_id = users.user_id)
+            WHERE user_id IN (SELECT user_id FROM sending)
+            """
+        )
+        conn.execute("DELETE FROM sending")
+        return cur.rowcount
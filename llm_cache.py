@@ -0,0 +1,131 @@
+"""
+llm_cache.py — кэш ответов LLM (включается явно: LLM_CACHE=1 в .env).
+
+Ключ: модель + хэш system-промпта + нормализованный вопрос + temperature + max_tokens.
+Два уровня:
+  - LRU в памяти процесса (мгновенно, до LLM_CACHE_SIZE записей);
+  - таблица llm_cache в bot.db (переживает перезапуск, общая для процессов).
+Обе записи живут LLM_CACHE_TTL секунд. Счётчики попаданий — в stats().
+Истёкшие строки удаляет purge(): при старте и по ходу работы — из put(),
+каждые LLM_CACHE_PURGE_EVERY записей или раз в LLM_CACHE_PURGE_S секунд.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import db
+
+ENABLED = os.getenv("LLM_CACHE", "0") == "1"
+TTL_S = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+MEMORY_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+PURGE_EVERY = int(os.getenv("LLM_CACHE_PURGE_EVERY", "500"))
+PURGE_INTERVAL_S = float(os.getenv("LLM_CACHE_PURGE_S", "3600"))
+
+
+def normalize_question(text: str) -> str:
+    # Регистр и лишние пробелы не должны давать разные ключи
+    return " ".join((text or "").lower().replace("ё", "е").split())
+
+
+def make_key(model: str, messages: list[dict], temperature: float, max_tokens: int) -> str:
+    system = "".join(m["content"] for m in messages if m["role"] == "system")
+    question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    raw = json.dumps([
+        model,
+        hashlib.sha256(system.encode("utf-8")).hexdigest(),
+        normalize_question(question),
+        temperature,
+        max_tokens,
+    ], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = MEMORY_SIZE, ttl_s: float = TTL_S, clock=time.time,
+                 purge_every: int = PURGE_EVERY, purge_interval_s: float = PURGE_INTERVAL_S):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.purge_every = purge_every
+        self.purge_interval_s = purge_interval_s
+        self._clock = clock
+        self._puts_since_purge = 0
+        self._last_purge = clock()
+        self._lock = threading.Lock()
+        self._mem: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.hits_memory = 0
+        self.hits_db = 0
+        self.misses = 0
+        self.stores = 0
+        self.purged = 0
+
+    def get(self, key: str) -> str | None:
+        now = self._clock()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._mem.move_to_end(key)
+                    self.hits_memory += 1
+                    return entry[0]
+                del self._mem[key]
+
+        row = db.llm_cache_get(key, now)
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits_db += 1
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now = self._clock()
+        expires_at = now + self.ttl_s
+        db.llm_cache_put(key, model, response, now, expires_at)
+        with self._lock:
+            self.stores += 1
+            self._remember(key, response, expires_at)
+            self._puts_since_purge += 1
+            due = (self._puts_since_purge >= self.purge_every
+                   or now - self._last_purge >= self.purge_interval_s)
+        if due:
+            self.purge()  # иначе таблица долгоживущего бота только растёт
+
+    def _remember(self, key: str, response: str, expires_at: float) -> None:
+        self._mem[key] = (response, expires_at)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.maxsize:
+            self._mem.popitem(last=False)
+
+    def purge(self) -> int:
+        """Удалить истёкшее из БД (и из памяти)."""
+        now = self._clock()
+        with self._lock:
+            self._puts_since_purge = 0
+            self._last_purge = now
+            for key in [k for k, (_, exp) in self._mem.items() if exp <= now]:
+                del self._mem[key]
+        removed = db.llm_cache_purge(now)
+        self.purged += removed
+        return removed
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_db
+        total = hits + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_db": self.hits_db,
+            "misses": self.misses,
+            "stores": self.stores,
+            "purged": self.purged,
+            "hit_ratio": hits / total if total else 0.0,
+            "memory_entries": len(self._mem),
+        }
+
+
+cache = ResponseCache()
@@ -0,0 +1,258 @@
+"""
+llm_limiter.py — допуск запросов к LLM: token bucket на пользователя и на весь
+бот + ограниченная очередь с приоритетами.
+
+  - per-user bucket: один пользователь не может заспамить модель
+    (LLM_USER_RATE запросов/с, всплеск до LLM_USER_BURST);
+  - global bucket: суммарный темп чуть ниже лимита OpenRouter
+    (LLM_GLOBAL_RATE запросов/с, всплеск LLM_GLOBAL_BURST) — вместо 429 для всех;
+  - очередь до LLM_QUEUE_SIZE заявок: кто не влез — сразу получает отказ с
+    позицией; внутри очереди раньше идут заявки с меньшим priority;
+  - время ожидания в очереди копится в статистике (stats());
+  - повтор и резервная модель (llm_router) — тоже запрос к OpenRouter: каждая
+    попытка после первой берёт свой токен общего бакета (take_global).
+"""
+
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+USER_RATE = float(os.getenv("LLM_USER_RATE", str(1 / 10)))
+USER_BURST = float(os.getenv("LLM_USER_BURST", "3"))
+GLOBAL_RATE = float(os.getenv("LLM_GLOBAL_RATE", str(18 / 60)))   # у free-моделей ~20/мин
+GLOBAL_BURST = float(os.getenv("LLM_GLOBAL_BURST", "5"))
+QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "50"))
+QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+MAX_USER_BUCKETS = 10_000
+
+PRIORITY_ASK = 0       # /ask, /ask_model — прямой вопрос
+PRIORITY_RANDOM = 1    # /ask_random — развлечение, может подождать
+
+
+class LimitError(Exception):
+    """Отказ в допуске; str(e) — готовый текст для пользователя."""
+
+
+class UserRateLimited(LimitError):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"⏳ Слишком часто. Повторите через {max(1, round(retry_after))} с.")
+
+
+class QueueFull(LimitError):
+    def __init__(self, position: int):
+        self.position = position
+        super().__init__(f"🚦 Очередь к модели заполнена ({position} в очереди). Попробуйте через минуту.")
+
+
+class QueueTimeout(LimitError):
+    def __init__(self):
+        super().__init__("🚦 Не дождались очереди к модели. Попробуйте позже.")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._ts = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Через сколько секунд появится целый токен."""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def is_full(self) -> bool:
+        """Бакет полон — забыть его то же, что создать заново."""
+        self._refill()
+        return self._tokens >= self.burst
+
+
+class Ticket:
+    __slots__ = ("priority", "seq", "enqueued_at", "position")
+
+    def __init__(self, priority: int, seq: int, enqueued_at: float, position: int):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = enqueued_at
+        self.position = position  # сколько заявок впереди на момент постановки
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Limiter:
+    def __init__(self, *, user_rate: float = USER_RATE, user_burst: float = USER_BURST,
+                 global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 queue_size: int = QUEUE_SIZE, queue_timeout_s: float = QUEUE_TIMEOUT_S,
+                 clock=time.monotonic):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.queue_size = queue_size
+        self.queue_timeout_s = queue_timeout_s
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._global = TokenBucket(global_rate, global_burst, clock)
+        self._users: OrderedDict[int, TokenBucket] = OrderedDict()  # LRU: давние — в начале
+        self._queue: list[Ticket] = []
+        self._seq = itertools.count()
+        self._waits: deque[float] = deque(maxlen=500)
+        self.admitted = 0
+        self.rejected_user = 0
+        self.rejected_full = 0
+        self.timed_out = 0
+        self.retry_tokens = 0
+
+    # ---------- шаг 1: лимит пользователя ----------
+    def check_user(self, user_id: int) -> None:
+        with self._cond:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                self._evict_users()
+                bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst, self._clock)
+            else:
+                self._users.move_to_end(user_id)
+            if not bucket.try_take():
+                self.rejected_user += 1
+                raise UserRateLimited(bucket.wait_time())
+
+    def _evict_users(self) -> None:
+        # С самых давних: выбрасываем только полные бакеты. Неполный (пользователь
+        # недавно тратил токены) оставляем, иначе он получил бы новый всплеск;
+        # тогда словарь временно растёт сверх MAX_USER_BUCKETS.
+        while len(self._users) >= MAX_USER_BUCKETS:
+            user_id, bucket = next(iter(self._users.items()))
+            if not bucket.is_full():
+                break
+            del self._users[user_id]
+
+    # ---------- шаг 2: очередь ----------
+    def enqueue(self, priority: int = PRIORITY_ASK) -> Ticket:
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                self.rejected_full += 1
+                raise QueueFull(len(self._queue))
+            ticket = Ticket(priority, next(self._seq), self._clock(),
+                            sum(1 for t in self._queue if t < Ticket(priority, 1 << 62, 0, 0)))
+            heapq.heappush(self._queue, ticket)
+            return ticket
+
+    def _try_admit(self, ticket: Ticket) -> float:
+        """0 — допущен; иначе сколько подождать до следующей проверки. Под self._cond."""
+        if self._queue[0] is ticket and self._global.try_take():
+            heapq.heappop(self._queue)
+            self.admitted += 1
+            self._waits.append(self._clock() - ticket.enqueued_at)
+            self._cond.notify_all()
+            return 0.0
+        left = ticket.enqueued_at + self.queue_timeout_s - self._clock()
+        if left < 0:
+            self.timed_out += 1
+            raise QueueTimeout()
+        # не спим дольше таймаута: иначе при медленном бакете он сработает с опозданием
+        return max(0.01, min(self._global.wait_time(), left))
+
+    def _abandon(self, ticket: Ticket) -> None:
+        """Убрать заявку, которая ушла из очереди не через допуск (таймаут, отмена)."""
+        with self._cond:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    # ---------- шаг 3: дождаться своей очереди ----------
+    def wait(self, ticket: Ticket) -> float:
+        """Блокирует поток до допуска; вернёт время ожидания в очереди."""
+        try:
+            with self._cond:
+                while True:
+                    delay = self._try_admit(ticket)
+                    if not delay:
+                        return self._clock() - ticket.enqueued_at
+                    self._cond.wait(delay)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    async def await_turn(self, ticket: Ticket) -> float:
+        """asyncio-версия wait(): ждёт через asyncio.sleep, поток не занимает."""
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_admit(ticket)
+                if not delay:
+                    return self._clock() - ticket.enqueued_at
+                await asyncio.sleep(min(delay, 0.5))
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    # ---------- повторные попытки уже допущенного запроса ----------
+    def _try_global(self, deadline: float) -> float:
+        """0 — токен взят; иначе сколько подождать. Под self._cond."""
+        if self._global.try_take():
+            self.retry_tokens += 1
+            return 0.0
+        delay = self._global.wait_time()
+        if self._clock() + delay > deadline:
+            self.timed_out += 1
+            raise QueueTimeout()
+        return delay
+
+    def take_global(self, timeout_s: float) -> None:
+        """
+        Токен общего бакета для повтора или резервной модели (llm_router):
+        первую попытку оплатил допуск из очереди, каждую следующую — отдельно.
+        Не дождались за timeout_s — QueueTimeout.
+        """
+        deadline = self._clock() + timeout_s
+        with self._cond:
+            while True:
+                delay = self._try_global(deadline)
+                if not delay:
+                    return
+                self._cond.wait(delay)
+
+    async def await_global(self, timeout_s: float) -> None:
+        """asyncio-версия take_global()."""
+        deadline = self._clock() + timeout_s
+        while True:
+            with self._cond:
+                delay = self._try_global(deadline)
+            if not delay:
+                return
+            await asyncio.sleep(min(delay, 0.5))
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "queued": len(self._queue),
+            "admitted": self.admitted,
+            "rejected_user": self.rejected_user,
+            "rejected_full": self.rejected_full,
+            "timed_out": self.timed_out,
+            "retry_tokens": self.retry_tokens,
+            "wait_avg_s": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95_s": waits[int(len(waits) * 0.95) - 1] if waits else 0.0,
+        }
+
+
+limiter = Limiter()
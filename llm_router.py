@@ -0,0 +1,229 @@
+"""
+llm_router.py — повторы, автоматический выключатель (circuit breaker) и
+переход на резервные модели из реестра models.
+
+Как идёт запрос:
+  1) модели-кандидаты: запрошенная, затем остальные из db.list_models() по порядку;
+  2) модель с «открытым» выключателем пропускается (она недавно падала подряд);
+  3) на 429/5xx/таймаут — повтор с экспоненциальной задержкой и джиттером,
+     после LLM_RETRIES повторов — следующая модель;
+  4) 401 (ключ) — сразу ошибка: другие модели не помогут.
+Каждая попытка ограничена LLM_ATTEMPT_TIMEOUT, весь запрос — LLM_TOTAL_BUDGET,
+поэтому неудачный вопрос стоит ограниченное время, а не 30 с на попытку.
+acquire(timeout_s) вызывается перед каждой попыткой, кроме первой: так повторы
+и резервные модели идут через общий лимит (llm_limiter.take_global).
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+import db
+from openrouter_client import OpenRouterError
+
+log = logging.getLogger(__name__)
+
+RETRIES = int(os.getenv("LLM_RETRIES", "1"))                    # повторов на модель
+ATTEMPT_TIMEOUT_S = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "10"))
+TOTAL_BUDGET_S = float(os.getenv("LLM_TOTAL_BUDGET", "25"))
+BACKOFF_BASE_S = 0.5
+BACKOFF_CAP_S = 4.0
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET", "60"))
+
+RETRYABLE = {429, 500, 502, 503, 504}
+FATAL = {401}
+
+
+class CircuitBreaker:
+    """
+    closed → (failures подряд) → open → (reset_after_s) → half-open:
+    одна пробная попытка; успех закрывает, неудача снова открывает.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_after_s: float = BREAKER_RESET_S,
+                 clock=time.monotonic):
+        self.failures = failures
+        self.reset_after_s = reset_after_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened_at: float | None = None
+        self._probe = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at >= self.reset_after_s:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probe:
+                self._probe = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._probe = False
+
+    def release(self) -> None:
+        """Пробную попытку так и не сделали (например, не дождались лимита) — отдать её."""
+        with self._lock:
+            self._probe = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._count += 1
+            self._probe = False
+            if self._count >= self.failures:
+                self._opened_at = self._clock()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(model_key: str) -> CircuitBreaker:
+    with _breakers_lock:
+        br = _breakers.get(model_key)
+        if br is None:
+            br = _breakers[model_key] = CircuitBreaker()
+        return br
+
+
+def breaker_states() -> dict[str, str]:
+    return {key: br.state for key, br in _breakers.items()}
+
+
+def backoff_delay(attempt: int) -> float:
+    """«Полный джиттер»: случайно в [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * (2 ** attempt)))
+
+
+def candidate_models(preferred_key: str, fallback: bool = True) -> list[str]:
+    keys = [preferred_key]
+    if fallback:
+        keys += [m["key"] for m in db.list_models() if m["key"] != preferred_key]
+    return keys
+
+
+def _plan(preferred_key: str, fallback: bool, budget_s: float, candidates: list[str] | None = None):
+    """
+    Общий для sync/async план попыток: выдаёт (model_key, timeout_s, delay_before_s).
+    Результат попытки сообщают через .send(error или None).
+    candidates — готовый список моделей (async-версия читает его из БД в потоке).
+    """
+    deadline = time.monotonic() + budget_s
+    last_error: OpenRouterError | None = None
+    if candidates is None:
+        candidates = candidate_models(preferred_key, fallback)
+    for key in candidates:
+        br = breaker_for(key)
+        if not br.allow():
+            log.info("LLM %s skipped: circuit open", key)
+            continue
+        for attempt in range(RETRIES + 1):
+            delay = backoff_delay(attempt - 1) if attempt else 0.0
+            remaining = deadline - time.monotonic() - delay
+            if remaining <= 0.5:
+                raise last_error or OpenRouterError(504, "Ошибка 504 — сервер не ответил вовремя. Повторите попытку.")
+            try:
+                error = yield key, min(ATTEMPT_TIMEOUT_S, remaining), delay
+            except GeneratorExit:
+                br.release()  # попытку отменили до запроса (plan.close())
+                raise
+            if error is None:
+                br.record_success()
+                return
+            last_error = error
+            if error.status in FATAL:
+                raise error
+            if error.status not in RETRYABLE:
+                # Сервис ответил (400/403/404…) — он доступен, но модель не годится:
+                # выключатель не трогаем как «сбой», просто идём к следующей
+                br.record_success()
+                break
+            br.record_failure()
+            log.warning("LLM %s failed (%s), attempt %d", key, error.status, attempt + 1)
+            if not br.allow():
+                break
+    raise last_error or OpenRouterError(503, "Все модели временно недоступны. Попробуйте позже.")
+
+
+def call_with_fallback(fn, preferred_key: str, *, fallback: bool = True,
+                       budget_s: float = TOTAL_BUDGET_S, acquire=None):
+    """
+    fn(model_key, timeout_s) -> результат; вернёт (результат, model_key ответившей модели).
+    Исключения OpenRouterError из fn — сигнал «попытка неудачна».
+    """
+    plan = _plan(preferred_key, fallback, budget_s)
+    step = next(plan)
+    first = True
+    while True:
+        key, timeout_s, delay = step
+        if delay:
+            time.sleep(delay)
+        if acquire is not None and not first:
+            try:
+                acquire(timeout_s)
+            except BaseException:
+                plan.close()
+                raise
+        first = False
+        try:
+            result = fn(key, timeout_s)
+        except OpenRouterError as e:
+            step = plan.send(e)
+            continue
+        try:
+            plan.send(None)
+        except StopIteration:
+            pass
+        return result, key
+
+
+async def acall_with_fallback(afn, preferred_key: str, *, fallback: bool = True,
+                              budget_s: float = TOTAL_BUDGET_S, acquire=None):
+    """
+    asyncio-версия call_with_fallback: afn(model_key, timeout_s) и
+    acquire(timeout_s) — корутины. Реестр моделей (SQLite) читается в пуле
+    потоков, а не в event loop.
+    """
+    candidates = await asyncio.to_thread(candidate_models, preferred_key, fallback)
+    plan = _plan(preferred_key, fallback, budget_s, candidates)
+    step = next(plan)
+    first = True
+    while True:
+        key, timeout_s, delay = step
+        if delay:
+            await asyncio.sleep(delay)
+        if acquire is not None and not first:
+            try:
+                await acquire(timeout_s)
+            except BaseException:
+                plan.close()
+                raise
+        first = False
+        try:
+            result = await afn(key, timeout_s)
+        except OpenRouterError as e:
+            step = plan.send(e)
+            continue
+        try:
+            plan.send(None)
+        except StopIteration:
+            pass
+        return result, key
@@ -1,15 +1,24 @@
 import os
+import logging
 from dotenv import load_dotenv
 import telebot
 import time
-import json
 import datetime
-from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from db import *
 from telebot import types
 import random
+import requests
 from db import (get_character_by_id)
-from openrouter_client import chat_once, OpenRouterError
+from openrouter_client import chat_stream, OpenRouterError
+from tg_stream import ThrottledEditor
+import llm_cache
+import llm_limiter
+import llm_router
+from activity_log import activity
+from note_export import FORMATS as EXPORT_FORMATS, export_notes
+from note_import import FORMATS as IMPORT_FORMATS, ImportFailed, detect_format, import_notes
+from singleflight import Group, AsyncGroup, Watchers, make_key
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -20,117 +29,119 @@ if not TOKEN:
 init_db()
 
 bot = telebot.TeleBot(TOKEN)
+log = logging.getLogger(__name__)
 
-# Структура для хранения активности пользователей
-user_activity = defaultdict(list)
 MAX_NOTES_PER_USER = 50  # Лимит заметок на пользователя
-
-
-# Загрузка заметок из файла
-def load_notes():
-    global notes, note_counter
-    try:
-        with open('notes.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            notes = data.get('notes', {})
-            # Конвертируем ключи обратно в int (json сохраняет как str)
-            notes = {int(k): v for k, v in notes.items()}
-            note_counter = data.get('counter', 1)
-    except FileNotFoundError:
-        notes = {}
-        note_counter = 1
-
-
-# Сохранение заметок в файл
-def save_notes():
-    with open('notes.json', 'w', encoding='utf-8') as f:
-        json.dump({
-            'notes': notes,
-            'counter': note_counter
-        }, f, ensure_ascii=False, indent=2)
-
-
-# Загрузка активности из файла
-def load_activity():
-    global user_activity
-    try:
-        with open('activity.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # Конвертируем строковые ключи обратно в int
-            user_activity = {int(k): v for k, v in data.items()}
-    except FileNotFoundError:
-        user_activity = {}
-
-
-# Сохранение активности в файл
-def save_activity():
-    with open('activity.json', 'w', encoding='utf-8') as f:
-        json.dump(user_activity, f, ensure_ascii=False, indent=2)
+# Кому доступны служебные команды (/note_reconcile): id через запятую
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+LLM_TEMPERATURE = 0.2
+LLM_MAX_TOKENS = 400
+
+# Склейка одинаковых одновременных вопросов к модели (sync и asyncio-бот);
+# watchers раздают ход общего запроса заглушкам всех участников
+llm_flights = Group()
+llm_async_flights = AsyncGroup()
+llm_watchers = Watchers()
+llm_async_watchers = Watchers()
+
+# Ожидание очереди и стрим ответа — не в потоках TeleBot (их num_threads=2:
+# два долгих вопроса остановили бы все команды), а в своём пуле. Размер —
+# вся очередь llm_limiter плюс уже допущенные стримы, чтобы заявки копились
+# в очереди лимитера (приоритет, QueueFull), а не в очереди пула.
+LLM_STREAMS = int(os.getenv("LLM_STREAMS", "10"))
+llm_pool = ThreadPoolExecutor(max_workers=llm_limiter.QUEUE_SIZE + LLM_STREAMS,
+                              thread_name_prefix="llm")
 
 
 # Функция для записи активности пользователя
 def log_activity(user_id):
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    if user_id not in user_activity:
-        user_activity[user_id] = []
-
-    # Добавляем сегодняшнюю дату, если её ещё нет
-    if today not in user_activity[user_id]:
-        user_activity[user_id].append(today)
-        # Сохраняем только последние 30 дней активности
-        user_activity[user_id] = user_activity[user_id][-30:]
-        save_activity()
+    # Без записи на диск: день попадает в память, в таблицу activity пишет фоновый поток
+    activity.record(user_id)
 
 
 # Функция для подсчета заметок пользователя
 def count_user_notes(user_id):
-    # В текущей реализации все заметки общие для всех пользователей
-    # В реальном приложении нужно хранить user_id для каждой заметки
-    return len(notes)  # Упрощенная версия
+    # Счётчик в note_counts ведут триггеры — одна строка по ключу, без COUNT(*)
+    return count_notes(user_id)
+
+
+DAYS_NAMES = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+MAX_STATS_DAYS = 36600  # /note_stats [days]: до ~100 лет
 
 
 # Функция для создания ASCII гистограммы
-def create_activity_chart(user_id):
-    today = datetime.datetime.now()
-    week_days = []
-
-    # Получаем последние 7 дней
-    for i in range(6, -1, -1):
-        day = today - datetime.timedelta(days=i)
-        week_days.append(day.strftime("%Y-%m-%d"))
-
-    # Считаем активность по дням
-    activity_data = []
-    for day in week_days:
-        if user_id in user_activity and day in user_activity[user_id]:
-            activity_data.append('█')  # Полный блок для дня с активностью
-        else:
-            activity_data.append('░')  # Пустой блок для дня без активности
+def create_activity_chart(user_id, history=None, today=None):
+    today = today or datetime.date.today()
+    history = history or activity.history(user_id)
+    start = today - datetime.timedelta(days=6)
+
+    # Флаги 7 дней — одна выборка из битовой карты
+    activity_data = ['█' if on else '░' for on in history.days(start, today)]
 
     # Создаем красивую гистограмму
     chart = "📊 Ваша активность за неделю:\n\n"
 
-    # Добавляем дни недели
-    days_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-    chart += "     " + "  ".join(days_names) + "\n"
+    # Добавляем дни недели (по датам, а не с понедельника)
+    week = [start + datetime.timedelta(days=i) for i in range(7)]
+    chart += "     " + "  ".join(DAYS_NAMES[d.weekday()] for d in week) + "\n"
 
     # Добавляем график
     chart += "     " + "  ".join(activity_data) + "\n"
 
     # Добавляем даты
-    dates = [(today - datetime.timedelta(days=i)).strftime("%d.%m") for i in range(6, -1, -1)]
-    chart += "     " + " ".join(dates) + "\n\n"
+    chart += "     " + " ".join(d.strftime("%d.%m") for d in week) + "\n\n"
 
     # Статистика
-    active_days = sum(1 for day in week_days if user_id in user_activity and day in user_activity[user_id])
-    chart += f"📈 Активных дней: {active_days}/7"
+    chart += f"📈 Активных дней: {history.count(start, today)}/7"
 
     return chart
 
 
+def create_month_heatmap(history, today=None):
+    """Календарь текущего месяца: █ — был активен, ░ — нет, · — ещё не наступил."""
+    today = today or datetime.date.today()
+    first = today.replace(day=1)
+    last = (first + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+    flags = history.days(first, last)
+    cells = [" "] * first.weekday()  # сдвиг до дня недели 1-го числа
+    for i, on in enumerate(flags):
+        cells.append("·" if first + datetime.timedelta(days=i) > today else ("█" if on else "░"))
+    rows = [" ".join(DAYS_NAMES)] + ["  ".join(cells[i:i + 7]) for i in range(0, len(cells), 7)]
+    return f"🗓 {first.strftime('%m.%Y')}: активных дней {history.count(first, today)}\n" + "\n".join(rows)
+
+
+SPARK = "▁▂▃▄▅▆▇█"
+SPARK_WIDTH = 30  # длинные периоды сворачиваются в столько столбиков
+
+
+def sparkline(values):
+    """Мини-график из блоков ▁..█; ненулевые значения не ниже второго уровня."""
+    top = max(values, default=0)
+    return "".join(SPARK[0] if not v else SPARK[max(1, round(v / top * (len(SPARK) - 1)))]
+                   for v in values)
+
+
+def create_notes_summary(user_id, days=30, today=None):
+    """Создано/изменено/удалено за 7/30/365 дней и графики — по строкам note_daily."""
+    today = today or datetime.date.today()
+    lines = ["📝 Заметки (+создано ✎изменено −удалено):"]
+    for window in (7, 30, 365):
+        t = note_daily_totals(user_id, today - datetime.timedelta(days=window - 1), today)
+        lines.append(f"• {window} дн.: +{t['created']} ✎{t['edited']} −{t['deleted']}")
+
+    created = [r["created"] for r in note_daily(user_id, today - datetime.timedelta(days=days - 1), today)]
+    step = -(-len(created) // SPARK_WIDTH)  # дней в столбике, с округлением вверх
+    buckets = [sum(created[i:i + step]) for i in range(0, len(created), step)]
+    lines.append(f"• Создано за {days} дн.: {sparkline(buckets)}")
+
+    weekdays = note_weekdays(user_id)
+    lines.append("• По дням недели: " + " ".join(f"{d} {s}" for d, s in zip(DAYS_NAMES, sparkline(weekdays))))
+    return "\n".join(lines)
+
+
 # Загружаем данные при старте
-load_notes()
-load_activity()
+if llm_cache.ENABLED:
+    llm_cache.cache.purge()  # выкидываем истёкшие ответы
 
 
 def cmd_start(message: types.Message) -> None:
@@ -146,13 +157,120 @@ def cmd_start(message: types.Message) -> None:
         " /note_edit <id> <текст>\n"
         " /note_del <id>\n"
         " /note_count\n"
-        " /note_export\n"
+        " /note_export [txt|jsonl|csv] [gz]\n"
+        " /note_import (документ txt|jsonl|csv)\n"
         " /note_stats [days]\n"
         " /models\n"
         " /model <id>\n"
     )
 
 
+def _model_note(used_key: str, model_key: str) -> str:
+    if used_key == model_key:
+        return f"модель: {used_key}"
+    return f"модель: {used_key}, резерв вместо {model_key}"
+
+
+def _safe_finish(editor: ThrottledEditor, message: types.Message, text: str) -> None:
+    """
+    Итоговая правка заглушки (и ответ, и ошибка). Если правка падает (заглушку
+    удалили, чат недоступен) или так и не прошла (429 не отпустил), текст
+    уходит отдельным сообщением — пользователь не остаётся без ответа, а
+    исключение не вылетает из обработчика.
+    """
+    try:
+        if editor.finish(text):
+            return
+        log.warning("Final edit did not land, replying instead")
+    except Exception:
+        log.exception("Final edit failed, replying instead")
+    try:
+        bot.reply_to(message, text)
+    except Exception:
+        log.exception("Reply after failed edit failed")
+
+
+def _stream_answer(message: types.Message, msgs: list[dict], model_key: str, *,
+                   header: str = "", who: str = "", error_prefix: str = "Ошибка",
+                   fallback: bool = True, priority: int = llm_limiter.PRIORITY_ASK) -> Future | None:
+    """
+    Ответ LLM с постепенным выводом: заглушка уходит сразу, дальше текст
+    дописывается правками сообщения (не чаще лимитов Telegram на edit).
+    Очередь и запрос к модели выполняются в llm_pool: поток обработчика
+    освобождается сразу после заглушки (вернёт Future этой работы).
+    При LLM_CACHE=1 повторный вопрос отдаётся из кэша без запроса к модели.
+    Сбои до первого токена обрабатывает llm_router: повторы и резервные модели.
+    Одинаковые одновременные вопросы склеиваются в один запрос (llm_flights).
+    Допуск к модели — llm_limiter: лимит пользователя, затем общая очередь.
+    """
+    cache_key = None
+    if llm_cache.ENABLED:
+        cache_key = llm_cache.make_key(model_key, msgs, LLM_TEMPERATURE, LLM_MAX_TOKENS)
+        cached = llm_cache.cache.get(cache_key)
+        if cached is not None:
+            footer = f"\n\n(из кэша; модель: {model_key}; {who})"
+            bot.reply_to(message, f"{header}{cached[:4000 - len(header) - len(footer)]}{footer}")
+            return
+
+    try:
+        llm_limiter.limiter.check_user(message.from_user.id)
+    except llm_limiter.LimitError as e:
+        bot.reply_to(message, str(e))
+        return
+
+    placeholder = bot.reply_to(message, f"{header}⏳ Думаю…")
+    editor = ThrottledEditor(bot, placeholder.chat.id, placeholder.message_id)
+    def open_stream(key: str, timeout_s: float):
+        it = chat_stream(msgs, model=key, temperature=LLM_TEMPERATURE,
+                         max_tokens=LLM_MAX_TOKENS, timeout_s=timeout_s)
+        # Первая порция внутри попытки: ошибка до первого токена → повтор/резерв
+        return next(it, ""), it
+
+    flight_key = make_key(model_key, msgs, LLM_TEMPERATURE, LLM_MAX_TOKENS, fallback)
+
+    def produce() -> tuple[str, str]:
+        # Выполняет только «ведущий», и только очередь с моделью: ход генерации
+        # публикуется, заглушку каждого участника правит его же show
+        ticket = llm_limiter.limiter.enqueue(priority)
+        if ticket.position:
+            llm_watchers.publish(flight_key, f"⏳ В очереди к модели: {ticket.position + 1}-й")
+        llm_limiter.limiter.wait(ticket)
+        (text, rest), used_key = llm_router.call_with_fallback(
+            open_stream, model_key, fallback=fallback, acquire=llm_limiter.limiter.take_global)
+        llm_watchers.publish(flight_key, f"{text} ▌")
+        for delta in rest:
+            text += delta
+            llm_watchers.publish(flight_key, f"{text} ▌")
+        return text, used_key
+
+    def show(body: str) -> None:
+        editor.update(f"{header}{body}")
+
+    def answer() -> None:
+        t0 = time.perf_counter()
+        try:
+            with llm_watchers.watch(flight_key, show):
+                (text, used_key), shared = llm_flights.do(flight_key, produce)
+            ms = int((time.perf_counter() - t0) * 1000)
+            footer = f"\n\n({ms} мс; {_model_note(used_key, model_key)}; {who})"
+            out = text.strip()[:4000 - len(header) - len(footer)]
+            _safe_finish(editor, message, f"{header}{out}{footer}")
+            if llm_cache.ENABLED and text.strip() and not shared:
+                key = cache_key
+                if used_key != model_key:
+                    key = llm_cache.make_key(used_key, msgs, LLM_TEMPERATURE, LLM_MAX_TOKENS)
+                llm_cache.cache.put(key, used_key, text.strip())
+        except OpenRouterError as e:
+            _safe_finish(editor, message, f"{error_prefix}: {e}")
+        except llm_limiter.LimitError as e:
+            _safe_finish(editor, message, f"{header}{e}")
+        except Exception:
+            log.exception("LLM handler failed")
+            _safe_finish(editor, message, "Непредвиденная ошибка.")
+
+    return llm_pool.submit(answer)
+
+
 # Добавляем недостающую функцию
 def _build_messages_for_character(character, question):
     """
@@ -220,31 +338,35 @@ def cmd_whoami(message: types.Message) -> None:
     bot.reply_to(message, f"Модель: {model['label']} ({model['key']})\nПерсонаж: {character['name']}")
 
 
-@bot.message_handler(commands=["ask_random"])
-def cmd_ask_random(message: types.Message) -> None:
+def _plan_ask_random(message: types.Message) -> str | dict:
+    """
+    Разбор /ask_random: строка — готовый ответ об ошибке,
+    dict — аргументы для _stream_answer (общие для sync и asyncio-бота).
+    """
     q = message.text.replace("/ask_random", "", 1).strip()
     if not q:
-        bot.reply_to(message, "Использование: /ask_random <вопрос>")
-        return
+        return "Использование: /ask_random <вопрос>"
     q = q[:600]
 
     items = list_characters()
     if not items:
-        bot.reply_to(message, "Каталог персонажей пуст.")
-        return
+        return "Каталог персонажей пуст."
     chosen = random.choice(items)
     character = get_character_by_id(chosen["id"])
 
     msgs = _build_messages_for_character(character, q)
     model_key = get_active_model()["key"]
-    try:
-        text, ms = chat_once(msgs, model=model_key, temperature=0.2, max_tokens=400)
-        out = (text or "").strip()[:4000]
-        bot.reply_to(message, f"{out}\n\n({ms} сек; модель: {model_key}; как: {character['name']})")
-    except OpenRouterError as e:
-        bot.reply_to(message, f"Ошибка: {e}")
-    except Exception:
-        bot.reply_to(message, "Непредвиденная ошибка.")
+    return {"msgs": msgs, "model_key": model_key, "who": f"как: {character['name']}",
+            "priority": llm_limiter.PRIORITY_RANDOM}
+
+
+@bot.message_handler(commands=["ask_random"])
+def cmd_ask_random(message: types.Message) -> None:
+    plan = _plan_ask_random(message)
+    if isinstance(plan, str):
+        bot.reply_to(message, plan)
+        return
+    _stream_answer(message, **plan)
 
 
 @bot.message_handler(commands=["models"])
@@ -292,11 +414,12 @@ def cmd_start(message: types.Message) -> None:
         "Команды:\n"
         " /note_add <текст>\n"
         " /note_list [N]\n"
-        " /note_find <подстрока>\n"
+        " /note_find <слова, префикс*, \"фраза\">\n"
         " /note_edit <id> <текст>\n"
         " /note_del <id>\n"
         " /note_count\n"
-        " /note_export\n"
+        " /note_export [txt|jsonl|csv] [gz]\n"
+        " /note_import (документ txt|jsonl|csv)\n"
         " /note_stats [days]\n"
         " /models\n"
         " /model <id>\n"
@@ -306,6 +429,7 @@ def cmd_start(message: types.Message) -> None:
         " /character <id>\n"
         " /whoami\n"
         " /ask_model <ID> <вопрос>\n"
+        " /llm_stats\n"
     )
     bot.reply_to(message, text)
 
@@ -322,6 +446,7 @@ def help_cmd(message):
 /note_del <id> - Удалить заметку
 /note_count - Показать количество заметок
 /note_export - Экспортировать заметки в файл
+/note_import - Загрузить заметки из файла (подпись к документу)
 /note_stats - Статистика активности
 """
     bot.reply_to(message, help_text)
@@ -330,30 +455,23 @@ def help_cmd(message):
 @bot.message_handler(commands=['note_add'])
 def note_add(message):
     log_activity(message.from_user.id)
-
-    # Проверяем лимит заметок
-    user_notes_count = count_user_notes(message.from_user.id)
-    if user_notes_count >= MAX_NOTES_PER_USER:
-        bot.reply_to(message, f"❌ Превышен лимит заметок! Максимум {MAX_NOTES_PER_USER} заметок на пользователя.")
-        return
-
-    global note_counter
     text = message.text.replace('/note_add', '').strip()
     if not text:
         bot.reply_to(message, "Ошибка: Укажите текст заметки.")
         return
 
-    notes[note_counter] = text
-    save_notes()  # Сохраняем после добавления
-    bot.reply_to(message, f"✅ Заметка #{note_counter} добавлена: {text}")
-    note_counter += 1
+    # Лимит проверяется в том же запросе, что и вставка
+    note_id = add_note(message.from_user.id, text, max_notes=MAX_NOTES_PER_USER)
+    if note_id is None:
+        bot.reply_to(message, f"❌ Превышен лимит заметок! Максимум {MAX_NOTES_PER_USER} заметок на пользователя.")
+        return
+    bot.reply_to(message, f"✅ Заметка #{note_id} добавлена: {text}")
 
 
 @bot.message_handler(commands=['note_count'])
 def note_count(message):
     log_activity(message.from_user.id)
-    count = len(notes)
-    user_notes_count = count_user_notes(message.from_user.id)
+    count = count_user_notes(message.from_user.id)
 
     if count == 0:
         bot.reply_to(message, "У вас пока нет заметок.")
@@ -365,14 +483,80 @@ def note_count(message):
         bot.reply_to(message, f"У вас {count} заметок. (Лимит: {MAX_NOTES_PER_USER})")
 
 
+NOTE_LIST_PAGE = 10
+
+
+def _note_list_page(user_id, size, before_id=None, after_id=None):
+    """
+    Страница /note_list и клавиатура ◀/▶. В callback_data — направление,
+    id крайней заметки (keyset-курсор) и размер страницы: nl:o:<id>:<size>.
+    """
+    rows, has_older, has_newer = list_notes_page(user_id, size, before_id=before_id, after_id=after_id)
+    if not rows:
+        return None, None
+    # Каждая строка укорачивается, чтобы страница влезла в лимит Telegram (4096)
+    width = max(40, 3800 // len(rows))
+    lines = []
+    for r in rows:
+        line = f"{r['id']}: {r['text']}"
+        lines.append(line if len(line) <= width else line[:width - 1] + "…")
+    response = "📝 Список заметок:\n" + "\n".join(lines)
+    buttons = []
+    if has_newer:
+        buttons.append(types.InlineKeyboardButton("◀ Новее", callback_data=f"nl:n:{rows[0]['id']}:{size}"))
+    if has_older:
+        buttons.append(types.InlineKeyboardButton("Старше ▶", callback_data=f"nl:o:{rows[-1]['id']}:{size}"))
+    kb = None
+    if buttons:
+        kb = types.InlineKeyboardMarkup()
+        kb.row(*buttons)
+    return response, kb
+
+
 @bot.message_handler(commands=['note_list'])
 def note_list(message):
     log_activity(message.from_user.id)
-    if not notes:
+    arg = message.text.replace('/note_list', '', 1).strip()
+    size = min(int(arg), MAX_NOTES_PER_USER) if arg.isdigit() and int(arg) > 0 else NOTE_LIST_PAGE
+    response, kb = _note_list_page(message.from_user.id, size)
+    if response is None:
         bot.reply_to(message, "Заметок пока нет.")
         return
-    response = "📝 Список заметок:\n" + "\n".join([f"{id}: {text}" for id, text in notes.items()])
-    bot.reply_to(message, response)
+    bot.reply_to(message, response, reply_markup=kb)
+
+
+@bot.callback_query_handler(func=lambda c: c.data.startswith("nl:"))
+def note_list_page(c):
+    origin = c.message.reply_to_message
+    if origin is None or origin.from_user.id != c.from_user.id:
+        bot.answer_callback_query(c.id, "Это не ваш список.")
+        return
+    _, direction, note_id, size = c.data.split(":")
+    if direction == "o":
+        response, kb = _note_list_page(c.from_user.id, int(size), before_id=int(note_id))
+    else:
+        response, kb = _note_list_page(c.from_user.id, int(size), after_id=int(note_id))
+    bot.answer_callback_query(c.id)
+    if response is None:
+        bot.edit_message_text("Заметок пока нет.", c.message.chat.id, c.message.message_id)
+        return
+    bot.edit_message_text(response, c.message.chat.id, c.message.message_id, reply_markup=kb)
+
+
+NOTE_FIND_PAGE = 10
+
+
+def _note_find_page(user_id, query, cursor=None):
+    """Текст страницы результатов и клавиатура «Ещё» (cursor — в callback_data)."""
+    rows, next_cursor = search_notes(user_id, query, NOTE_FIND_PAGE, cursor)
+    if not rows:
+        return None, None
+    response = "🔍 Найденные заметки:\n" + "\n".join([f"{r['id']}: {r['snippet']}" for r in rows])
+    kb = None
+    if next_cursor:
+        kb = types.InlineKeyboardMarkup()
+        kb.add(types.InlineKeyboardButton("Ещё ▶", callback_data=f"nf:{next_cursor}"))
+    return response, kb
 
 
 @bot.message_handler(commands=['note_find'])
@@ -380,14 +564,29 @@ def note_find(message):
     log_activity(message.from_user.id)
     query = message.text.replace('/note_find', '').strip()
     if not query:
-        bot.reply_to(message, "Ошибка: Укажите поисковый запрос.")
+        bot.reply_to(message, 'Ошибка: Укажите поисковый запрос (слово, префикс* или "фраза").')
         return
-    found = {id: text for id, text in notes.items() if query in text}
-    if not found:
+    response, kb = _note_find_page(message.from_user.id, query)
+    if response is None:
         bot.reply_to(message, "Заметки не найдены.")
         return
-    response = "🔍 Найденные заметки:\n" + "\n".join([f"{id}: {text}" for id, text in found.items()])
-    bot.reply_to(message, response)
+    bot.reply_to(message, response, reply_markup=kb)
+
+
+@bot.callback_query_handler(func=lambda c: c.data.startswith("nf:"))
+def note_find_more(c):
+    # Запрос берём из исходной команды /note_find, на которую отвечает сообщение
+    origin = c.message.reply_to_message
+    if origin is None or origin.from_user.id != c.from_user.id:
+        bot.answer_callback_query(c.id, "Это не ваш поиск.")
+        return
+    query = origin.text.replace('/note_find', '').strip()
+    response, kb = _note_find_page(c.from_user.id, query, c.data[len("nf:"):])
+    bot.answer_callback_query(c.id)
+    if response is None:
+        bot.edit_message_reply_markup(c.message.chat.id, c.message.message_id, reply_markup=None)
+        return
+    bot.edit_message_text(response, c.message.chat.id, c.message.message_id, reply_markup=kb)
 
 
 @bot.message_handler(commands=['note_edit'])
@@ -403,11 +602,9 @@ def note_edit(message):
     except ValueError:
         bot.reply_to(message, "Ошибка: ID должен быть числом.")
         return
-    if note_id not in notes:
+    if not update_note(message.from_user.id, note_id, new_text):
         bot.reply_to(message, f"Ошибка: Заметка #{note_id} не найдена.")
         return
-    notes[note_id] = new_text
-    save_notes()  # Сохраняем после изменения
     bot.reply_to(message, f"✏️ Заметка #{note_id} изменена на: {new_text}")
 
 
@@ -423,61 +620,136 @@ def note_del(message):
     except ValueError:
         bot.reply_to(message, "Ошибка: ID должен быть числом.")
         return
-    if note_id not in notes:
+    if not delete_note(message.from_user.id, note_id):
         bot.reply_to(message, f"Ошибка: Заметка #{note_id} не найдена.")
         return
-    del notes[note_id]
-    save_notes()  # Сохраняем после удаления
     bot.reply_to(message, f"🗑️ Заметка #{note_id} удалена.")
 
 
 @bot.message_handler(commands=['note_export'])
 def note_export(message):
     log_activity(message.from_user.id)
-    if not notes:
+    args = message.text.replace('/note_export', '', 1).lower().split()
+    fmt = next((a for a in args if a in EXPORT_FORMATS), "txt")
+    compress = True if "gz" in args else None  # None — gzip сам для больших выгрузок
+    if any(a not in EXPORT_FORMATS and a != "gz" for a in args):
+        bot.reply_to(message, "Использование: /note_export [txt|jsonl|csv] [gz]")
+        return
+
+    # Файл собирается в памяти (большой — в анонимном временном файле), без имён на диске
+    buf, filename, count = export_notes(message.from_user.id, fmt, compress)
+    if buf is None:
         bot.reply_to(message, "Нет заметок для экспорта.")
         return
+    with buf:
+        bot.send_document(message.chat.id, buf, visible_file_name=filename,
+                          caption=f"📁 Ваши заметки экспортированы! ({count})")
+
+
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # больше Bot API не отдаёт через getFile
+IMPORT_USAGE = ("Использование: пришлите файл .txt, .jsonl или .csv (можно .gz) "
+                "с подписью /note_import [txt|jsonl|csv] или ответьте этой командой на документ.")
+
+
+def _import_document(message, document, args):
+    fmt, gz = detect_format(document.file_name)
+    fmt = next((a for a in args if a in IMPORT_FORMATS), fmt)
+    if fmt is None or any(a not in IMPORT_FORMATS for a in args):
+        bot.reply_to(message, IMPORT_USAGE)
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        bot.reply_to(message, "❌ Файл слишком большой: не больше 20 МБ.")
+        return
 
-    # Создаем имя файла с timestamp
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"notes_{timestamp}.txt"
+    # Файл читается из ответа по мере разбора и пишется в БД пачками
+    failed, error = 0, None
+    try:
+        url = bot.get_file_url(document.file_id)
+        with requests.get(url, stream=True, timeout=60) as resp:
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            imported, skipped, over_quota = import_notes(
+                message.from_user.id, resp.raw, fmt, gz, max_notes=MAX_NOTES_PER_USER)
+    except ImportFailed as e:
+        # Часть пачек уже в БД — сообщаем, сколько именно, чтобы не гадать о повторе
+        imported, skipped, over_quota, failed = e.imported, e.skipped, e.over_quota, e.failed
+        error = e.__cause__ or e
+    except Exception as e:
+        # До чтения файла: getFile, HTTP-ошибка, таймаут — в БД ничего не записано
+        bot.reply_to(message, f"❌ Не удалось скачать файл, ничего не импортировано: {e}")
+        return
 
-    # Записываем заметки в файл
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(f"Экспорт заметок от {datetime.datetime.now().strftime('%d.%m.%Y %H:%M')}\n")
-        f.write("=" * 50 + "\n\n")
-        for note_id, text in notes.items():
-            f.write(f"Заметка #{note_id}:\n")
-            f.write(f"{text}\n")
-            f.write("-" * 30 + "\n")
+    text = f"📥 Импортировано заметок: {imported}"
+    if skipped:
+        text += f"\nПропущено пустых, битых или слишком длинных строк: {skipped}"
+    if over_quota:
+        text += f"\n❌ Не влезло в лимит ({MAX_NOTES_PER_USER} заметок): {over_quota}"
+    if error is not None:
+        text += (f"\n❌ Файл не дочитан ({type(error).__name__}: {error}); "
+                 f"прочитано, но не сохранено: {failed}. Импортированные заметки уже сохранены — "
+                 f"при повторном импорте того же файла они задвоятся.")
+    bot.reply_to(message, text)
 
-    # Отправляем файл пользователю
-    with open(filename, 'rb') as f:
-        bot.send_document(message.chat.id, f, caption="📁 Ваши заметки экспортированы!")
 
-    # Удаляем временный файл
-    os.remove(filename)
+@bot.message_handler(content_types=['document'],
+                     func=lambda m: (m.caption or '').startswith('/note_import'))
+def note_import_document(message):
+    log_activity(message.from_user.id)
+    args = message.caption.replace('/note_import', '', 1).lower().split()
+    _import_document(message, message.document, args)
 
 
-@bot.message_handler(commands=["ask_model"])
-def cmd_ask_model(message: types.Message) -> None:
+@bot.message_handler(commands=['note_import'])
+def note_import(message):
+    log_activity(message.from_user.id)
+    reply = message.reply_to_message
+    if reply is None or reply.document is None:
+        bot.reply_to(message, IMPORT_USAGE)
+        return
+    args = message.text.replace('/note_import', '', 1).lower().split()
+    _import_document(message, reply.document, args)
+
+
+def _plan_ask(message: types.Message) -> str | dict:
+    q = message.text.replace("/ask", "", 1).strip()
+    if not q:
+        return "Использование: /ask <вопрос>"
+    q = q[:600]
+
+    character, system = get_user_prompt(message.from_user.id)
+    msgs = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": q},
+    ]
+    model_key = get_active_model()["key"]
+    return {"msgs": msgs, "model_key": model_key, "who": f"как: {character['name']}"}
+
+
+@bot.message_handler(commands=["ask"])
+def cmd_ask(message: types.Message) -> None:
     """
-    Выполнить запрос к конкретной модели по ID без смены активной модели
-    Использование: /ask_model <ID модели> <вопрос>
+    Вопрос активной модели от лица выбранного персонажа.
+    Использование: /ask <вопрос>
     """
+    plan = _plan_ask(message)
+    if isinstance(plan, str):
+        bot.reply_to(message, plan)
+        return
+    _stream_answer(message, **plan)
+
+
+def _plan_ask_model(message: types.Message) -> str | dict:
     user_id = message.from_user.id
     args = message.text.replace("/ask_model", "", 1).strip().split(maxsplit=1)
 
     if len(args) < 2 or not args[0].isdigit():
-        bot.reply_to(message, "Использование: /ask_model <ID модели> <вопрос>\n\nСписок моделей: /models")
-        return
+        return "Использование: /ask_model <ID модели> <вопрос>\n\nСписок моделей: /models"
 
     model_id = int(args[0])
     question = args[1].strip()[:600]
 
     if not question:
-        bot.reply_to(message, "Ошибка: Укажите текст вопроса.")
-        return
+        return "Ошибка: Укажите текст вопроса."
 
     # Получаем информацию о запрашиваемой модели
     try:
@@ -489,52 +761,111 @@ def cmd_ask_model(message: types.Message) -> None:
                 break
 
         if not target_model:
-            bot.reply_to(message, f"Ошибка: Модель с ID {model_id} не найдена.\nСписок моделей: /models")
-            return
+            return f"Ошибка: Модель с ID {model_id} не найдена.\nСписок моделей: /models"
 
     except Exception as e:
-        bot.reply_to(message, f"Ошибка при получении списка моделей: {e}")
-        return
+        return f"Ошибка при получении списка моделей: {e}"
 
-    # Получаем текущего персонажа пользователя
+    # Персонаж пользователя и готовый system-промпт (из LRU в db.py)
     try:
-        character = get_user_character(user_id)
+        character, system = get_user_prompt(user_id)
     except Exception as e:
-        bot.reply_to(message, f"Ошибка при получении персонажа: {e}")
-        return
+        return f"Ошибка при получении персонажа: {e}"
 
-    # Формируем сообщения для персонажа
-    msgs = _build_messages_for_character(character, question)
+    msgs = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": question},
+    ]
 
-    # Выполняем запрос к указанной модели
-    try:
-        text, ms = chat_once(msgs, model=target_model["key"], temperature=0.2, max_tokens=400)
-        out = (text or "").strip()[:4000]
+    # Заголовок с информацией о модели
+    active_model = get_active_model()
+    model_info = f"🎯 Запрос к модели: {target_model['label']}\n"
+    if target_model["id"] == active_model["id"]:
+        model_info += f"📋 (текущая активная модель)\n"
 
-        # Формируем ответ с информацией о модели
-        active_model = get_active_model()
-        model_info = f"🎯 Запрос к модели: {target_model['label']}\n"
-        if target_model["id"] == active_model["id"]:
-            model_info += f"📋 (текущая активная модель)\n"
+    # Модель выбрана явно — без перехода на резервные, только повторы
+    return {"msgs": msgs, "model_key": target_model["key"], "header": f"{model_info}\n",
+            "who": f"персонаж: {character['name']}", "error_prefix": "❌ Ошибка API",
+            "fallback": False}
 
-        bot.reply_to(message,
-                     f"{model_info}\n{out}\n\n({ms} мс; модель: {target_model['key']}; персонаж: {character['name']})")
 
-    except OpenRouterError as e:
-        bot.reply_to(message, f"❌ Ошибка API: {e}")
-    except Exception as e:
-        bot.reply_to(message, f"❌ Непредвиденная ошибка: {e}")
+@bot.message_handler(commands=["ask_model"])
+def cmd_ask_model(message: types.Message) -> None:
+    """
+    Выполнить запрос к конкретной модели по ID без смены активной модели
+    Использование: /ask_model <ID модели> <вопрос>
+    """
+    plan = _plan_ask_model(message)
+    if isinstance(plan, str):
+        bot.reply_to(message, plan)
+        return
+    # Ответ выводится по мере генерации
+    _stream_answer(message, **plan)
+
+@bot.message_handler(commands=["llm_stats"])
+def cmd_llm_stats(message: types.Message) -> None:
+    """Счётчики кэша ответов LLM и состояние моделей."""
+    if llm_cache.ENABLED:
+        st = llm_cache.cache.stats()
+        text = ("🧠 Кэш ответов LLM:\n"
+                f"• попадания (память): {st['hits_memory']}\n"
+                f"• попадания (БД): {st['hits_db']}\n"
+                f"• промахи: {st['misses']}\n"
+                f"• доля попаданий: {st['hit_ratio']:.0%}\n"
+                f"• записей в памяти: {st['memory_entries']}\n")
+    else:
+        text = "🧠 Кэш ответов выключен (LLM_CACHE=1 в .env).\n"
+
+    calls = llm_flights.calls + llm_async_flights.calls
+    executions = llm_flights.executions + llm_async_flights.executions
+    if calls:
+        text += (f"\n🔗 Склейка запросов: {calls} вопросов → {executions} запросов к модели "
+                 f"(дедупликация {1 - executions / calls:.0%})\n")
+
+    lim = llm_limiter.limiter.stats()
+    text += (f"\n🚦 Очередь к модели: {lim['queued']} ждут, допущено {lim['admitted']}\n"
+             f"• ожидание: среднее {lim['wait_avg_s']:.1f} с, p95 {lim['wait_p95_s']:.1f} с\n"
+             f"• отказы: частые запросы {lim['rejected_user']}, "
+             f"очередь полна {lim['rejected_full']}, таймаут {lim['timed_out']}\n")
+
+    states = llm_router.breaker_states()
+    if states:
+        text += "\n🔌 Модели:\n" + "\n".join(f"• {key}: {state}" for key, state in states.items())
+    bot.reply_to(message, text)
+
+
+@bot.message_handler(commands=["note_reconcile"])
+def cmd_note_reconcile(message: types.Message) -> None:
+    """Пересчитать счётчики заметок, если они разошлись с таблицей notes."""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.reply_to(message, "⛔ Команда доступна только администраторам.")
+        return
+    fixed = reconcile_note_counts()
+    if fixed:
+        bot.reply_to(message, f"🔧 Счётчики заметок исправлены у {fixed} пользователей.")
+    else:
+        bot.reply_to(message, "✅ Счётчики заметок сходятся с таблицей.")
+
 
 @bot.message_handler(commands=['note_stats'])
 def note_stats(message):
     log_activity(message.from_user.id)
     user_id = message.from_user.id
+    arg = message.text.replace('/note_stats', '', 1).strip()
+    if arg and not (arg.isdigit() and 1 <= int(arg) <= MAX_STATS_DAYS):
+        bot.reply_to(message, f"Использование: /note_stats [дней, 1–{MAX_STATS_DAYS}]")
+        return
+    days = int(arg) if arg else 7
+
+    # Вся история — одна битовая карта: любые диапазоны считаются масками
+    history = activity.history(user_id)
+    today = datetime.date.today()
 
     # Создаем ASCII график активности
-    chart = create_activity_chart(user_id)
+    chart = create_activity_chart(user_id, history, today) + "\n\n" + create_month_heatmap(history, today) + "\n"
 
     # Добавляем общую статистику
-    total_notes = len(notes)
+    total_notes = count_notes()
     user_notes_count = count_user_notes(user_id)
 
     stats_text = f"\n📊 Общая статистика:\n"
@@ -542,13 +873,19 @@ def note_stats(message):
     stats_text += f"• Ваших заметок: {user_notes_count}\n"
     stats_text += f"• Лимит: {MAX_NOTES_PER_USER} заметок\n"
 
-    if user_id in user_activity:
-        total_active_days = len(user_activity[user_id])
-        stats_text += f"• Всего активных дней: {total_active_days}"
+    since = today - datetime.timedelta(days=days - 1)
+    stats_text += f"• Активных дней за {days} дн.: {history.count(since, today)}\n"
+    stats_text += f"• Текущая серия: {history.current_streak(today)} дн., рекорд: {history.longest_streak()} дн.\n"
+    stats_text += f"• Всего активных дней: {history.total()}\n\n"
+    stats_text += create_notes_summary(user_id, days, today)
 
     bot.reply_to(message, chart + stats_text)
 
 
 if __name__ == "__main__":
     print("Бот запускается...")
-    bot.infinity_polling(skip_pending=True)
\ No newline at end of file
+    try:
+        bot.infinity_polling(skip_pending=True)
+    finally:
+        activity.stop()  # дописать накопленную активность
+        close_db()
\ No newline at end of file
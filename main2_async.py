@@ -0,0 +1,172 @@
+"""
+main2_async.py — asyncio-запуск заметочника (main2) на AsyncTeleBot.
+
+/ask, /ask_random и /ask_model идут через aiohttp (openrouter_client.achat_stream):
+ожидание ответа модели не занимает поток, поэтому одновременно могут
+выполняться сотни запросов.
+
+Остальные обработчики берутся из main2 как есть (тот же список и порядок
+фильтров): они короткие (SQLite, файлы), выполняются в пуле потоков через
+asyncio.to_thread и отвечают через синхронный клиент main2.bot.
+
+Запуск: python main2_async.py   (вместо python main2.py)
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+import time
+
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+
+import llm_cache
+import llm_limiter
+import llm_router
+import main2 as core
+from activity_log import activity
+from db import close_db
+from openrouter_client import achat_stream, get_async_client, OpenRouterError
+from singleflight import make_key
+from tg_stream import AsyncThrottledEditor
+
+log = logging.getLogger(__name__)
+
+abot = AsyncTeleBot(core.TOKEN)
+
+# Команды с «родной» async-реализацией: команда -> разбор из main2
+LLM_COMMANDS = {
+    "ask": core._plan_ask,
+    "ask_random": core._plan_ask_random,
+    "ask_model": core._plan_ask_model,
+}
+
+
+async def _safe_finish(editor: AsyncThrottledEditor, message: types.Message, text: str) -> None:
+    """asyncio-версия main2._safe_finish: не вышла правка — отдельный ответ."""
+    try:
+        if await editor.finish(text):
+            return
+        log.warning("Final edit did not land, replying instead")
+    except Exception:
+        log.exception("Final edit failed, replying instead")
+    try:
+        await abot.reply_to(message, text)
+    except Exception:
+        log.exception("Reply after failed edit failed")
+
+
+async def _stream_answer(message: types.Message, msgs: list[dict], model_key: str, *,
+                         header: str = "", who: str = "", error_prefix: str = "Ошибка",
+                         fallback: bool = True, priority: int = llm_limiter.PRIORITY_ASK) -> None:
+    """asyncio-версия main2._stream_answer."""
+    cache_key = None
+    if llm_cache.ENABLED:
+        cache_key = llm_cache.make_key(model_key, msgs, core.LLM_TEMPERATURE, core.LLM_MAX_TOKENS)
+        cached = await asyncio.to_thread(llm_cache.cache.get, cache_key)
+        if cached is not None:
+            footer = f"\n\n(из кэша; модель: {model_key}; {who})"
+            await abot.reply_to(message, f"{header}{cached[:4000 - len(header) - len(footer)]}{footer}")
+            return
+
+    try:
+        llm_limiter.limiter.check_user(message.from_user.id)
+    except llm_limiter.LimitError as e:
+        await abot.reply_to(message, str(e))
+        return
+
+    placeholder = await abot.reply_to(message, f"{header}⏳ Думаю…")
+    editor = AsyncThrottledEditor(abot, placeholder.chat.id, placeholder.message_id)
+    async def open_stream(key: str, timeout_s: float):
+        it = achat_stream(msgs, model=key, temperature=core.LLM_TEMPERATURE,
+                          max_tokens=core.LLM_MAX_TOKENS, timeout_s=timeout_s).__aiter__()
+        try:
+            return await it.__anext__(), it
+        except StopAsyncIteration:
+            return "", it
+
+    flight_key = make_key(model_key, msgs, core.LLM_TEMPERATURE, core.LLM_MAX_TOKENS, fallback)
+    watchers = core.llm_async_watchers
+
+    async def produce() -> tuple[str, str]:
+        ticket = llm_limiter.limiter.enqueue(priority)
+        if ticket.position:
+            await watchers.apublish(flight_key, f"⏳ В очереди к модели: {ticket.position + 1}-й")
+        await llm_limiter.limiter.await_turn(ticket)
+        (text, rest), used_key = await llm_router.acall_with_fallback(
+            open_stream, model_key, fallback=fallback, acquire=llm_limiter.limiter.await_global)
+        await watchers.apublish(flight_key, f"{text} ▌")
+        async for delta in rest:
+            text += delta
+            await watchers.apublish(flight_key, f"{text} ▌")
+        return text, used_key
+
+    async def show(body: str) -> None:
+        await editor.update(f"{header}{body}")
+
+    t0 = time.perf_counter()
+    try:
+        with watchers.watch(flight_key, show):
+            (text, used_key), shared = await core.llm_async_flights.do(flight_key, produce)
+        ms = int((time.perf_counter() - t0) * 1000)
+        footer = f"\n\n({ms} мс; {core._model_note(used_key, model_key)}; {who})"
+        out = text.strip()[:4000 - len(header) - len(footer)]
+        await _safe_finish(editor, message, f"{header}{out}{footer}")
+        if llm_cache.ENABLED and text.strip() and not shared:
+            if used_key != model_key:
+                cache_key = llm_cache.make_key(used_key, msgs, core.LLM_TEMPERATURE, core.LLM_MAX_TOKENS)
+            await asyncio.to_thread(llm_cache.cache.put, cache_key, used_key, text.strip())
+    except OpenRouterError as e:
+        await _safe_finish(editor, message, f"{error_prefix}: {e}")
+    except llm_limiter.LimitError as e:
+        await _safe_finish(editor, message, f"{header}{e}")
+    except Exception:
+        log.exception("LLM handler failed")
+        await _safe_finish(editor, message, "Непредвиденная ошибка.")
+
+
+def _llm_handler(plan_fn):
+    async def handler(message: types.Message) -> None:
+        # Разбор трогает SQLite — выносим из event loop
+        plan = await asyncio.to_thread(plan_fn, message)
+        if isinstance(plan, str):
+            await abot.reply_to(message, plan)
+            return
+        await _stream_answer(message, **plan)
+    return handler
+
+
+def _in_thread(fn):
+    async def handler(obj) -> None:
+        await asyncio.to_thread(fn, obj)
+    handler.__name__ = fn.__name__
+    return handler
+
+
+def setup_handlers() -> None:
+    for command, plan_fn in LLM_COMMANDS.items():
+        abot.register_message_handler(_llm_handler(plan_fn), commands=[command])
+
+    for h in core.bot.message_handlers:
+        if set(h["filters"].get("commands") or ()) & LLM_COMMANDS.keys():
+            continue
+        abot.register_message_handler(_in_thread(h["function"]), **h["filters"])
+
+    for h in core.bot.callback_query_handlers:
+        abot.register_callback_query_handler(_in_thread(h["function"]), **h["filters"])
+
+
+async def main() -> None:
+    setup_handlers()
+    try:
+        await abot.infinity_polling(skip_pending=True)
+    finally:
+        await get_async_client().close()
+        await abot.close_session()
+        activity.stop()
+        close_db()
+
+
+if __name__ == "__main__":
+    print("Бот (asyncio) запускается...")
+    asyncio.run(main())
@@ -12,27 +12,33 @@ main.py — DailyZodiakBot (развлекательный контент без
   /signs                  — показать список знаков
 
 Рассылка:
-  - фоновый поток проверяет раз в минуту: кому отправить сейчас;
-  - условие: subscribed=1, notify_hour == now.hour, last_sent_date != today.
+  - фоновый поток спит до ближайшего HH:00 (daily_scheduler.py), а не опрашивает БД раз в минуту;
+    сама рассылка часа — в отдельном потоке (executor), чтобы не задерживать следующий час;
+  - условие: subscribed=1, notify_hour == now.hour, last_sent_date != today;
+  - /set_time, /subscribe и выбор знака будят поток, если их час уже идёт.
 """
 
 from __future__ import annotations
 import logging
-import threading
-import time
 import hashlib
-from datetime import datetime, date
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 
 import telebot
 from telebot import types
 
 import db2 as db
 from config2 import TOKEN, DEFAULT_NOTIFY_HOUR
+from daily_scheduler import DailyScheduler, SentMarks
+from broadcast import Broadcaster
 
 log = logging.getLogger(__name__)
 
 bot = telebot.TeleBot(TOKEN)
 db.init_db()  # создаём схемы, если их нет
+if recovered := db.recover_sending():  # прошлый запуск упал посреди рассылки
+    log.warning("Recovered %d unconfirmed deliveries as sent", recovered)
 
 # ---------- справочник знаков: канон, синонимы, эмодзи ----------
 CANON_SIGNS = [
@@ -89,33 +95,58 @@ LUCK = [
 COLOR = ["синий", "зелёный", "жёлтый", "красный", "фиолетовый", "белый", "оранжевый"]
 NUMBER = [3, 4, 5, 6, 7, 8, 9]
 
-def _pick(seq: list, seed: bytes, salt: str) -> str:
-    h = hashlib.md5(seed + salt.encode("utf-8")).hexdigest()
-    idx = int(h, 16) % len(seq)
-    return str(seq[idx])
+# Части текста и их соли; соли закодированы заранее, списки — уже строками
+_PARTS = [
+    (tuple(map(str, seq)), salt.encode("utf-8"))
+    for seq, salt in ((INTRO, ":intro"), (FOCUS, ":focus"), (ADVICE, ":advice"),
+                      (LUCK, ":luck"), (COLOR, ":color"), (NUMBER, ":num"))
+]
 
-def make_daily_text(sign: str, for_date: date) -> str:
+def _pick(seq: tuple, seed_md5, salt: bytes) -> str:
+    # md5(seed + salt): префикс seed уже посчитан, дохэшируем только соль;
+    # int.from_bytes(digest) — то же число, что int(hexdigest, 16), но без hex-строки
+    h = seed_md5.copy()
+    h.update(salt)
+    return seq[int.from_bytes(h.digest(), "big") % len(seq)]
+
+def _render_daily_text(sign: str, for_date: date) -> str:
     """
     Генерирует 3–4 коротких фразы и пару «фишек» (цвет, число).
     Детерминированно для (sign, date) — без внешних API.
     """
-    iso = for_date.isoformat().encode("utf-8")
-    sgn = sign.encode("utf-8")
-    intro = _pick(INTRO, sgn+iso, ":intro")
-    focus = _pick(FOCUS, sgn+iso, ":focus")
-    advice = _pick(ADVICE, sgn+iso, ":advice")
-    luck = _pick(LUCK, sgn+iso, ":luck")
-    color = _pick(COLOR, sgn+iso, ":color")
-    number = _pick(NUMBER, sgn+iso, ":num")
+    iso = for_date.isoformat()  # то же, что strftime('%Y-%m-%d'), но в разы быстрее
+    seed_md5 = hashlib.md5((sign + iso).encode("utf-8"))
+    intro, focus, advice, luck, color, number = [_pick(seq, seed_md5, salt) for seq, salt in _PARTS]
 
     emoji = SIGN_EMOJI.get(sign, "")
     return (
-        f"{emoji} *{sign.capitalize()}* — {for_date.strftime('%Y-%m-%d')}\n"
+        f"{emoji} *{sign.capitalize()}* — {iso}\n"
         f"{intro} акцент на *{focus}*; {luck}. Советы: {advice}.\n\n"
         f"Счастливый цвет: *{color}*, число дня: *{number}*.\n"
         f"_Развлекательный контент._"
     )
 
+# Текстов в день всего 12 (по знаку): считаем таблицу дня один раз на дату,
+# /today и рассылка берут готовое. Держим две последние даты — старые выкидываем.
+DAILY_CACHE_DAYS = 2
+_daily_texts: dict[date, dict[str, str]] = {}
+_daily_lock = threading.Lock()
+
+def make_daily_text(sign: str, for_date: date) -> str:
+    text = _daily_texts.get(for_date, {}).get(sign)
+    if text is not None:
+        return text
+    with _daily_lock:
+        table = _daily_texts.get(for_date)
+        if table is None:
+            table = {s: _render_daily_text(s, for_date) for s in CANON_SIGNS}
+            _daily_texts[for_date] = table
+            for old in sorted(_daily_texts)[:-DAILY_CACHE_DAYS]:
+                del _daily_texts[old]
+        if sign not in table:
+            table[sign] = _render_daily_text(sign, for_date)
+        return table[sign]
+
 
 # ---------- вспомогательные утилиты ----------
 def user_mention(m: types.Message) -> str:
@@ -166,6 +197,7 @@ def cmd_set_sign(message: types.Message) -> None:
         return
     db.ensure_user(message.from_user.id)
     db.set_sign(message.from_user.id, s)
+    wake_scheduler(message.from_user.id)
     bot.reply_to(message, f"Знак сохранён: {SIGN_EMOJI[s]} {s.capitalize()}")
 
 
@@ -178,6 +210,7 @@ def cmd_set_time(message: types.Message) -> None:
         return
     db.ensure_user(message.from_user.id)
     db.set_notify_hour(message.from_user.id, hour)
+    scheduler.notify(hour)
     bot.reply_to(message, f"Час отправки сохранён: {hour}:00")
 
 
@@ -185,6 +218,7 @@ def cmd_set_time(message: types.Message) -> None:
 def cmd_subscribe(message: types.Message) -> None:
     db.ensure_user(message.from_user.id)
     db.set_subscribed(message.from_user.id, True)
+    wake_scheduler(message.from_user.id)
     bot.reply_to(message, "Подписка включена. Я пришлю сообщение в заданный час.")
 
 
@@ -227,35 +261,49 @@ def kb_pick_sign(message: types.Message) -> None:
     s = (message.text or "").strip().lower()
     db.ensure_user(message.from_user.id)
     db.set_sign(message.from_user.id, s)
+    wake_scheduler(message.from_user.id)
     bot.reply_to(message, f"Знак сохранён: {SIGN_EMOJI[s]} {s.capitalize()}")
 
 
 # ---------- планировщик ежедневной отправки ----------
-def scheduler_loop() -> None:
-    log.info("Scheduler started")
-    while True:
-        now = datetime.now()               # время сервера
-        today_str = now.strftime("%Y-%m-%d")
-        hour = now.hour
-        try:
-            due = db.list_due_users(today_str, hour)
-            for u in due:
-                # Сгенерировать текст и отправить:
-                txt = make_daily_text(u["sign"], now.date())
-                try:
-                    bot.send_message(u["user_id"], txt, parse_mode="Markdown")
-                except Exception as e:
-                    log.warning("Send failed to %s: %r", u["user_id"], e)
-                # Отметить отправку за сегодня:
-                db.mark_sent_today(u["user_id"], today_str)
-        except Exception as e:
-            log.exception("Scheduler error: %r", e)
-        time.sleep(60)  # проверяем раз в минуту
+def _send_markdown(chat_id: int, text: str) -> None:
+    bot.send_message(chat_id, text, parse_mode="Markdown")
+
+
+# Пул потоков с лимитами Telegram: общий темп, темп на чат, retry_after при 429
+broadcaster = Broadcaster(_send_markdown)
+
+
+def send_due(users, for_date: date) -> None:
+    today_str = for_date.strftime("%Y-%m-%d")
+    # Сгенерировать тексты и разослать:
+    messages = ((u["user_id"], make_daily_text(u["sign"], for_date)) for u in users)
+    # Сначала — кому шлём (одна транзакция): если упадём до записи отметок,
+    # при старте они посчитаются отправленными и второй раз не придут
+    db.claim_sending([u["user_id"] for u in users], today_str)
+    # Отметки (и о неудаче — как раньше, чтобы не долбить заблокировавших) пишутся пачками
+    marks = SentMarks(lambda ids: db.mark_sent_many(ids, today_str))
+    try:
+        broadcaster.run(messages, on_done=lambda user_id, ok: marks.add(user_id))
+    finally:
+        marks.flush()
+
+
+# Время сервера; час отрабатывается в HH:00, а не «в течение минуты».
+# Рассылка — в отдельном потоке (по часу за раз), планировщик только считает время
+scheduler = DailyScheduler(db.list_due_users, send_due,
+                           executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix="daily-send"))
+
+
+def wake_scheduler(user_id: int) -> None:
+    """Пользователь стал получателем (подписка, знак): его час, если он идёт, — сразу."""
+    row = db.get_user(user_id)
+    if row:
+        scheduler.notify(row["notify_hour"])
 
 
 def start_scheduler() -> None:
-    t = threading.Thread(target=scheduler_loop, name="daily-scheduler", daemon=True)
-    t.start()
+    scheduler.start()
 
 
 # ---------- меню команд в клиенте (см. Л2) ----------
@@ -277,4 +325,7 @@ def setup_bot_commands() -> None:
 if __name__ == "__main__":
     setup_bot_commands()        # удобство для пользователей [oai_citation:8‡L2_Текст к лекции.pdf](file-service://file-6kQEVmhZuKhD1nBDo1XNnq)
     start_scheduler()           # запускаем фоновую проверку
-    bot.infinity_polling(skip_pending=True)  # запуск long polling (паттерн Л2/Л3) [oai_citation:9‡L2_Текст к лекции.pdf](file-service://file-6kQEVmhZuKhD1nBDo1XNnq) [oai_citation:10‡L3.pdf](file-service://file-TzQZFVK22mksuAGPBby5ME)
+    try:
+        bot.infinity_polling(skip_pending=True)  # запуск long polling (паттерн Л2/Л3) [oai_citation:9‡L2_Текст к лекции.pdf](file-service://file-6kQEVmhZuKhD1nBDo1XNnq) [oai_citation:10‡L3.pdf](file-service://file-TzQZFVK22mksuAGPBby5ME)
+    finally:
+        db.close_db()
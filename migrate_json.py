@@ -0,0 +1,256 @@
+"""
+migrate_json.py — разовый перенос notes.json и activity.json в bot.db.
+
+Файлы читаются потоком: парсер идёт по верхнему объекту и отдаёт по одной
+паре «ключ: значение», не загружая весь JSON в память. Записи копятся пачками
+и пишутся в SQLite вместе с контрольной точкой (байт, до которого дочитан файл)
+одной транзакцией — db.save_json_migration_batch. Поэтому перенос можно
+прервать в любой момент: повторный запуск продолжит с контрольной точки, а уже
+перенесённый файл пропустит. Заметки не задваиваются, активность — OR битов,
+её повторная запись ничего не меняет.
+
+В старом notes.json заметки общие ({"notes": {"id": "текст"}, "counter": N}),
+без владельца, поэтому для них нужен --owner (id пользователя Telegram).
+
+Запуск из корня репозитория:
+    python migrate_json.py --owner 123456789 [--notes notes.json] [--activity activity.json]
+"""
+
+from __future__ import annotations
+import argparse
+import codecs
+import datetime
+import json
+import os
+import sys
+import time
+
+import db
+from activity_log import year_bit
+
+BATCH = int(os.getenv("MIGRATE_BATCH", "1000"))
+READ_CHUNK = 1 << 16
+PROGRESS_S = 1.0  # как часто печатать прогресс
+
+
+class JsonItems:
+    """
+    Потоковый перебор членов одного JSON-объекта (например, {"notes": {...}} →
+    пары из вложенного "notes"). Значения разбирает json.JSONDecoder.raw_decode
+    прямо из буфера, буфер дочитывается по READ_CHUNK. offset() — байт в файле
+    сразу после последнего отданного значения: с него можно продолжить (resume).
+    """
+
+    def __init__(self, f, chunk: int = READ_CHUNK):
+        self._f = f
+        self._chunk = chunk
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._base = 0  # байт файла до начала _buf
+        self._eof = False
+
+    def offset(self) -> int:
+        return self._base + len(self._buf[:self._pos].encode("utf-8"))
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        data = self._f.read(self._chunk)
+        self._eof = not data
+        self._base = self.offset()
+        self._buf = self._buf[self._pos:] + self._utf8.decode(data, final=self._eof)
+        self._pos = 0
+        return not self._eof
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._fill():
+                return self._buf[self._pos:self._pos + 1]
+
+    def _expect(self, ch: str) -> None:
+        if self._peek() != ch:
+            raise ValueError(f"ожидался {ch!r} на байте {self.offset()}")
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # число в конце буфера может продолжаться в следующем куске
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _members(self, first: bool):
+        while True:
+            if self._peek() == "}":
+                self._pos += 1
+                return
+            if not first:
+                self._expect(",")
+                if self._peek() == "}":  # висячая запятая — не JSON, но не страшно
+                    continue
+            first = False
+            key = self._value()
+            self._expect(":")
+            yield key, self._value()
+
+    def items(self, path: tuple[str, ...] = ()):
+        """Члены объекта по пути ключей от корня; нет такого ключа — ничего."""
+        self._expect("{")
+        for name in path:
+            if not self._seek_key(name):
+                return
+            self._expect("{")
+        yield from self._members(first=True)
+
+    def _seek_key(self, name: str) -> bool:
+        # Пропускает члены до name и встаёт на его значение
+        first = True
+        while self._peek() != "}":
+            if not first:
+                self._expect(",")
+            first = False
+            key = self._value()
+            self._expect(":")
+            if key == name:
+                return True
+            self._value()
+        return False
+
+    def resume(self, offset: int):
+        """Продолжить перебор с байта offset (сразу после значения члена)."""
+        self._f.seek(offset)
+        self._base, self._buf, self._pos, self._eof = offset, "", 0, False
+        yield from self._members(first=False)
+
+
+def _notes_rows(items, owner: int | None, stats: dict):
+    for _, value in items:
+        text, user_id = value, owner
+        if isinstance(value, dict):  # {"text": ..., "user_id": ...}
+            text, user_id = value.get("text"), value.get("user_id", owner)
+        if not isinstance(text, str) or not text.strip() or user_id is None:
+            stats["skipped"] += 1
+            yield None
+            continue
+        yield (int(user_id), text)
+
+
+def _activity_masks(items, stats: dict):
+    for key, days in items:
+        masks: dict[tuple[int, int], int] = {}
+        try:
+            user_id = int(key)
+            for day in days:
+                year, bit = year_bit(datetime.date.fromisoformat(day))
+                masks[(user_id, year)] = masks.get((user_id, year), 0) | 1 << bit
+        except (TypeError, ValueError):
+            stats["skipped"] += 1
+            yield None
+            continue
+        yield masks
+
+
+def migrate_file(path: str, kind: str, owner: int | None = None, batch: int = BATCH,
+                 out=sys.stdout) -> dict:
+    """
+    Перенести один файл (kind: "notes" или "activity").
+    Вернёт {"items", "skipped", "seconds", "status"}.
+    """
+    source = os.path.basename(path)
+    stats = {"items": 0, "skipped": 0, "seconds": 0.0, "status": "done"}
+    if not os.path.exists(path):
+        stats["status"] = "missing"
+        return stats
+    size = os.path.getsize(path)
+    state = db.get_json_migration(source)
+    if state and state["size"] != size:
+        raise RuntimeError(f"{source} изменился после начала переноса "
+                           f"({state['size']} → {size} байт); удалите строку из json_migrations")
+    if state and state["done"]:
+        stats["status"] = "already"
+        return stats
+    if kind == "notes" and owner is None:
+        stats["status"] = "no owner"
+        return stats
+
+    t0 = reported = time.perf_counter()
+    done_items = state["items"] if state else 0
+    with open(path, "rb") as f:
+        parser = JsonItems(f)
+        if state:
+            print(f"{source}: продолжаю с байта {state['byte_offset']}", file=out)
+            items = parser.resume(state["byte_offset"])
+        else:
+            items = parser.items(("notes",) if kind == "notes" else ())
+        rows = _notes_rows(items, owner, stats) if kind == "notes" else _activity_masks(items, stats)
+
+        notes, masks, pending = [], {}, 0
+        for row in rows:
+            pending += 1
+            if kind == "notes" and row is not None:
+                notes.append(row)
+            elif row is not None:
+                for key, mask in row.items():
+                    masks[key] = masks.get(key, 0) | mask
+            if pending >= batch:
+                done_items += pending
+                db.save_json_migration_batch(source, size, parser.offset(), done_items,
+                                             notes=notes, masks=masks)
+                stats["items"] += pending
+                notes, masks, pending = [], {}, 0
+                now = time.perf_counter()
+                if now - reported >= PROGRESS_S:
+                    reported = now
+                    print(f"{source}: {done_items} записей, {parser.offset() / size:.0%}, "
+                          f"{stats['items'] / (now - t0):.0f} записей/с", file=out)
+        done_items += pending
+        stats["items"] += pending
+        db.save_json_migration_batch(source, size, size, done_items, done=True,
+                                     notes=notes, masks=masks)
+    stats["seconds"] = time.perf_counter() - t0
+    return stats
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Перенос notes.json и activity.json в SQLite")
+    ap.add_argument("--notes", default="notes.json")
+    ap.add_argument("--activity", default="activity.json")
+    ap.add_argument("--owner", type=int, help="владелец заметок из notes.json (id в Telegram)")
+    ap.add_argument("--batch", type=int, default=BATCH)
+    args = ap.parse_args(argv)
+
+    db.init_db()
+    try:
+        for path, kind in ((args.notes, "notes"), (args.activity, "activity")):
+            stats = migrate_file(path, kind, args.owner, args.batch)
+            if stats["status"] == "missing":
+                print(f"{path}: нет файла, пропускаю")
+            elif stats["status"] == "already":
+                print(f"{path}: уже перенесён")
+            elif stats["status"] == "no owner":
+                print(f"{path}: у старых заметок нет владельца, укажите --owner <id>")
+            else:
+                mb = os.path.getsize(path) / 1e6
+                rate = stats["items"] / stats["seconds"] if stats["seconds"] else 0.0
+                print(f"{path}: {stats['items']} записей (пропущено {stats['skipped']}) "
+                      f"за {stats['seconds']:.2f} с — {rate:.0f} записей/с, "
+                      f"{mb / stats['seconds'] if stats['seconds'] else 0.0:.1f} МБ/с")
+    finally:
+        db.close_db()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
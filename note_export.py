@@ -0,0 +1,87 @@
+"""
+note_export.py — выгрузка заметок для /note_export без файлов в рабочей папке.
+
+Строки читаются из SQLite пачками (db.iter_notes), форматируются генератором
+и пишутся в SpooledTemporaryFile: до EXPORT_SPOOL_MAX байт буфер живёт в
+памяти, дальше — в анонимном временном файле (без имени, удаляется при
+закрытии). Поэтому одновременные выгрузки не пересекаются, а память не растёт
+с числом заметок. Буфер передаётся в send_document как есть.
+
+Форматы: txt (как раньше), jsonl, csv; gzip — по запросу или автоматически,
+когда заметок больше EXPORT_GZIP_OVER.
+"""
+
+from __future__ import annotations
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+
+import db
+
+FORMATS = ("txt", "jsonl", "csv")
+SPOOL_MAX = int(os.getenv("EXPORT_SPOOL_MAX", str(1024 * 1024)))
+GZIP_OVER = int(os.getenv("EXPORT_GZIP_OVER", "5000"))
+
+
+def _write_txt(out: io.TextIOBase, rows, now: datetime.datetime) -> None:
+    out.write(f"Экспорт заметок от {now.strftime('%d.%m.%Y %H:%M')}\n")
+    out.write("=" * 50 + "\n\n")
+    for r in rows:
+        out.write(f"Заметка #{r['id']}:\n")
+        out.write(f"{r['text']}\n")
+        out.write("-" * 30 + "\n")
+
+
+def _write_jsonl(out: io.TextIOBase, rows, now: datetime.datetime) -> None:
+    for r in rows:
+        out.write(json.dumps({"id": r["id"], "text": r["text"], "created_at": r["created_at"]},
+                             ensure_ascii=False))
+        out.write("\n")
+
+
+def _write_csv(out: io.TextIOBase, rows, now: datetime.datetime) -> None:
+    writer = csv.writer(out)
+    writer.writerow(("id", "text", "created_at"))
+    for r in rows:
+        writer.writerow((r["id"], r["text"], r["created_at"]))
+
+
+_WRITERS = {"txt": _write_txt, "jsonl": _write_jsonl, "csv": _write_csv}
+
+
+def export_notes(user_id: int, fmt: str = "txt", compress: bool | None = None):
+    """
+    Вернёт (буфер с начала, имя файла, число заметок) или (None, None, 0), если
+    заметок нет. compress=None — gzip только для больших выгрузок.
+    Буфер нужно закрыть после отправки.
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    count = db.count_notes(user_id)
+    if not count:
+        return None, None, 0
+    if compress is None:
+        compress = count > GZIP_OVER
+
+    now = datetime.datetime.now()
+    buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX)
+    raw = gzip.GzipFile(fileobj=buf, mode="wb") if compress else buf
+    # utf-8-sig для csv: Excel иначе не узнаёт кодировку
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig" if fmt == "csv" else "utf-8",
+                            newline="" if fmt == "csv" else None)
+    try:
+        _WRITERS[fmt](text, db.iter_notes(user_id), now)
+        text.flush()
+        text.detach()
+        if compress:
+            raw.close()  # дописывает хвост gzip, сам buf не закрывает
+    except BaseException:
+        buf.close()
+        raise
+    buf.seek(0)
+    name = f"notes_{now.strftime('%Y%m%d_%H%M%S')}.{fmt}" + (".gz" if compress else "")
+    return buf, name, count
@@ -0,0 +1,200 @@
+"""
+note_import.py — загрузка заметок из присланного документа для /note_import.
+
+Файл читается потоком (строка за строкой, без чтения целиком в память),
+тексты копятся пачками по IMPORT_CHUNK и уходят в db.add_notes: одна пачка —
+один executemany в одной короткой транзакции, так что блокировка записи не
+держится, пока разбирается весь файл. Лимит заметок проверяется внутри той же
+транзакции: когда он исчерпан, остаток файла только досчитывается.
+
+Форматы — те же, что у /note_export: txt (по заметке на строку или файл
+экспорта бота), jsonl (объекты с полем text или строки), csv (колонка text,
+без заголовка — первая колонка). Любой из них может быть сжат gzip (.gz).
+
+Если чтение оборвалось (битый gzip, обрыв загрузки, ошибка csv), уже
+записанные пачки остаются в БД — import_notes бросает ImportFailed со счётчиками,
+чтобы было видно, сколько сохранено.
+"""
+
+from __future__ import annotations
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import db
+
+FORMATS = ("txt", "jsonl", "csv")
+CHUNK = int(os.getenv("IMPORT_CHUNK", "1000"))
+MAX_TEXT_LEN = 4096  # длиннее одно сообщение Telegram не покажет
+MAX_FIELD_LEN = 20 * 1024 * 1024  # не больше самого файла (getFile отдаёт до 20 МБ)
+
+# Стандартный предел csv — 128 КБ на поле: одна длинная заметка обрывала весь
+# файл ошибкой csv.Error. С запасом до размера файла такое поле дочитывается
+# и пропускается как слишком длинное (MAX_TEXT_LEN). Предел общий на процесс,
+# поэтому поднимается только на время чтения (_csv_field_limit).
+_field_limit_lock = threading.Lock()
+_field_limit_readers = 0
+_field_limit_saved = 0
+
+_EXPORT_HEADER = "Экспорт заметок от"
+_EXPORT_SEPARATOR = "-" * 30
+
+
+class ImportFailed(Exception):
+    """
+    Файл не дочитан. imported — уже сохранено в БД (повторный импорт того же
+    файла их задвоит), failed — прочитано, но не сохранено; причина — __cause__.
+    """
+
+    def __init__(self, imported: int, skipped: int, over_quota: int, failed: int):
+        super().__init__(f"импорт прерван: сохранено {imported}, не сохранено {failed}")
+        self.imported = imported
+        self.skipped = skipped
+        self.over_quota = over_quota
+        self.failed = failed
+
+
+def detect_format(filename: str) -> tuple[str | None, bool]:
+    """(формат по расширению или None, сжат ли gzip)."""
+    name = (filename or "").lower()
+    gz = name.endswith(".gz")
+    if gz:
+        name = name[:-3]
+    ext = name.rsplit(".", 1)[-1] if "." in name else ""
+    return (ext if ext in FORMATS else None), gz
+
+
+def _iter_txt(lines):
+    first = next(lines, None)
+    if first is None:
+        return
+    if not first.startswith(_EXPORT_HEADER):
+        yield first.rstrip("\r\n")
+        for line in lines:
+            yield line.rstrip("\r\n")
+        return
+    # Файл /note_export: «Заметка #N:», текст (может быть многострочным), черта
+    block = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if block is None:
+            if line.startswith("Заметка #") and line.endswith(":"):
+                block = []
+        elif line == _EXPORT_SEPARATOR:
+            yield "\n".join(block)
+            block = None
+        else:
+            block.append(line)
+    if block:
+        yield "\n".join(block)
+
+
+def _iter_jsonl(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        text = obj.get("text") if isinstance(obj, dict) else obj
+        yield text if isinstance(text, str) else None
+
+
+@contextmanager
+def _csv_field_limit():
+    """
+    Поднять предел csv до MAX_FIELD_LEN, пока читается файл. Одновременные
+    импорты считаются: прежний предел возвращает последний закончивший.
+    """
+    global _field_limit_readers, _field_limit_saved
+    with _field_limit_lock:
+        if not _field_limit_readers:
+            _field_limit_saved = csv.field_size_limit(max(csv.field_size_limit(), MAX_FIELD_LEN))
+        _field_limit_readers += 1
+    try:
+        yield
+    finally:
+        with _field_limit_lock:
+            _field_limit_readers -= 1
+            if not _field_limit_readers:
+                csv.field_size_limit(_field_limit_saved)
+
+
+def _iter_csv(lines):
+    with _csv_field_limit():
+        reader = csv.reader(lines)
+        first = next(reader, None)
+        if first is None:
+            return
+        header = [h.strip().lower() for h in first]
+        col = header.index("text") if "text" in header else 0
+        if "text" not in header:
+            yield first[0] if first else None
+        for row in reader:
+            yield row[col] if len(row) > col else None
+
+
+_READERS = {"txt": _iter_txt, "jsonl": _iter_jsonl, "csv": _iter_csv}
+
+
+def iter_texts(stream, fmt: str, gz: bool = False):
+    """
+    Тексты заметок из бинарного потока. None — битая строка, "" — пустая;
+    и то и другое импорт пропускает.
+    """
+    if fmt not in _READERS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    raw = gzip.GzipFile(fileobj=stream, mode="rb") if gz else stream
+    # utf-8-sig: BOM от Excel (и от нашего csv-экспорта) не попадает в первую заметку
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace",
+                            newline="" if fmt == "csv" else None)
+    try:
+        yield from _READERS[fmt](iter(text))
+    finally:
+        text.detach()
+
+
+def import_notes(user_id: int, stream, fmt: str, gz: bool = False,
+                 max_notes: int | None = None, chunk: int = CHUNK) -> tuple[int, int, int]:
+    """
+    Импортировать заметки из потока.
+    Вернёт (добавлено, пропущено пустых/битых/слишком длинных, не влезло в лимит).
+    Ошибка чтения или записи на полпути — ImportFailed со счётчиками на этот момент.
+    """
+    if fmt not in _READERS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    imported = skipped = over_quota = 0
+    batch: list[str] = []
+    full = False
+
+    def flush() -> None:
+        nonlocal imported, over_quota, full
+        added = db.add_notes(user_id, batch, max_notes)
+        imported += added
+        if added < len(batch):
+            over_quota += len(batch) - added
+            full = True
+        batch.clear()
+
+    try:
+        for text in iter_texts(stream, fmt, gz):
+            text = text.strip() if text is not None else ""
+            if not text or len(text) > MAX_TEXT_LEN:
+                skipped += 1
+            elif full:
+                over_quota += 1
+            else:
+                batch.append(text)
+                if len(batch) >= chunk:
+                    flush()
+        if batch:
+            flush()
+    except Exception as e:
+        raise ImportFailed(imported, skipped, over_quota, len(batch)) from e
+    return imported, skipped, over_quota
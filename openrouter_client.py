@@ -1,14 +1,23 @@
 from __future__ import annotations
-import os, time, requests
+import os, json, time, asyncio, threading, requests
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv()
 
 OPENROUTER_API = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
+# Настройки пула соединений (keep-alive) — можно переопределить через .env
+POOL_SIZE = int(os.getenv("OPENROUTER_POOL_SIZE", "16"))
+CONNECT_RETRIES = int(os.getenv("OPENROUTER_CONNECT_RETRIES", "2"))
+CONNECT_TIMEOUT_S = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "5"))
+# Для asyncio-клиента: сколько одновременных соединений держит aiohttp
+ASYNC_POOL_SIZE = int(os.getenv("OPENROUTER_ASYNC_POOL_SIZE", "256"))
+
 
 @dataclass
 class OpenRouterError(Exception):
@@ -36,50 +45,333 @@ def _friendly(status: int) -> str:
     return error_messages.get(status, "Сервис недоступен. Повторите попытку позже.")
 
 
+_SSE_DONE = object()
+
+
+def _sse_delta(line: bytes):
+    """
+    Одна строка SSE-потока → кусочек текста, None (пропустить) или _SSE_DONE.
+    Пустые строки разделяют события, ":" — комментарии (keep-alive).
+    """
+    line = line.strip()
+    if not line.startswith(b"data:"):
+        return None
+    data = line[5:].strip()
+    if data == b"[DONE]":
+        return _SSE_DONE
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+    if "error" in chunk:
+        status = int(chunk["error"].get("code") or 500)
+        raise OpenRouterError(status, _friendly(status))
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or None
+
+
+class OpenRouterClient:
+    """
+    Клиент OpenRouter с собственным requests.Session.
+
+    Session держит пул keep-alive соединений: TCP+TLS устанавливается один раз,
+    дальше запросы идут по уже открытому соединению.
+    - pool_size    — сколько соединений держать открытыми (≈ число параллельных запросов);
+    - max_retries  — число повторов только при ошибке установки соединения
+                     (запрос до сервера не дошёл — повтор безопасен) или свой Retry;
+    - connect_timeout / read_timeout — таймауты по умолчанию, секунды.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, *,
+                 api_url: str = OPENROUTER_API,
+                 pool_size: int = POOL_SIZE,
+                 max_retries: Union[int, Retry] = CONNECT_RETRIES,
+                 connect_timeout: float = CONNECT_TIMEOUT_S,
+                 read_timeout: float = 30):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        if not isinstance(max_retries, Retry):
+            max_retries = Retry(total=max_retries, connect=max_retries, read=0, status=0,
+                                redirect=0, backoff_factor=0.2, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=max_retries, pool_block=False)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _headers(self) -> Dict[str, str]:
+        key = self.api_key or OPENROUTER_API_KEY
+        if not key:
+            raise OpenRouterError(401, "Отсутствует OPENROUTER_API_KEY (.env).")
+        return {
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+
+    def chat_once(self, messages: List[Dict], *,
+                  model: str,
+                  temperature: float = 0.2,
+                  max_tokens: int = 400,
+                  timeout_s: Optional[float] = None) -> Tuple[str, int]:
+        headers = self._headers()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        timeout = (self.connect_timeout, timeout_s or self.read_timeout)
+
+        t0 = time.perf_counter()
+
+        try:
+            r = self.session.post(self.api_url, json=payload, headers=headers, timeout=timeout)
+            dt_ms = int((time.perf_counter() - t0) * 1000)
+
+            # Обработка HTTP ошибок включая 5xx (задание 3)
+            if r.status_code // 100 != 2:
+                raise OpenRouterError(r.status_code, _friendly(r.status_code))
+
+            try:
+                data = r.json()
+                text = data["choices"][0]["message"]["content"]
+            except Exception:
+                raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+
+            return text, dt_ms
+
+        except OpenRouterError:
+            raise
+        except requests.exceptions.Timeout:
+            raise OpenRouterError(504, "Ошибка 504 — сервер не ответил вовремя. Повторите попытку.")
+        except requests.exceptions.ConnectionError:
+            raise OpenRouterError(503, "Ошибка 503 — сервис временно недоступен. Подождите немного.")
+        except Exception as e:
+            raise OpenRouterError(500, f"Внутренняя ошибка: {str(e)}")
+
+    def chat_stream(self, messages: List[Dict], *,
+                    model: str,
+                    temperature: float = 0.2,
+                    max_tokens: int = 400,
+                    timeout_s: Optional[float] = None) -> Iterator[str]:
+        """
+        Потоковый ответ (SSE, "stream": true): генератор кусочков текста (delta).
+        Ошибки те же, что у chat_once, — OpenRouterError с понятным сообщением.
+        timeout_s здесь — максимальная пауза между событиями, а не на весь ответ.
+        """
+        headers = self._headers()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+        timeout = (self.connect_timeout, timeout_s or self.read_timeout)
+
+        try:
+            with self.session.post(self.api_url, json=payload, headers=headers,
+                                   timeout=timeout, stream=True) as r:
+                if r.status_code // 100 != 2:
+                    raise OpenRouterError(r.status_code, _friendly(r.status_code))
+                for line in r.iter_lines(decode_unicode=False):
+                    delta = _sse_delta(line)
+                    if delta is _SSE_DONE:
+                        return
+                    if delta:
+                        yield delta
+
+        except OpenRouterError:
+            raise
+        except requests.exceptions.Timeout:
+            raise OpenRouterError(504, "Ошибка 504 — сервер не ответил вовремя. Повторите попытку.")
+        except requests.exceptions.ConnectionError:
+            raise OpenRouterError(503, "Ошибка 503 — сервис временно недоступен. Подождите немного.")
+        except Exception as e:
+            raise OpenRouterError(500, f"Внутренняя ошибка: {str(e)}")
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client: Optional[OpenRouterClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OpenRouterClient:
+    """Общий клиент процесса (создаётся при первом запросе)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenRouterClient()
+    return _client
+
+
 def chat_once(messages: List[Dict], *,
               model: str,
               temperature: float = 0.2,
               max_tokens: int = 400,
               timeout_s: int = 30) -> Tuple[str, int]:
     """
-    Реальный запрос к OpenRouter API с обработкой ошибок 500, 502, 503, 504
+    Реальный запрос к OpenRouter API с обработкой ошибок 500, 502, 503, 504.
+    Идёт через общий OpenRouterClient, т.е. переиспользует keep-alive соединения.
     """
-    if not OPENROUTER_API_KEY:
-        raise OpenRouterError(401, "Отсутствует OPENROUTER_API_KEY (.env).")
+    return get_client().chat_once(messages, model=model, temperature=temperature,
+                                  max_tokens=max_tokens, timeout_s=timeout_s)
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
 
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-    }
+def chat_stream(messages: List[Dict], *,
+                model: str,
+                temperature: float = 0.2,
+                max_tokens: int = 400,
+                timeout_s: int = 30) -> Iterator[str]:
+    """Потоковый вариант chat_once: отдаёт текст кусочками по мере генерации."""
+    return get_client().chat_stream(messages, model=model, temperature=temperature,
+                                    max_tokens=max_tokens, timeout_s=timeout_s)
 
-    t0 = time.perf_counter()
 
-    try:
-        r = requests.post(OPENROUTER_API, json=payload, headers=headers, timeout=timeout_s)
-        dt_ms = int((time.perf_counter() - t0) * 1000)
+class AsyncOpenRouterClient:
+    """
+    asyncio-вариант клиента на aiohttp: одна ClientSession с пулом до pool_size
+    соединений. Запросы не занимают потоков, поэтому сотни вызовов могут
+    ждать ответа одновременно. aiohttp импортируется лениво — синхронному
+    боту он не нужен.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, *,
+                 api_url: str = OPENROUTER_API,
+                 pool_size: int = ASYNC_POOL_SIZE,
+                 connect_timeout: float = CONNECT_TIMEOUT_S,
+                 read_timeout: float = 30):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session = None
+
+    _headers = OpenRouterClient._headers
+
+    def _get_session(self):
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self._session
+
+    def _timeout(self, timeout_s: Optional[float]):
+        import aiohttp
+        return aiohttp.ClientTimeout(total=None, connect=self.connect_timeout,
+                                     sock_read=timeout_s or self.read_timeout)
+
+    async def chat_once(self, messages: List[Dict], *,
+                        model: str,
+                        temperature: float = 0.2,
+                        max_tokens: int = 400,
+                        timeout_s: Optional[float] = None) -> Tuple[str, int]:
+        import aiohttp
+        headers = self._headers()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
 
-        # Обработка HTTP ошибок включая 5xx (задание 3)
-        if r.status_code // 100 != 2:
-            raise OpenRouterError(r.status_code, _friendly(r.status_code))
+        t0 = time.perf_counter()
 
         try:
-            data = r.json()
-            text = data["choices"][0]["message"]["content"]
-        except Exception:
-            raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
-
-        return text, dt_ms
-
-    except requests.exceptions.Timeout:
-        raise OpenRouterError(504, "Ошибка 504 — сервер не ответил вовремя. Повторите попытку.")
-    except requests.exceptions.ConnectionError:
-        raise OpenRouterError(503, "Ошибка 503 — сервис временно недоступен. Подождите немного.")
-    except Exception as e:
-        raise OpenRouterError(500, f"Внутренняя ошибка: {str(e)}")
\ No newline at end of file
+            async with self._get_session().post(self.api_url, json=payload, headers=headers,
+                                                timeout=self._timeout(timeout_s)) as r:
+                if r.status // 100 != 2:
+                    raise OpenRouterError(r.status, _friendly(r.status))
+                try:
+                    data = await r.json(content_type=None)
+                    text = data["choices"][0]["message"]["content"]
+                except Exception:
+                    raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+            return text, int((time.perf_counter() - t0) * 1000)
+
+        except OpenRouterError:
+            raise
+        except asyncio.TimeoutError:
+            raise OpenRouterError(504, "Ошибка 504 — сервер не ответил вовремя. Повторите попытку.")
+        except aiohttp.ClientConnectionError:
+            raise OpenRouterError(503, "Ошибка 503 — сервис временно недоступен. Подождите немного.")
+        except Exception as e:
+            raise OpenRouterError(500, f"Внутренняя ошибка: {str(e)}")
+
+    async def chat_stream(self, messages: List[Dict], *,
+                          model: str,
+                          temperature: float = 0.2,
+                          max_tokens: int = 400,
+                          timeout_s: Optional[float] = None) -> AsyncIterator[str]:
+        import aiohttp
+        headers = self._headers()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+
+        try:
+            async with self._get_session().post(self.api_url, json=payload, headers=headers,
+                                                timeout=self._timeout(timeout_s)) as r:
+                if r.status // 100 != 2:
+                    raise OpenRouterError(r.status, _friendly(r.status))
+                async for line in r.content:
+                    delta = _sse_delta(line)
+                    if delta is _SSE_DONE:
+                        return
+                    if delta:
+                        yield delta
+
+        except OpenRouterError:
+            raise
+        except asyncio.TimeoutError:
+            raise OpenRouterError(504, "Ошибка 504 — сервер не ответил вовремя. Повторите попытку.")
+        except aiohttp.ClientConnectionError:
+            raise OpenRouterError(503, "Ошибка 503 — сервис временно недоступен. Подождите немного.")
+        except Exception as e:
+            raise OpenRouterError(500, f"Внутренняя ошибка: {str(e)}")
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+_async_client: Optional[AsyncOpenRouterClient] = None
+
+
+def get_async_client() -> AsyncOpenRouterClient:
+    """Общий asyncio-клиент (сессия создаётся внутри работающего event loop)."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenRouterClient()
+    return _async_client
+
+
+async def achat_once(messages: List[Dict], *,
+                     model: str,
+                     temperature: float = 0.2,
+                     max_tokens: int = 400,
+                     timeout_s: int = 30) -> Tuple[str, int]:
+    """asyncio-версия chat_once (aiohttp), та же сигнатура и те же ошибки."""
+    return await get_async_client().chat_once(messages, model=model, temperature=temperature,
+                                              max_tokens=max_tokens, timeout_s=timeout_s)
+
+
+def achat_stream(messages: List[Dict], *,
+                 model: str,
+                 temperature: float = 0.2,
+                 max_tokens: int = 400,
+                 timeout_s: int = 30) -> AsyncIterator[str]:
+    """asyncio-версия chat_stream: async for delta in achat_stream(...)."""
+    return get_async_client().chat_stream(messages, model=model, temperature=temperature,
+                                          max_tokens=max_tokens, timeout_s=timeout_s)
\ No newline at end of file
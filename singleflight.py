@@ -0,0 +1,153 @@
+"""
+singleflight.py — склейка одинаковых одновременных запросов.
+
+Пока запрос с ключом K выполняется, повторные вызовы с тем же K не делают
+свой запрос, а ждут результата первого («ведущего»). Результат или ошибка
+раздаются всем ожидающим. Ключ — make_key(модель, сообщения, параметры).
+
+Group — для потоков (TeleBot), AsyncGroup — для asyncio (AsyncTeleBot).
+Счётчики: calls — сколько раз просили, executions — сколько реально выполнили.
+
+Watchers — ход общего запроса для всех участников: ведущий публикует
+промежуточный результат, каждый показывает его у себя сам. Ошибка
+наблюдателя (правка сообщения) логируется и не валит общий запрос.
+"""
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+def make_key(*parts) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Stats:
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Доля вызовов, обслуженных чужим запросом."""
+        return 1 - self.executions / self.calls if self.calls else 0.0
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class Group(_Stats):
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+
+    def do(self, key: str, fn):
+        """Вернёт (результат, shared): shared=True — результат чужого запроса."""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+
+class AsyncGroup(_Stats):
+    def __init__(self):
+        super().__init__()
+        self._calls: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, afn):
+        """asyncio-версия Group.do: afn() — корутина-функция."""
+        self.calls += 1
+        fut = self._calls.get(key)
+        if fut is not None:
+            # shield: отмена одного ожидающего не отменяет общий запрос
+            return await asyncio.shield(fut), True
+
+        fut = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.executions += 1
+        try:
+            result = await afn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # помечаем как полученное: ожидающих может и не быть
+            raise
+        else:
+            fut.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, False
+
+
+class Watchers:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_key: dict[str, list] = {}
+
+    @contextmanager
+    def watch(self, key: str, fn):
+        """Пока блок выполняется, fn(value) получает всё, что публикуют по key."""
+        with self._lock:
+            self._by_key.setdefault(key, []).append(fn)
+        try:
+            yield
+        finally:
+            with self._lock:
+                fns = self._by_key[key]
+                fns.remove(fn)
+                if not fns:
+                    del self._by_key[key]
+
+    def _current(self, key: str) -> list:
+        with self._lock:
+            return list(self._by_key.get(key, ()))
+
+    def publish(self, key: str, value) -> None:
+        for fn in self._current(key):
+            try:
+                fn(value)
+            except Exception:
+                log.exception("Flight watcher failed")
+
+    async def apublish(self, key: str, value) -> None:
+        """asyncio-версия publish: наблюдатели — корутины-функции."""
+        for fn in self._current(key):
+            try:
+                await fn(value)
+            except Exception:
+                log.exception("Flight watcher failed")
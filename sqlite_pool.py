@@ -0,0 +1,116 @@
+"""
+sqlite_pool.py — переиспользуемые подключения к SQLite (по одному на поток).
+
+Раньше каждая функция в db.py / db2.py открывала новое подключение и заново
+выполняла PRAGMA. Теперь подключение создаётся один раз на пару (поток, путь к БД),
+PRAGMA применяются при создании, а дальше объект просто возвращается из кэша.
+
+Совместимо со старым стилем вызова:
+    with _connect() as conn:
+        conn.execute(...)
+`with conn:` у sqlite3 делает commit/rollback, но не закрывает подключение —
+именно это и нужно для повторного использования.
+"""
+
+from __future__ import annotations
+import atexit
+import sqlite3
+import threading
+import weakref
+from typing import Iterable
+
+DEFAULT_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+class ConnectionPool:
+    """
+    Кэш подключений «поток → путь → sqlite3.Connection».
+
+    - PRAGMA выполняются один раз при создании подключения;
+    - подключения умерших потоков закрываются при следующем создании нового;
+    - close_all() закрывает всё (вызывается автоматически при выходе).
+    """
+
+    def __init__(self, pragmas: Iterable[str] = DEFAULT_PRAGMAS, timeout: float = 5.0):
+        self._pragmas = tuple(pragmas)
+        self._timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Растёт при close_all(): потоки увидят, что их кэш устарел
+        self._generation = 0
+        # id(conn) -> (weakref на поток-владелец, conn)
+        self._all: dict[int, tuple[weakref.ref, sqlite3.Connection]] = {}
+
+    def connect(self, path: str) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            local.conns = {}
+            local.generation = self._generation
+        conns = local.conns
+        conn = conns.get(path)
+        if conn is None:
+            conn = self._open(path)
+            conns[path] = conn
+        return conn
+
+    def _open(self, path: str) -> sqlite3.Connection:
+        # check_same_thread=False — только ради close_all() из другого потока;
+        # рабочие запросы по-прежнему идут лишь из потока-владельца.
+        conn = sqlite3.connect(path, timeout=self._timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in self._pragmas:
+            conn.execute(pragma)
+        with self._lock:
+            self._prune_dead()
+            self._all[id(conn)] = (weakref.ref(threading.current_thread()), conn)
+        return conn
+
+    def _prune_dead(self) -> None:
+        for key, (thread_ref, conn) in list(self._all.items()):
+            thread = thread_ref()
+            if thread is None or not thread.is_alive():
+                del self._all[key]
+                conn.close()
+
+    def close_thread(self) -> None:
+        """Закрыть подключения текущего потока (например, в конце воркера)."""
+        conns = getattr(self._local, "conns", None) or {}
+        with self._lock:
+            for conn in conns.values():
+                self._all.pop(id(conn), None)
+                conn.close()
+        conns.clear()
+
+    def close_all(self) -> None:
+        """Закрыть все подключения всех потоков (завершение процесса)."""
+        with self._lock:
+            items = list(self._all.values())
+            self._all.clear()
+            self._generation += 1
+        for _, conn in items:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._all)
+
+
+_pools: list[ConnectionPool] = []
+
+
+def create_pool(pragmas: Iterable[str] = DEFAULT_PRAGMAS, timeout: float = 5.0) -> ConnectionPool:
+    pool = ConnectionPool(pragmas, timeout)
+    _pools.append(pool)
+    return pool
+
+
+@atexit.register
+def _close_pools() -> None:
+    for pool in _pools:
+        pool.close_all()
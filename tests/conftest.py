@@ -32,4 +32,38 @@ def openrouter_module():
     """
     Импортируем openrouter_client.py
     """
-    return importlib.import_module("openrouter_client")
\ No newline at end of file
+    return importlib.import_module("openrouter_client")
+
+@pytest.fixture()
+def llm_cache_module(db_module):
+    """
+    Импортируем llm_cache.py поверх временной БД
+    """
+    return importlib.import_module("llm_cache")
+
+@pytest.fixture()
+def db2_module(tmp_db_path, monkeypatch):
+    """
+    db2.py (DailyZodiakBot) поверх временной БД; config2 требует TOKEN
+    """
+    monkeypatch.setenv("TOKEN", "1:test")
+    db2 = importlib.import_module("db2")
+    monkeypatch.setattr(db2, "DB_PATH", tmp_db_path)
+    db2.init_db()
+    yield db2
+    db2.close_db()
+
+@pytest.fixture()
+def main3_module(db2_module):
+    """
+    Импортируем main3.py (DailyZodiakBot) поверх временной БД
+    """
+    return importlib.import_module("main3")
+
+@pytest.fixture()
+def main2_module(db_module, monkeypatch):
+    """
+    Импортируем main2.py поверх временной БД (TeleBot без сети: init_db и конструктор)
+    """
+    monkeypatch.setenv("TOKEN", "1:test")
+    return importlib.import_module("main2")
@@ -0,0 +1,101 @@
+import datetime
+import time
+
+import pytest
+
+D = datetime.date
+
+
+@pytest.fixture()
+def activity_module(db_module):
+    import activity_log
+    return activity_log
+
+
+def test_record_is_write_behind(activity_module, db_module, monkeypatch):
+    writes = []
+    monkeypatch.setattr(db_module, "add_activity_bits", lambda masks: writes.append(dict(masks)))
+    log = activity_module.ActivityLog(flush_interval_s=3600)
+    for _ in range(100):
+        log.record(1)
+    log.record(2)
+    assert writes == []                       # горячий путь без записи в БД
+    assert log.history(1).total() == 1        # незаписанное уже видно
+    log.stop()
+    assert len(writes) == 1 and len(writes[0]) == 2   # одна пачка на всё
+
+
+def test_flush_merges_into_year_bitmaps(activity_module, db_module):
+    today = [D(2024, 12, 31)]
+    log = activity_module.ActivityLog(flush_interval_s=3600, today=lambda: today[0])
+    log.record(1)
+    assert log.flush() == 1
+    today[0] = D(2025, 1, 1)
+    log.record(1)
+    today[0] = D(2025, 1, 2)
+    log.record(1)
+    log.record(1)
+    assert log.flush() == 2
+    assert log.flush() == 0
+    years = db_module.activity_years(1)
+    assert years == {2024: 1 << 365, 2025: 0b11}   # 2024 — високосный
+    h = log.history(1)
+    assert h.current_streak(D(2025, 1, 2)) == 3      # через границу года
+    log.stop()
+
+
+def test_history_bit_queries(activity_module):
+    days = [D(2025, 3, d) for d in (1, 2, 3, 10, 11, 20, 21, 22, 23)]
+    years = {}
+    for d in days:
+        year, bit = activity_module.year_bit(d)
+        years[year] = years.get(year, 0) | 1 << bit
+    h = activity_module.History(years)
+    assert h.total() == 9
+    assert h.longest_streak() == 4
+    assert h.count(D(2025, 3, 1), D(2025, 3, 10)) == 4
+    assert h.count(D(2024, 1, 1), D(2025, 3, 2)) == 2   # до начала истории — нули
+    assert h.days(D(2025, 3, 9), D(2025, 3, 12)) == [False, True, True, False]
+    assert h.current_streak(D(2025, 3, 23)) == 4
+    assert h.current_streak(D(2025, 3, 24)) == 4         # сегодня ещё не заходил
+    assert h.current_streak(D(2025, 3, 25)) == 0
+    assert not h.is_active(D(2024, 12, 31))
+
+
+def test_legacy_activity_rows_are_folded(tmp_db_path, monkeypatch):
+    import sqlite3
+    import db
+    monkeypatch.setattr(db, "DB_PATH", tmp_db_path)
+    conn = sqlite3.connect(tmp_db_path)
+    conn.execute("CREATE TABLE activity (user_id INTEGER, day TEXT, PRIMARY KEY (user_id, day))")
+    conn.executemany("INSERT INTO activity VALUES (?, ?)", [(1, "2025-01-01"), (1, "2025-01-03")])
+    conn.commit()
+    conn.close()
+    db.init_db()
+    assert db.activity_years(1) == {2025: 0b101}
+    assert not db._connect().execute("SELECT 1 FROM sqlite_master WHERE name = 'activity'").fetchone()
+
+
+def test_background_flusher_commits(activity_module, db_module):
+    log = activity_module.ActivityLog(flush_interval_s=0.01)
+    log.record(5)
+    deadline = time.monotonic() + 2
+    while not db_module.activity_years(5) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db_module.activity_years(5)
+    log.stop()
+
+
+def test_failed_flush_keeps_rows(activity_module, db_module, monkeypatch):
+    log = activity_module.ActivityLog(flush_interval_s=3600)
+    log.record(1)
+    real = db_module.add_activity_bits
+
+    def boom(masks):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(db_module, "add_activity_bits", boom)
+    assert log.flush() == 0
+    monkeypatch.setattr(db_module, "add_activity_bits", real)
+    log.stop()
+    assert db_module.activity_years(1)
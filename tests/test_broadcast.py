@@ -0,0 +1,69 @@
+import threading
+import time
+
+from broadcast import Broadcaster
+
+
+class ApiError(Exception):
+    """Как telebot.apihelper.ApiTelegramException: error_code и result_json."""
+
+    def __init__(self, code, retry_after=None):
+        super().__init__(code)
+        self.error_code = code
+        self.result_json = {"parameters": {"retry_after": retry_after}} if retry_after is not None else {}
+
+
+def test_delivers_retries_and_gives_up():
+    calls = {}
+    lock = threading.Lock()
+
+    def send(chat_id, text):
+        with lock:
+            calls[chat_id] = calls.get(chat_id, 0) + 1
+            n = calls[chat_id]
+        if chat_id == 2:
+            raise ApiError(403)          # заблокировал бота — без повторов
+        if chat_id == 3 and n == 1:
+            raise ApiError(502)          # сбой сервера — повтор
+        if chat_id == 4:
+            raise ConnectionError()      # сеть лежит — до MAX_ATTEMPTS
+
+    done = []
+    b = Broadcaster(send, rate=1000, burst=1000, chat_rate=1000, max_attempts=3, on_progress=None,
+                    sleep=lambda s: None)
+    st = b.run(((i, "t") for i in range(1, 6)), on_done=lambda c, ok: done.append((c, ok)))
+    assert sorted(done) == [(1, True), (2, False), (3, True), (4, False), (5, True)]
+    assert calls == {1: 1, 2: 1, 3: 2, 4: 3, 5: 1}
+    assert (st["total"], st["sent"], st["failed"], st["retried"]) == (5, 3, 2, 3)
+
+
+def test_global_and_per_chat_rate():
+    b = Broadcaster(lambda c, t: None, workers=8, rate=50, burst=1, chat_rate=1000, on_progress=None)
+    t0 = time.monotonic()
+    assert b.run((i, "t") for i in range(26))["sent"] == 26
+    assert time.monotonic() - t0 >= 0.45                     # 25 токенов при 50/с
+
+    b = Broadcaster(lambda c, t: None, rate=1000, burst=1000, chat_rate=10, on_progress=None)
+    t0 = time.monotonic()
+    b.run([(7, "a"), (7, "b"), (7, "c")])
+    assert time.monotonic() - t0 >= 0.18                      # один чат — не чаще 10/с
+
+
+def test_retry_after_pauses_everyone():
+    sent_at = []
+    first = threading.Event()
+
+    def send(chat_id, text):
+        if chat_id == 0 and not first.is_set():
+            first.set()
+            raise ApiError(429, retry_after=0.3)
+        sent_at.append(time.monotonic())
+
+    reports = []
+    b = Broadcaster(send, workers=1, rate=1000, burst=1000, chat_rate=100,
+                    on_progress=reports.append, progress_s=0)
+    t0 = time.monotonic()
+    st = b.run((i, "t") for i in range(3))
+    assert st["sent"] == 3 and st["rate_limited"] == 1 and st["retried"] == 1
+    assert min(sent_at) - t0 >= 0.3                           # после 429 ждали все
+    assert reports[-1]["sent"] == 3 and "rate" in reports[-1]
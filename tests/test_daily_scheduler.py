@@ -0,0 +1,118 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from daily_scheduler import DailyScheduler, next_fire
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def setup():
+    clock = Clock(datetime(2025, 3, 1, 8, 30))
+    queries, sent = [], []
+
+    def list_due(today_str, hour):
+        queries.append((today_str, hour))
+        return [{"user_id": hour, "sign": "лев"}]
+
+    sched = DailyScheduler(list_due, lambda users, d: sent.append((users[0]["user_id"], d)), now=clock)
+    return sched, clock, queries, sent
+
+
+def test_next_fire():
+    assert next_fire(9, datetime(2025, 3, 1, 8, 30)) == datetime(2025, 3, 1, 9)
+    assert next_fire(9, datetime(2025, 3, 1, 9, 0)) == datetime(2025, 3, 1, 9)
+    assert next_fire(9, datetime(2025, 12, 31, 9, 1)) == datetime(2026, 1, 1, 9)
+
+
+def test_fires_each_hour_once_per_day(setup):
+    sched, clock, queries, sent = setup
+    assert sched.run_pending() == 1                  # текущий час — сразу при старте
+    assert queries == [("2025-03-01", 8)]
+    assert sched.seconds_until_next() == 30 * 60
+    assert sched.run_pending() == 0                  # до 9:00 в БД не ходим
+
+    clock.now = datetime(2025, 3, 1, 9, 0, 2)
+    assert sched.run_pending() == 1
+    assert queries[-1] == ("2025-03-01", 9) and sched.stats()["lag_last_s"] == 2
+
+    for hour in range(10, 24 + 9):                    # сутки по часам: 24 запроса на 24 часа
+        clock.now = datetime(2025, 3, 1 + hour // 24, hour % 24, 0, 1)
+        assert sched.run_pending() == 1
+    assert len(queries) == 25 and queries[-1] == ("2025-03-02", 8)
+    assert len(sent) == 25 and sched.stats()["lag_max_s"] == 2
+
+
+def test_missed_hours_are_skipped_after_long_gap(setup):
+    sched, clock, queries, sent = setup
+    sched.run_pending()
+    clock.now = datetime(2025, 3, 1, 14, 30)         # машина спала с 8:30
+    sched.run_pending()
+    assert queries[-1] == ("2025-03-01", 14)          # 14:00 опоздал на 30 мин — отработан
+    assert ("2025-03-01", 12) not in queries          # 12:00 — больше часа назад, пропущен
+    clock.now = datetime(2025, 3, 2, 12, 0)
+    sched.run_pending()
+    assert queries[-1] == ("2025-03-02", 12)          # на следующий день — как обычно
+
+
+def test_notify_current_hour_wakes_thread(setup):
+    sched, clock, queries, sent = setup
+    sched.run_pending()
+    fired = threading.Event()
+    sched._deliver = lambda users, d: fired.set()
+    sched.notify(10)                                  # не текущий час — ждём 10:00
+    assert sched.seconds_until_next() > 0
+    sched.start()
+    try:
+        sched.notify(8)
+        assert fired.wait(2)
+    finally:
+        sched.stop()
+    assert queries[-1] == ("2025-03-01", 8)
+
+
+def test_sent_marks_flush_by_count_time_and_at_end():
+    from daily_scheduler import SentMarks
+    writes = []
+    clock = [0.0]
+    marks = SentMarks(writes.append, flush_every=3, flush_s=10, clock=lambda: clock[0])
+    for uid in range(4):
+        marks.add(uid)
+    assert writes == [[0, 1, 2]]
+    clock[0] = 11
+    marks.add(4)                                     # давно не сбрасывали — пишем
+    assert writes[-1] == [3, 4]
+    marks.add(5)
+    assert marks.flush() == 1 and writes[-1] == [5] and marks.flushes == 3
+
+
+def test_long_delivery_does_not_block_next_hour(setup):
+    from concurrent.futures import ThreadPoolExecutor
+    sched, clock, queries, sent = setup
+    release = threading.Event()
+    delivered = []
+
+    def slow_deliver(users, d):
+        if users[0]["user_id"] == 8:
+            release.wait(5)                           # рассылка 8:00 затянулась
+        delivered.append(users[0]["user_id"])
+
+    sched._deliver = slow_deliver
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        sched._executor = pool
+        sched.run_pending()                           # 8:00 ушёл в executor и висит
+        clock.now = datetime(2025, 3, 1, 9, 0, 1)
+        assert sched.run_pending() == 1               # поток планировщика свободен
+        assert sched.stats()["lag_last_s"] == 1
+        clock.now = datetime(2025, 3, 1, 10, 30)
+        assert sched.run_pending() == 1               # 10:00 не пропущен из-за долгой рассылки
+        release.set()
+    assert delivered == [8, 9, 10]
@@ -0,0 +1,50 @@
+import hashlib
+from datetime import date, timedelta
+
+
+def _reference_text(m, sign, for_date):
+    """make_daily_text до оптимизации — эталон для сравнения."""
+    def pick(seq, seed, salt):
+        h = hashlib.md5(seed + salt.encode("utf-8")).hexdigest()
+        return str(seq[int(h, 16) % len(seq)])
+
+    seed = sign.encode("utf-8") + for_date.isoformat().encode("utf-8")
+    intro = pick(m.INTRO, seed, ":intro")
+    focus = pick(m.FOCUS, seed, ":focus")
+    advice = pick(m.ADVICE, seed, ":advice")
+    luck = pick(m.LUCK, seed, ":luck")
+    color = pick(m.COLOR, seed, ":color")
+    number = pick(m.NUMBER, seed, ":num")
+    return (
+        f"{m.SIGN_EMOJI.get(sign, '')} *{sign.capitalize()}* — {for_date.strftime('%Y-%m-%d')}\n"
+        f"{intro} акцент на *{focus}*; {luck}. Советы: {advice}.\n\n"
+        f"Счастливый цвет: *{color}*, число дня: *{number}*.\n"
+        f"_Развлекательный контент._"
+    )
+
+
+def test_fast_render_matches_reference(main3_module):
+    m = main3_module
+    start = date(2024, 1, 1)
+    for i in range(0, 800, 3):
+        d = start + timedelta(days=i)
+        for sign in m.CANON_SIGNS + ["неизвестный"]:
+            assert m._render_daily_text(sign, d) == _reference_text(m, sign, d)
+            assert m.make_daily_text(sign, d) == _reference_text(m, sign, d)
+
+
+def test_daily_table_is_built_once_and_old_days_evicted(main3_module, monkeypatch):
+    m = main3_module
+    calls = []
+    real = m._render_daily_text
+    monkeypatch.setattr(m, "_render_daily_text", lambda s, d: calls.append((s, d)) or real(s, d))
+    monkeypatch.setattr(m, "_daily_texts", {})
+    d1, d2, d3 = date(2030, 1, 1), date(2030, 1, 2), date(2030, 1, 3)
+    for _ in range(3):
+        for sign in m.CANON_SIGNS:
+            m.make_daily_text(sign, d1)
+    assert len(calls) == 12                      # одна таблица на день
+    m.make_daily_text("лев", d2)
+    m.make_daily_text("лев", d3)
+    assert sorted(m._daily_texts) == [d2, d3]    # d1 вытеснен
+    assert len(calls) == 36
@@ -79,4 +79,370 @@ def test_set_user_character_rejects_unknown_id(db_module):
         db.set_user_character(test_user_id, unknown_character_id)
 
     # Проверяем сообщение об ошибке
-    assert "Неверный ID персонажа" in str(excinfo.value)
\ No newline at end of file
+    assert "Неверный ID персонажа" in str(excinfo.value)
+
+def test_connect_reuses_connection_per_thread(db_module):
+    import threading
+    db = db_module
+
+    c1 = db._connect()
+    c2 = db._connect()
+    assert c1 is c2, "в одном потоке должно переиспользоваться одно подключение"
+
+    other = []
+    t = threading.Thread(target=lambda: other.append(db._connect()))
+    t.start()
+    t.join()
+    assert other[0] is not c1, "у другого потока своё подключение"
+
+    # PRAGMA применены при создании
+    assert c1.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+
+def test_close_db_reopens_on_next_call(db_module):
+    db = db_module
+    nid = db.add_note(1, "до закрытия")
+    db.close_db()
+    # после закрытия пул сам откроет новое подключение
+    rows = db.list_notes(1)
+    assert rows[0]["id"] == nid
+
+
+def test_catalog_cache_sees_writes_from_other_connection(db_module):
+    import sqlite3
+    db = db_module
+
+    assert db.get_character_by_id(1)["name"] == "Йода"
+    version = db._catalog.version
+
+    # Повторное чтение берётся из памяти — версия не меняется
+    db.list_characters()
+    assert db._catalog.version == version
+
+    # «Другой процесс» правит каталог отдельным подключением
+    other = sqlite3.connect(db.DB_PATH)
+    with other:
+        other.execute("UPDATE characters SET name = 'Мастер Йода' WHERE id = 1")
+    other.close()
+
+    assert db.get_character_by_id(1)["name"] == "Мастер Йода"
+    assert db._catalog.version > version
+
+
+def test_catalog_cache_returns_copies(db_module):
+    db = db_module
+    models = db.list_models()
+    models[0]["label"] = "испорчено"
+    assert db.list_models()[0]["label"] != "испорчено"
+
+
+def test_user_prompt_lru_invalidated_by_set_user_character(db_module):
+    db = db_module
+    uid = 777002
+
+    ch1, sys1 = db.get_user_prompt(uid)
+    assert ch1["id"] == 1 and ch1["name"] in sys1
+    # Повторный вызов отдаёт тот же (закэшированный) system-промпт
+    assert db.get_user_prompt(uid)[1] is sys1
+
+    db.set_user_character(uid, 2)
+    ch2, sys2 = db.get_user_prompt(uid)
+    assert ch2["id"] == 2
+    assert ch2["name"] in sys2
+
+
+def test_set_user_character_keeps_other_users_prompts(db_module):
+    import sqlite3
+    db = db_module
+    _, sys_a = db.get_user_prompt(777003)
+    version = db._catalog.version
+    db.set_user_character(777004, 3)
+    # выбор из другого потока/процесса (отдельное подключение)
+    other = sqlite3.connect(db.DB_PATH)
+    with other:
+        other.execute("INSERT INTO user_character(telegram_user_id, character_id) VALUES (777005, 4)")
+    other.close()
+    # выбор других пользователей не трогает ни каталог, ни чужую запись LRU
+    assert db.get_user_prompt(777003)[1] is sys_a
+    assert db._catalog.version == version
+    assert db.get_user_character(777004)["id"] == 3
+
+
+def test_user_prompt_sees_choice_from_other_process(db_module):
+    import sqlite3
+    db = db_module
+    uid = 777006
+    assert db.get_user_character(uid)["id"] == 1
+    # выбор сделан другим процессом — set_user_character здесь не вызывался
+    other = sqlite3.connect(db.DB_PATH)
+    with other:
+        other.execute("INSERT INTO user_character(telegram_user_id, character_id) VALUES (?, 3)", (uid,))
+    other.close()
+    assert db.get_user_character(uid)["id"] == 3
+
+
+def test_user_character_fallback_without_default_id(db_module):
+    db = db_module
+    with db._connect() as conn:
+        conn.execute("DELETE FROM characters WHERE id = 1")
+    # Персонажа с id=1 нет — берётся первый по id
+    assert db.get_user_character(999002)["id"] == 2
+
+
+def test_notes_are_owned_by_user(db_module):
+    db = db_module
+    nid = db.add_note(1, "моя")
+    db.add_note(2, "чужая")
+    assert not db.update_note(2, nid, "взлом")
+    assert not db.delete_note(2, nid)
+    assert [r["text"] for r in db.list_notes(1)] == ["моя"]
+    assert db.count_notes(1) == 1 and db.count_notes() == 2
+
+
+def test_add_note_respects_limit(db_module):
+    db = db_module
+    assert db.add_note(1, "a", max_notes=2) is not None
+    assert db.add_note(1, "b", max_notes=2) is not None
+    assert db.add_note(1, "c", max_notes=2) is None
+    assert db.add_note(2, "c", max_notes=2) is not None
+    assert db.count_notes(1) == 2
+
+
+def test_search_notes_prefix_phrase_and_owner(db_module):
+    db = db_module
+    db.add_note(1, "Купить молоко и хлеб")
+    db.add_note(1, "позвонить маме насчёт молока")
+    db.add_note(2, "молоко у другого")
+    rows, _ = db.search_notes(1, "МОЛОКО")
+    assert [r["text"] for r in rows] == ["Купить молоко и хлеб"]
+    assert rows[0]["snippet"] == "Купить «молоко» и хлеб"
+    assert len(db.search_notes(1, "молок*")[0]) == 2
+    assert len(db.search_notes(1, '"хлеб молоко"')[0]) == 0
+    assert len(db.search_notes(1, '"молоко и хлеб"')[0]) == 1
+    # операторы FTS5 из ввода — просто слова, без ошибки синтаксиса
+    assert db.search_notes(1, 'AND NEAR(" *')[0] == []
+
+
+def test_search_notes_for_user_without_notes(db_module):
+    db = db_module
+    db.add_note(1, "молоко")
+    # у пользователя 2 нет строки в note_counts
+    assert db.search_notes(2, "молоко") == ([], None)
+
+
+def test_search_notes_ranks_by_bm25(db_module):
+    db = db_module
+    long_id = db.add_note(1, "кот " + "и ещё очень много других слов " * 5)
+    short_id = db.add_note(1, "кот и кот")
+    db.add_note(1, "про собаку")
+    rows, _ = db.search_notes(1, "кот")
+    assert [r["id"] for r in rows] == [short_id, long_id]
+    assert rows[0]["rank"] < rows[1]["rank"]
+    phrase, _ = db.search_notes(1, '"кот и кот"')
+    assert phrase[0]["snippet"] == "«кот и кот»"
+
+
+def test_search_notes_ranks_by_own_notes_only(db_module):
+    db = db_module
+    db.add_note(1, "кот и кот")
+    db.add_note(1, "кот " + "и ещё очень много других слов " * 5)
+    before = [r["rank"] for r in db.search_notes(1, "кот")[0]]
+    # чужие заметки не меняют ни порядок, ни оценки
+    db.add_notes(2, ["кот"] * 100)
+    assert [r["rank"] for r in db.search_notes(1, "кот")[0]] == before
+
+
+def test_search_notes_follows_writes_and_pages(db_module):
+    db = db_module
+    ids = [db.add_note(1, f"заметка про кота {i}") for i in range(5)]
+    db.update_note(1, ids[0], "про собаку")
+    db.delete_note(1, ids[1])
+    seen, cursor = [], None
+    while True:
+        rows, cursor = db.search_notes(1, "кота", limit=2, cursor=cursor)
+        seen += [r["id"] for r in rows]
+        if cursor is None:
+            break
+    assert sorted(seen) == ids[2:]
+    assert [r["id"] for r in db.search_notes(1, "собаку")[0]] == [ids[0]]
+
+
+def test_search_notes_reaches_old_matches(db_module):
+    db = db_module
+    # после переноса из notes.json у пользователя могут быть тысячи заметок
+    best = db.add_note(1, "отчёт отчёт")
+    db.add_notes(1, [f"отчёт и ещё много слов номер {i}" for i in range(2500)])
+    rows, cursor = db.search_notes(1, "отчёт", limit=50)
+    assert rows[0]["id"] == best
+    seen = len(rows)
+    while cursor:
+        rows, cursor = db.search_notes(1, "отчёт", limit=500, cursor=cursor)
+        seen += len(rows)
+    assert seen == 2501
+
+
+def test_fts_index_is_rebuilt_for_existing_notes(tmp_db_path, monkeypatch):
+    import sqlite3
+    import db
+    monkeypatch.setattr(db, "DB_PATH", tmp_db_path)
+    conn = sqlite3.connect(tmp_db_path)
+    conn.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+                 "text TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("INSERT INTO notes(user_id, text) VALUES (7, 'старая заметка')")
+    conn.commit()
+    conn.close()
+    db.init_db()
+    assert [r["text"] for r in db.search_notes(7, "старая")[0]] == ["старая заметка"]
+
+
+def test_list_notes_keyset_pages(db_module):
+    db = db_module
+    ids = [db.add_note(1, f"n{i}") for i in range(25)]
+    db.add_note(2, "чужая")
+
+    rows, older, newer = db.list_notes_page(1, 10)
+    assert [r["id"] for r in rows] == ids[::-1][:10] and older and not newer
+    rows, older, newer = db.list_notes_page(1, 10, before_id=rows[-1]["id"])
+    assert [r["id"] for r in rows] == ids[::-1][10:20] and older and newer
+    last, older, newer = db.list_notes_page(1, 10, before_id=rows[-1]["id"])
+    assert [r["id"] for r in last] == ids[::-1][20:] and not older and newer
+    back, _, _ = db.list_notes_page(1, 10, after_id=last[0]["id"])
+    assert back == rows
+
+
+def test_list_notes_page_uses_index_without_sort(db_module):
+    db = db_module
+    conn = db._connect()
+    for sql in ("SELECT id FROM notes WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                "SELECT id FROM notes WHERE user_id = ? AND id > ? ORDER BY id ASC LIMIT ?"):
+        plan = " ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, (1, 100, 10)))
+        assert "idx_user_id (user_id=? AND rowid" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_note_counts_follow_writes(db_module):
+    db = db_module
+    ids = [db.add_note(1, f"n{i}") for i in range(3)]
+    db.add_note(2, "чужая")
+    assert db.count_notes(1) == 3 and db.count_notes(2) == 1 and db.count_notes(3) == 0
+    assert db.count_notes() == 4
+    assert db.delete_note(1, ids[0])
+    with db._connect() as conn:
+        conn.execute("UPDATE notes SET user_id = 2 WHERE id = ?", (ids[1],))
+    assert db.count_notes(1) == 1 and db.count_notes(2) == 2
+    # лимит читает счётчик: после удаления место снова есть
+    assert db.add_note(1, "ещё", max_notes=2) is not None
+    assert db.add_note(1, "лишняя", max_notes=2) is None
+
+
+def test_note_counts_lookup_is_by_key(db_module):
+    plan = db_module._connect().execute(
+        "EXPLAIN QUERY PLAN SELECT n FROM note_counts WHERE user_id = ?", (1,)).fetchall()
+    assert any("USING PRIMARY KEY (user_id=?)" in row[-1] for row in plan)
+
+
+def test_reconcile_note_counts(db_module):
+    db = db_module
+    db.add_note(1, "a")
+    db.add_note(1, "b")
+    with db._connect() as conn:
+        conn.execute("UPDATE note_counts SET n = 10 WHERE user_id = 1")
+        conn.execute("INSERT INTO note_counts(user_id, n) VALUES (5, 3)")
+    assert db.reconcile_note_counts() == 2
+    assert db.count_notes(1) == 2 and db.count_notes(5) == 0
+    assert db.reconcile_note_counts() == 0
+
+
+def test_note_counts_backfilled_for_existing_notes(tmp_db_path, monkeypatch):
+    import sqlite3
+    import db
+    monkeypatch.setattr(db, "DB_PATH", tmp_db_path)
+    conn = sqlite3.connect(tmp_db_path)
+    conn.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+                 "text TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.executemany("INSERT INTO notes(user_id, text) VALUES (?, ?)", [(7, "a"), (7, "b"), (8, "c")])
+    conn.commit()
+    conn.close()
+    db.init_db()
+    assert db.count_notes(7) == 2 and db.count_notes(8) == 1
+    db.init_db()  # повторный запуск не удваивает
+    assert db.count_notes(7) == 2
+
+
+def test_note_counts_created_atomically(tmp_db_path, monkeypatch):
+    import sqlite3
+    import pytest
+    import db
+    monkeypatch.setattr(db, "DB_PATH", tmp_db_path)
+    real = db._NOTE_COUNTS_SCHEMA
+    monkeypatch.setattr(db, "_NOTE_COUNTS_SCHEMA", real[:-1] + ("CREATE TRIGGER broken",))
+    with pytest.raises(sqlite3.OperationalError):
+        db.init_db()
+    # упали на последнем триггере — ни таблицы, ни первых триггеров
+    with db._connect() as conn:
+        left = conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%note_counts%'").fetchall()
+    assert left == []
+    monkeypatch.setattr(db, "_NOTE_COUNTS_SCHEMA", real)
+    db.init_db()
+    db.add_note(7, "a")
+    assert db.count_notes(7) == 1
+
+
+def test_notes_fts_created_atomically(tmp_db_path, monkeypatch):
+    import sqlite3
+    import pytest
+    import db
+    monkeypatch.setattr(db, "DB_PATH", tmp_db_path)
+    real = db._FTS_SCHEMA
+    monkeypatch.setattr(db, "_FTS_SCHEMA", real[:-1] + ("CREATE TRIGGER broken",))
+    with pytest.raises(sqlite3.OperationalError):
+        db.init_db()
+    # ни индекса (с его служебными таблицами), ни триггеров
+    with db._connect() as conn:
+        left = conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%notes_fts%'").fetchall()
+    assert left == []
+    monkeypatch.setattr(db, "_FTS_SCHEMA", real)
+    db.init_db()
+    db.add_note(7, "новая заметка")
+    assert [r["text"] for r in db.search_notes(7, "новая")[0]] == ["новая заметка"]
+
+
+def test_note_daily_rollup_follows_writes(db_module):
+    import datetime
+    db = db_module
+    today = datetime.date.today()
+    ids = [db.add_note(1, f"n{i}") for i in range(3)]
+    db.add_note(2, "чужая")
+    assert db.update_note(1, ids[0], "новый текст")
+    assert db.update_note(1, ids[0], "новый текст")   # тот же текст — не правка
+    assert db.delete_note(1, ids[1])
+    assert db.note_daily_totals(1, today, today) == {"created": 3, "edited": 1, "deleted": 1}
+    week = db.note_daily(1, today - datetime.timedelta(days=6), today)
+    assert len(week) == 7 and week[0]["created"] == 0 and week[-1]["day"] == today
+    weekdays = db.note_weekdays(1)
+    assert weekdays[today.weekday()] == 3 and sum(weekdays) == 3
+
+
+def test_note_daily_window_reads_only_key_range(db_module):
+    plan = db_module._connect().execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM note_daily WHERE user_id = ? AND day BETWEEN ? AND ?",
+        (1, "2025-01-01", "2025-12-31")).fetchall()
+    assert any("USING PRIMARY KEY (user_id=? AND day>? AND day<?)" in row[-1] for row in plan)
+
+
+def test_note_daily_backfilled_from_created_at(tmp_db_path, monkeypatch):
+    import datetime
+    import sqlite3
+    import db
+    monkeypatch.setattr(db, "DB_PATH", tmp_db_path)
+    conn = sqlite3.connect(tmp_db_path)
+    conn.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+                 "text TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.executemany("INSERT INTO notes(user_id, text, created_at) VALUES (7, ?, ?)",
+                     [("a", "2025-03-03 12:00:00"), ("b", "2025-03-03 13:00:00"), ("c", "2025-03-05 12:00:00")])
+    conn.commit()
+    conn.close()
+    db.init_db()
+    days = db.note_daily(7, datetime.date(2025, 3, 3), datetime.date(2025, 3, 5))
+    assert [d["created"] for d in days] == [2, 0, 1]
+    assert db.note_weekdays(7)[:3] == [2, 0, 1]   # 3 марта 2025 — понедельник
@@ -0,0 +1,85 @@
+def _users(db2, n, hour=9):
+    for uid in range(1, n + 1):
+        db2.ensure_user(uid)
+        db2.set_sign(uid, "лев")
+        db2.set_notify_hour(uid, hour)
+
+
+def test_mark_sent_many(db2_module):
+    db2 = db2_module
+    _users(db2, 5)
+    db2.claim_sending([1, 2, 3, 4, 5], "2025-03-01")
+    db2.mark_sent_many([1, 2, 3], "2025-03-01")
+    assert sorted(r["user_id"] for r in db2.list_due_users("2025-03-01", 9)) == [4, 5]
+    with db2._connect() as conn:
+        assert [r[0] for r in conn.execute("SELECT user_id FROM sending ORDER BY 1")] == [4, 5]
+
+
+def test_recover_sending_prevents_double_send(db2_module):
+    db2 = db2_module
+    _users(db2, 4)
+    db2.claim_sending([1, 2, 3], "2025-03-01")
+    db2.mark_sent_many([1], "2025-03-01")
+    # падение: отметки 2 и 3 не записаны; при старте они считаются отправленными
+    assert db2.recover_sending() == 2
+    assert [r["user_id"] for r in db2.list_due_users("2025-03-01", 9)] == [4]
+    assert db2.recover_sending() == 0
+
+
+def test_list_due_users_ranges(db2_module):
+    db2 = db2_module
+    _users(db2, 6)
+    db2.set_subscribed(5, False)
+    db2.set_notify_hour(6, 10)
+    db2.mark_sent_many([1], "2025-03-01")         # сегодня — не слать
+    db2.mark_sent_many([2], "2025-02-28")         # вчера — слать
+    db2.mark_sent_many([3], "2025-03-02")         # «завтра» (часы перевели назад) — слать, как раньше
+    assert sorted(r["user_id"] for r in db2.list_due_users("2025-03-01", 9)) == [2, 3, 4]
+
+
+def test_due_query_uses_covering_partial_index(db2_module):
+    db2 = db2_module
+    with db2._connect() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db2._MIGRATIONS)
+        assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_users_hour'").fetchone()
+        plan = [r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + db2.DUE_USERS_SQL, (9, 9, "d", 9, "d"))]
+    searches = [p for p in plan if p.startswith("SEARCH")]
+    assert len(searches) == 3 and all("COVERING INDEX idx_users_due" in p for p in searches)
+
+
+def test_failed_migration_rolls_back(db2_module, monkeypatch):
+    import sqlite3
+    import pytest
+    db2 = db2_module
+    monkeypatch.setattr(db2, "_MIGRATIONS", db2._MIGRATIONS + [
+        ("CREATE TABLE half_done (x)", "SELECT * FROM no_such_table"),
+    ])
+    with pytest.raises(sqlite3.OperationalError):
+        db2.init_db()
+    with db2._connect() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db2._MIGRATIONS) - 1
+        assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone()
+
+
+def test_migration_upgrades_old_schema(tmp_db_path, monkeypatch):
+    import sqlite3
+    monkeypatch.setenv("TOKEN", "1:test")
+    import db2
+    monkeypatch.setattr(db2, "DB_PATH", tmp_db_path)
+    conn = sqlite3.connect(tmp_db_path)
+    conn.executescript("""
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, sign TEXT, notify_hour INTEGER NOT NULL DEFAULT 9,
+                            subscribed INTEGER NOT NULL DEFAULT 1, last_sent_date TEXT);
+        CREATE INDEX idx_users_hour ON users(notify_hour);
+        INSERT INTO users(user_id, sign) VALUES (1, 'лев');
+    """)
+    conn.close()
+    db2.init_db()
+    db2.init_db()  # повторный запуск миграции не трогает
+    try:
+        with db2._connect() as c:
+            names = {r[0] for r in c.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert "idx_users_due" in names and "idx_users_hour" not in names
+        assert [r["user_id"] for r in db2.list_due_users("2025-03-01", 9)] == [1]
+    finally:
+        db2.close_db()
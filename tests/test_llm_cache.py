@@ -0,0 +1,53 @@
+def test_key_normalizes_question_but_respects_params(llm_cache_module):
+    llm_cache = llm_cache_module
+    sys_msg = {"role": "system", "content": "Ты — Йода."}
+    k1 = llm_cache.make_key("m", [sys_msg, {"role": "user", "content": "Что  такое API?"}], 0.2, 400)
+    k2 = llm_cache.make_key("m", [sys_msg, {"role": "user", "content": "что такое api?"}], 0.2, 400)
+    assert k1 == k2
+    assert k1 != llm_cache.make_key("m", [sys_msg, {"role": "user", "content": "что такое api?"}], 0.7, 400)
+    assert k1 != llm_cache.make_key("other", [sys_msg, {"role": "user", "content": "что такое api?"}], 0.2, 400)
+    other_sys = {"role": "system", "content": "Ты — Гэндальф."}
+    assert k1 != llm_cache.make_key("m", [other_sys, {"role": "user", "content": "что такое api?"}], 0.2, 400)
+
+
+def test_memory_and_sqlite_tiers_with_ttl(llm_cache_module):
+    llm_cache = llm_cache_module
+    now = [1000.0]
+    cache = llm_cache.ResponseCache(maxsize=10, ttl_s=60, clock=lambda: now[0])
+
+    assert cache.get("k") is None
+    cache.put("k", "m", "ответ")
+    assert cache.get("k") == "ответ"
+    assert cache.hits_memory == 1
+
+    # Новый процесс: память пуста, ответ берётся из bot.db
+    fresh = llm_cache.ResponseCache(maxsize=10, ttl_s=60, clock=lambda: now[0])
+    assert fresh.get("k") == "ответ"
+    assert fresh.hits_db == 1
+
+    now[0] += 61
+    assert cache.get("k") is None
+    assert fresh.get("k") is None
+    assert cache.purge() == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_expired_rows_are_purged_while_running(llm_cache_module, db_module):
+    llm_cache = llm_cache_module
+    now = [1000.0]
+    cache = llm_cache.ResponseCache(maxsize=10, ttl_s=60, clock=lambda: now[0],
+                                    purge_every=3, purge_interval_s=3600)
+
+    def rows():
+        with db_module._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    cache.put("old1", "m", "a")
+    cache.put("old2", "m", "b")
+    now[0] += 61
+    cache.put("new1", "m", "c")       # третья запись — чистка по счётчику
+    assert rows() == 1 and cache.stats()["purged"] == 2
+
+    now[0] += 3600                    # и по времени, даже при редких записях
+    cache.put("new2", "m", "d")
+    assert rows() == 1
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+
+import pytest
+
+import llm_limiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_at_rate():
+    clock = Clock()
+    bucket = llm_limiter.TokenBucket(rate=2, burst=2, clock=clock)
+    assert bucket.try_take() and bucket.try_take()
+    assert not bucket.try_take()
+    assert bucket.wait_time() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_take()
+
+
+def test_user_limit_rejects_fast_with_retry_after():
+    clock = Clock()
+    lim = llm_limiter.Limiter(user_rate=0.1, user_burst=1, clock=clock)
+    lim.check_user(1)
+    with pytest.raises(llm_limiter.UserRateLimited) as excinfo:
+        lim.check_user(1)
+    assert excinfo.value.retry_after == pytest.approx(10)
+    lim.check_user(2)  # у другого пользователя свой бакет
+    assert lim.stats()["rejected_user"] == 1
+
+
+def test_full_queue_rejects_with_position():
+    lim = llm_limiter.Limiter(queue_size=2)
+    lim.enqueue()
+    lim.enqueue()
+    with pytest.raises(llm_limiter.QueueFull) as excinfo:
+        lim.enqueue()
+    assert excinfo.value.position == 2
+    assert "2 в очереди" in str(excinfo.value)
+
+
+def test_priority_order_and_wait_time():
+    clock = Clock()
+    lim = llm_limiter.Limiter(global_rate=1, global_burst=1, clock=clock)
+    random_q = lim.enqueue(llm_limiter.PRIORITY_RANDOM)
+    ask = lim.enqueue(llm_limiter.PRIORITY_ASK)
+    assert ask.position == 0 and random_q.position == 0
+
+    with lim._cond:
+        assert lim._try_admit(random_q) > 0   # впереди прямой вопрос
+        assert lim._try_admit(ask) == 0
+        delay = lim._try_admit(random_q)      # глобальный бакет пуст
+    assert delay == pytest.approx(1)
+    clock.now += 1
+    assert lim.wait(random_q) == pytest.approx(1)
+    st = lim.stats()
+    assert st["admitted"] == 2 and st["queued"] == 0
+    assert st["wait_avg_s"] == pytest.approx(0.5)
+
+
+def test_queue_timeout_frees_the_head():
+    clock = Clock()
+    lim = llm_limiter.Limiter(global_rate=1, global_burst=0, queue_timeout_s=5, clock=clock)
+    stuck = lim.enqueue()
+    nxt = lim.enqueue()
+    clock.now += 6
+    with pytest.raises(llm_limiter.QueueTimeout):
+        lim.wait(stuck)
+    assert lim._queue == [nxt]
+
+
+def test_slow_bucket_does_not_delay_queue_timeout():
+    # Бакет пополнится через ~1000 с, а таймаут очереди — 0.2 с
+    lim = llm_limiter.Limiter(global_rate=0.001, global_burst=0, queue_timeout_s=0.2)
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(pytest.raises(
+        llm_limiter.QueueTimeout, lim.wait, lim.enqueue())))
+    waiter.start()
+    waiter.join(2)
+    assert not waiter.is_alive() and result
+    assert lim.stats()["queued"] == 0
+
+
+def test_global_rate_holds_across_threads():
+    lim = llm_limiter.Limiter(global_rate=50, global_burst=1)
+    admitted = []
+
+    def worker():
+        lim.wait(lim.enqueue())
+        admitted.append(lim._clock())
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    admitted.sort()
+    assert len(admitted) == 6
+    # 1 токен сразу + 5 по 1/50 с: не быстрее темпа бакета
+    assert admitted[-1] - admitted[0] >= 5 / 50 * 0.9
+
+
+def test_cancelled_async_waiter_leaves_queue():
+    lim = llm_limiter.Limiter(global_rate=0.001, global_burst=0)
+
+    async def scenario():
+        ticket = lim.enqueue()
+        task = asyncio.create_task(lim.await_turn(ticket))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert lim.stats()["queued"] == 0
+
+
+def test_take_global_meters_retries():
+    clock = Clock()
+    lim = llm_limiter.Limiter(global_rate=1, global_burst=1, clock=clock)
+    lim.take_global(timeout_s=0)
+    with pytest.raises(llm_limiter.QueueTimeout):
+        lim.take_global(timeout_s=0.5)  # токен появится только через 1 с
+    clock.now += 1
+    asyncio.run(lim.await_global(timeout_s=0))
+    assert lim.stats()["retry_tokens"] == 2
+
+
+def test_user_buckets_evict_only_full_ones(monkeypatch):
+    monkeypatch.setattr(llm_limiter, "MAX_USER_BUCKETS", 3)
+    clock = Clock()
+    lim = llm_limiter.Limiter(user_rate=0.1, user_burst=1, clock=clock)
+    lim.check_user(1)
+    lim.check_user(2)
+    clock.now += 100                # бакеты 1 и 2 снова полные
+    lim.check_user(3)               # 3 только что потратил свой токен
+    lim.check_user(4)               # вытесняется самый давний полный — 1
+    lim.check_user(5)
+    assert list(lim._users) == [3, 4, 5]
+    lim.check_user(6)               # 3 не полон: не забываем, словарь временно растёт
+    assert list(lim._users) == [3, 4, 5, 6]
+    with pytest.raises(llm_limiter.UserRateLimited):
+        lim.check_user(3)           # нового всплеска нет
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+import llm_router
+from openrouter_client import OpenRouterError
+
+
+@pytest.fixture()
+def router(db_module, monkeypatch):
+    monkeypatch.setattr(llm_router, "_breakers", {})
+    monkeypatch.setattr(llm_router, "backoff_delay", lambda attempt: 0.0)
+    return llm_router
+
+
+def test_breaker_opens_and_half_opens():
+    now = [0.0]
+    br = llm_router.CircuitBreaker(failures=2, reset_after_s=10, clock=lambda: now[0])
+    br.record_failure()
+    assert br.allow()
+    br.record_failure()
+    assert br.state == "open" and not br.allow()
+    now[0] += 10
+    assert br.allow()          # одна пробная попытка
+    assert not br.allow()
+    br.record_success()
+    assert br.state == "closed"
+
+
+def test_falls_back_to_next_model_in_registry(router, db_module):
+    models = [m["key"] for m in db_module.list_models()]
+    calls = []
+
+    def fn(key, timeout_s):
+        calls.append(key)
+        if key == models[0]:
+            raise OpenRouterError(503, "down")
+        return "ответ"
+
+    result, used = router.call_with_fallback(fn, models[0])
+    assert (result, used) == ("ответ", models[1])
+    # 1 попытка + LLM_RETRIES повторов на первой модели, затем вторая
+    assert calls == [models[0]] * (router.RETRIES + 1) + [models[1]]
+
+
+def test_fatal_error_and_no_fallback(router, db_module):
+    models = [m["key"] for m in db_module.list_models()]
+
+    def unauthorized(key, timeout_s):
+        raise OpenRouterError(401, "bad key")
+
+    with pytest.raises(OpenRouterError) as excinfo:
+        router.call_with_fallback(unauthorized, models[0])
+    assert excinfo.value.status == 401
+
+    seen = []
+
+    def rate_limited(key, timeout_s):
+        seen.append(key)
+        raise OpenRouterError(429, "rate")
+
+    with pytest.raises(OpenRouterError):
+        router.call_with_fallback(rate_limited, models[0], fallback=False)
+    assert set(seen) == {models[0]}
+
+
+def test_open_breaker_skips_model_async(router, db_module):
+    models = [m["key"] for m in db_module.list_models()]
+    br = router.breaker_for(models[0])
+    for _ in range(br.failures):
+        br.record_failure()
+
+    async def afn(key, timeout_s):
+        assert timeout_s <= router.ATTEMPT_TIMEOUT_S
+        return key
+
+    result, used = asyncio.run(router.acall_with_fallback(afn, models[0]))
+    assert used == models[1]
+
+
+def test_every_retry_and_fallback_takes_a_global_token(router, db_module):
+    models = [m["key"] for m in db_module.list_models()]
+    acquired, calls = [], []
+
+    def fn(key, timeout_s):
+        calls.append(key)
+        if len(calls) < 3:
+            raise OpenRouterError(503, "down")
+        return "ok"
+
+    result, used = router.call_with_fallback(fn, models[0], acquire=acquired.append)
+    # первая попытка оплачена допуском из очереди, повтор и резервная — токеном каждая
+    assert result == "ok" and len(calls) == 3 and len(acquired) == 2
+
+
+def test_failed_acquire_releases_half_open_probe(router, db_module):
+    models = [m["key"] for m in db_module.list_models()]
+
+    def fn(key, timeout_s):
+        raise OpenRouterError(503, "down")
+
+    def no_token(timeout_s):
+        raise TimeoutError
+
+    br = router.breaker_for(models[1])
+    for _ in range(br.failures):
+        br.record_failure()
+    br._opened_at -= br.reset_after_s  # half-open: одна пробная попытка
+    with pytest.raises(TimeoutError):
+        router.call_with_fallback(fn, models[0], acquire=no_token)
+    assert br.allow()  # пробу не «съели» несостоявшейся попыткой
+
+
+def test_async_reads_model_registry_off_the_event_loop(router, db_module, monkeypatch):
+    import threading
+    models = [m["key"] for m in db_module.list_models()]
+    real = router.candidate_models
+    threads = []
+
+    def spy(*args):
+        threads.append(threading.current_thread())
+        return real(*args)
+
+    monkeypatch.setattr(router, "candidate_models", spy)
+
+    async def afn(key, timeout_s):
+        return key
+
+    async def scenario():
+        return threading.current_thread(), await router.acall_with_fallback(afn, models[0])
+
+    loop_thread, (result, used) = asyncio.run(scenario())
+    assert used == models[0]
+    assert threads and loop_thread not in threads
@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import llm_limiter
+from singleflight import Group
+
+
+class RateLimited(Exception):
+    error_code = 429
+    result_json = {"parameters": {"retry_after": 0}}
+
+
+class FakeBot:
+    def __init__(self, edit_error=None, final_only=False):
+        self.replies = []
+        self.edits = []
+        self.chat_edits = {}
+        self.edit_error = edit_error
+        self.final_only = final_only  # падает только итоговая правка (без «▌»)
+
+    def reply_to(self, message, text, **kwargs):
+        self.replies.append(text)
+        return SimpleNamespace(chat=SimpleNamespace(id=message.chat.id), message_id=len(self.replies))
+
+    def edit_message_text(self, text, chat_id, message_id):
+        if self.edit_error is not None and not (self.final_only and text.endswith("▌")):
+            raise self.edit_error
+        self.edits.append(text)
+        self.chat_edits.setdefault(chat_id, []).append(text)
+
+
+def _message(user_id=1):
+    return SimpleNamespace(chat=SimpleNamespace(id=user_id), from_user=SimpleNamespace(id=user_id))
+
+
+@pytest.fixture()
+def stream(main2_module, monkeypatch):
+    """_stream_answer без сети: модель отвечает «Привет», лимитер свежий."""
+    def fake_stream(msgs, model, **kwargs):
+        yield "При"
+        yield "вет"
+
+    monkeypatch.setattr(main2_module, "chat_stream", fake_stream)
+    monkeypatch.setattr(main2_module.llm_cache, "ENABLED", False)
+    monkeypatch.setattr(main2_module.llm_router, "call_with_fallback",
+                        lambda fn, key, **kwargs: (fn(key, 5.0), key))
+    monkeypatch.setattr(main2_module.llm_limiter, "limiter", llm_limiter.Limiter())
+    monkeypatch.setattr(main2_module, "llm_flights", Group())
+
+    def run(bot, question="Кто ты?", user_id=1):
+        monkeypatch.setattr(main2_module, "bot", bot)
+        work = main2_module._stream_answer(_message(user_id), [{"role": "user", "content": question}], "m")
+        if work is not None:
+            work.result(5)
+        return bot
+
+    return run
+
+
+def test_answer_is_delivered_by_edit(stream):
+    bot = stream(FakeBot())
+    assert bot.replies == ["⏳ Думаю…"]
+    assert bot.edits[-1].startswith("Привет\n\n(")
+
+
+def test_answer_is_replied_when_final_edit_raises(stream):
+    bot = stream(FakeBot(edit_error=RuntimeError("message to edit not found"), final_only=True))
+    assert len(bot.replies) == 2
+    assert bot.replies[1].startswith("Привет\n\n(")
+
+
+def test_answer_is_replied_when_final_edit_never_lands(stream):
+    # 429 на каждую правку: finish() исчерпал попытки и вернул False
+    bot = stream(FakeBot(edit_error=RateLimited("Too Many Requests")))
+    assert bot.edits == []
+    assert len(bot.replies) == 2
+    assert bot.replies[1].startswith("Привет\n\n(")
+
+
+def test_failing_progress_edits_do_not_fail_the_answer(stream):
+    # Каждая правка падает: ход генерации теряется, но ответ доходит отдельным сообщением
+    bot = stream(FakeBot(edit_error=RuntimeError("message to edit not found")))
+    assert bot.replies[1].startswith("Привет\n\n(")
+
+
+def test_follower_sees_progress_of_shared_request(stream, main2_module, monkeypatch):
+    release = threading.Event()
+
+    def slow_stream(msgs, model, **kwargs):
+        yield "При"
+        release.wait(2)
+        yield "вет"
+
+    monkeypatch.setattr(main2_module, "chat_stream", slow_stream)
+    bot = FakeBot()
+    leader = threading.Thread(target=stream, args=(bot,), kwargs={"user_id": 1})
+    leader.start()
+    while main2_module.llm_flights.calls < 1 or 1 not in bot.chat_edits:
+        time.sleep(0.01)
+    follower = threading.Thread(target=stream, args=(bot,), kwargs={"user_id": 2})
+    follower.start()
+    while main2_module.llm_flights.calls < 2:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert main2_module.llm_flights.executions == 1
+    assert "Привет ▌" in bot.chat_edits[2]            # ход общего запроса — и у ведомого
+    assert bot.chat_edits[2][-1].startswith("Привет\n\n(")
+
+
+def test_queued_llm_requests_do_not_hold_handler_threads(stream, main2_module, monkeypatch):
+    # Общий бакет пуст: все вопросы ждут в очереди лимитера (до таймаута)
+    limiter = llm_limiter.Limiter(global_rate=0.001, global_burst=1, queue_timeout_s=1)
+    limiter.take_global(0)
+    monkeypatch.setattr(main2_module.llm_limiter, "limiter", limiter)
+    bot = FakeBot()
+    monkeypatch.setattr(main2_module, "bot", bot)
+
+    def ask(user_id):
+        return main2_module._stream_answer(
+            _message(user_id), [{"role": "user", "content": f"вопрос {user_id}"}], "m")
+
+    # Потоки обработчиков TeleBot (num_threads=2): два вопроса, затем обычная команда
+    handlers = ThreadPoolExecutor(max_workers=2)
+    t0 = time.perf_counter()
+    asked = [handlers.submit(ask, user_id) for user_id in (1, 2)]
+    other = handlers.submit(lambda: "note_list")
+    assert other.result(0.5) == "note_list"
+    assert time.perf_counter() - t0 < 0.5
+    works = [f.result(0.5) for f in asked]
+    assert limiter.stats()["queued"] == 2
+
+    for work in works:
+        work.result(5)
+    handlers.shutdown()
+    assert limiter.stats()["timed_out"] == 2
+    assert sum("очеред" in r.lower() for r in bot.replies + bot.edits) >= 2
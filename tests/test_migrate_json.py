@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture()
+def migrate(db_module):
+    import migrate_json
+    return migrate_json
+
+
+def _write(tmp_path, name, obj):
+    path = tmp_path / name
+    path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    return str(path)
+
+
+def test_json_items_streams_and_resumes(migrate):
+    data = {"counter": 12345, "notes": {str(i): f"заметка №{i}" for i in range(50)}, "tail": [1]}
+    raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    parser = migrate.JsonItems(io.BytesIO(raw), chunk=7)  # куски режут и кириллицу, и числа
+    items = parser.items(("notes",))
+    first = [next(items) for _ in range(20)]
+    assert first[-1] == ("19", "заметка №19")
+    rest = list(migrate.JsonItems(io.BytesIO(raw), chunk=5).resume(parser.offset()))
+    assert [k for k, _ in first + rest] == [str(i) for i in range(50)]
+    assert list(migrate.JsonItems(io.BytesIO(b'{"a": 1}')).items(("notes",))) == []
+
+
+def test_migrate_notes_and_activity(migrate, db_module, tmp_path):
+    notes = _write(tmp_path, "notes.json", {"notes": {"1": "купить хлеб", "2": " ", "5": "позвонить"},
+                                            "counter": 6})
+    activity = _write(tmp_path, "activity.json", {"7": ["2025-01-01", "2025-01-03"], "x": ["bad"]})
+    out = io.StringIO()
+    stats = migrate.migrate_file(notes, "notes", owner=42, batch=2, out=out)
+    assert stats["items"] == 3 and stats["skipped"] == 1
+    assert [r["text"] for r in db_module.iter_notes(42)] == ["купить хлеб", "позвонить"]
+    assert migrate.migrate_file(activity, "activity", out=out)["skipped"] == 1
+    assert db_module.activity_years(7) == {2025: 0b101}
+
+    # повторный запуск ничего не дублирует
+    assert migrate.migrate_file(notes, "notes", owner=42, out=out)["status"] == "already"
+    assert db_module.count_notes(42) == 2
+    assert migrate.migrate_file(notes.replace("notes", "none"), "notes")["status"] == "missing"
+
+
+def test_migrate_resumes_after_crash(migrate, db_module, tmp_path, monkeypatch):
+    path = _write(tmp_path, "notes.json", {"notes": {str(i): f"n{i}" for i in range(10)}})
+    real = db_module.save_json_migration_batch
+    calls = []
+
+    def crash_on_second(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        real(*args, **kwargs)
+
+    monkeypatch.setattr(db_module, "save_json_migration_batch", crash_on_second)
+    with pytest.raises(KeyboardInterrupt):
+        migrate.migrate_file(path, "notes", owner=1, batch=3, out=io.StringIO())
+    assert db_module.count_notes(1) == 3 and db_module.get_json_migration("notes.json")["items"] == 3
+
+    monkeypatch.setattr(db_module, "save_json_migration_batch", real)
+    stats = migrate.migrate_file(path, "notes", owner=1, batch=3, out=io.StringIO())
+    assert stats["items"] == 7
+    assert [r["text"] for r in db_module.iter_notes(1)] == [f"n{i}" for i in range(10)]
+    assert db_module.get_json_migration("notes.json")["done"] == 1
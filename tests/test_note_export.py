@@ -0,0 +1,67 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture()
+def exporter(db_module):
+    import note_export
+    return note_export
+
+
+def test_iter_notes_crosses_batches_in_order(db_module):
+    db = db_module
+    ids = [db.add_note(1, f"n{i}") for i in range(7)]
+    db.add_note(2, "чужая")
+    assert [r["id"] for r in db.iter_notes(1, batch=3)] == ids
+
+
+def test_export_formats(exporter, db_module):
+    db_module.add_note(1, "первая")
+    db_module.add_note(1, 'с "кавычками", запятой\nи переносом')
+
+    buf, name, count = exporter.export_notes(1, "jsonl")
+    with buf:
+        lines = buf.read().decode("utf-8").splitlines()
+    assert count == 2 and name.endswith(".jsonl")
+    assert [json.loads(line)["text"] for line in lines] == ["первая", 'с "кавычками", запятой\nи переносом']
+
+    buf, name, _ = exporter.export_notes(1, "csv")
+    with buf:
+        rows = list(csv.reader(io.StringIO(buf.read().decode("utf-8-sig"), newline="")))
+    assert rows[0] == ["id", "text", "created_at"]
+    assert rows[2][1] == 'с "кавычками", запятой\nи переносом'
+
+    buf, name, _ = exporter.export_notes(1, "txt")
+    with buf:
+        text = buf.read().decode("utf-8")
+    assert name.endswith(".txt") and "Заметка #1:\nпервая\n" in text
+
+
+def test_export_gzip_and_empty(exporter, db_module, monkeypatch):
+    assert exporter.export_notes(1) == (None, None, 0)
+    for i in range(3):
+        db_module.add_note(1, f"n{i}")
+
+    monkeypatch.setattr(exporter, "GZIP_OVER", 2)  # больше порога — сжимаем сами
+    buf, name, _ = exporter.export_notes(1, "jsonl")
+    with buf:
+        data = gzip.decompress(buf.read()).decode("utf-8")
+    assert name.endswith(".jsonl.gz") and len(data.splitlines()) == 3
+
+    buf, name, _ = exporter.export_notes(1, "jsonl", compress=False)
+    with buf:
+        assert not name.endswith(".gz") and buf.read().startswith(b"{")
+
+
+def test_large_export_spills_out_of_memory(exporter, db_module, monkeypatch):
+    monkeypatch.setattr(exporter, "SPOOL_MAX", 4096)
+    for i in range(200):
+        db_module.add_note(1, "x" * 100)
+    buf, _, count = exporter.export_notes(1, "txt", compress=False)
+    with buf:
+        assert count == 200 and buf._rolled  # ушло в анонимный файл
+        assert buf.read().count(b"x" * 100) == 200
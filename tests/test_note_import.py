@@ -0,0 +1,98 @@
+import gzip
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture()
+def importer(db_module):
+    import note_import
+    return note_import
+
+
+def _texts(db_module, user_id):
+    return [r["text"] for r in db_module.iter_notes(user_id)]
+
+
+def test_detect_format():
+    import note_import
+    assert note_import.detect_format("Notes.CSV") == ("csv", False)
+    assert note_import.detect_format("notes.jsonl.gz") == ("jsonl", True)
+    assert note_import.detect_format("notes.pdf") == (None, False)
+
+
+def test_import_formats(importer, db_module):
+    data = "первая\n\nвторая\n".encode()
+    assert importer.import_notes(1, io.BytesIO(data), "txt") == (2, 1, 0)
+
+    lines = [json.dumps({"text": "из json"}, ensure_ascii=False), "не json", json.dumps("строка"), "{}"]
+    assert importer.import_notes(2, io.BytesIO("\n".join(lines).encode()), "jsonl") == (2, 2, 0)
+    assert _texts(db_module, 2) == ["из json", "строка"]
+
+    data = "\ufeffid,text\n1,\"с запятой, и\nпереносом\"\n2,\n".encode()
+    assert importer.import_notes(3, io.BytesIO(data), "csv") == (1, 1, 0)
+    assert _texts(db_module, 3) == ["с запятой, и\nпереносом"]
+
+
+def test_export_round_trip(importer, db_module):
+    import note_export
+    db_module.add_note(1, "одна")
+    db_module.add_note(1, "многострочная\nзаметка")
+    for fmt in ("txt", "jsonl", "csv"):
+        buf, name, _ = note_export.export_notes(1, fmt, compress=True)
+        with buf:
+            fmt_, gz = importer.detect_format(name)
+            assert importer.import_notes(10, buf, fmt_, gz)[0] == 2
+    assert _texts(db_module, 10) == ["одна", "многострочная\nзаметка"] * 3
+
+
+def test_import_respects_quota_and_chunks(importer, db_module, monkeypatch):
+    calls = []
+    real = db_module.add_notes
+    monkeypatch.setattr(db_module, "add_notes", lambda *a: calls.append(len(a[1])) or real(*a))
+    db_module.add_note(1, "старая")
+    data = gzip.compress("\n".join(f"n{i}" for i in range(10)).encode())
+    assert importer.import_notes(1, io.BytesIO(data), "txt", gz=True, max_notes=5, chunk=3) == (4, 0, 6)
+    assert calls == [3, 3]  # после заполнения лимита в БД больше не ходим
+    assert db_module.count_notes(1) == 5
+
+
+def test_add_notes_single_transaction(db_module):
+    assert db_module.add_notes(1, ["a", "b", "c"], max_notes=2) == 2
+    assert db_module.add_notes(1, ["d"], max_notes=2) == 0
+    with pytest.raises(Exception):
+        db_module.add_notes(1, ["e", None])  # NOT NULL — откатывается вся пачка
+    assert _texts(db_module, 1) == ["a", "b"]
+
+
+def test_csv_field_over_default_limit_is_skipped(importer, db_module):
+    data = f"text\nкороткая\n\"{'x' * 200_000}\"\nпоследняя\n".encode()
+    assert importer.import_notes(1, io.BytesIO(data), "csv") == (2, 1, 0)
+    assert _texts(db_module, 1) == ["короткая", "последняя"]
+
+
+def test_csv_import_restores_process_field_limit(importer, db_module):
+    import csv
+    before = csv.field_size_limit()
+    assert before < importer.MAX_FIELD_LEN  # импорт модуля предел не трогает
+    data = f"text\n\"{'x' * 200_000}\"\n".encode()
+    importer.import_notes(1, io.BytesIO(data), "csv")
+    with pytest.raises(importer.ImportFailed):
+        importer.import_notes(1, io.BytesIO(b"not gzip at all"), "csv", gz=True)
+    assert csv.field_size_limit() == before
+
+
+def test_broken_file_reports_what_was_saved(importer, db_module):
+    with pytest.raises(importer.ImportFailed) as exc:
+        importer.import_notes(1, io.BytesIO(b"not gzip at all"), "txt", gz=True)
+    assert (exc.value.imported, exc.value.failed) == (0, 0)
+    assert isinstance(exc.value.__cause__, gzip.BadGzipFile)
+
+    # обрыв посреди сжатого потока: первые пачки уже в БД
+    data = gzip.compress("\n".join(f"n{i}" for i in range(10_000)).encode())
+    with pytest.raises(importer.ImportFailed) as exc:
+        importer.import_notes(2, io.BytesIO(data[:len(data) // 2]), "txt", gz=True, chunk=100)
+    saved = db_module.count_notes(2)
+    assert saved > 0 and exc.value.imported == saved
+    assert 0 <= exc.value.failed < 100
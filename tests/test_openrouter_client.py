@@ -33,3 +33,105 @@ def test_chat_once_ok_headers_and_body(openrouter_module, monkeypatch):
     assert hdrs["Content-Type"] == "application/json"
     assert hdrs["Authorization"] == "Bearer test-key"
 
+
+
+@responses.activate
+def test_client_uses_pooled_session_and_timeouts(openrouter_module):
+    url = "http://stub.local/v1/chat/completions"
+    payload = {"choices": [{"message": {"content": "pong"}}]}
+    responses.add(responses.POST, url, json=payload, status=200)
+    responses.add(responses.POST, url, json={"error": "busy"}, status=502)
+
+    client = openrouter_module.OpenRouterClient(
+        "k", api_url=url, pool_size=2, connect_timeout=1.5, read_timeout=7)
+    adapter = client.session.get_adapter(url)
+    assert adapter._pool_maxsize == 2
+
+    text, _ = client.chat_once([{"role": "user", "content": "ping"}], model="m")
+    assert text == "pong"
+    assert responses.calls[0].request.req_kwargs["timeout"] == (1.5, 7)
+
+    # HTTP-ошибка не «заворачивается» в 500 — статус сохраняется
+    try:
+        client.chat_once([{"role": "user", "content": "ping"}], model="m", timeout_s=3)
+        assert False, "Ожидалось исключение при 502"
+    except openrouter_module.OpenRouterError as e:
+        assert e.status == 502
+    client.close()
+
+
+@responses.activate
+def test_chat_stream_yields_deltas(openrouter_module):
+    url = "http://stub.local/v1/chat/completions"
+    sse = (
+        ": OPENROUTER PROCESSING\n\n"
+        'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n'
+        'data: {"choices": [{"delta": {"content": "При"}}]}\n\n'
+        'data: {"choices": [{"delta": {"content": "вет"}}]}\n\n'
+        "data: [DONE]\n\n"
+    )
+    responses.add(responses.POST, url, body=sse.encode(), status=200,
+                  content_type="text/event-stream")
+
+    client = openrouter_module.OpenRouterClient("k", api_url=url)
+    parts = list(client.chat_stream([{"role": "user", "content": "hi"}], model="m"))
+    assert parts == ["При", "вет"]
+    assert json.loads(responses.calls[0].request.body)["stream"] is True
+
+
+@responses.activate
+def test_chat_stream_maps_http_error(openrouter_module):
+    url = "http://stub.local/v1/chat/completions"
+    responses.add(responses.POST, url, json={"error": "rate"}, status=429)
+    client = openrouter_module.OpenRouterClient("k", api_url=url)
+    try:
+        list(client.chat_stream([{"role": "user", "content": "hi"}], model="m"))
+        assert False, "Ожидалось исключение при 429"
+    except openrouter_module.OpenRouterError as e:
+        assert e.status == 429
+
+
+def test_async_client_once_and_stream(openrouter_module):
+    import asyncio
+    import pytest
+    web = pytest.importorskip("aiohttp.web")
+
+    async def completions(request):
+        body = await request.json()
+        if body.get("stream"):
+            resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await resp.prepare(request)
+            for part in ("A", "B"):
+                chunk = json.dumps({"choices": [{"delta": {"content": part}}]})
+                await resp.write(f"data: {chunk}\n\n".encode())
+            await resp.write(b"data: [DONE]\n\n")
+            return resp
+        if body["model"] == "busy":
+            return web.json_response({"error": "busy"}, status=503)
+        return web.json_response({"choices": [{"message": {"content": "OK"}}]})
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", completions)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        client = openrouter_module.AsyncOpenRouterClient(
+            "k", api_url=f"http://127.0.0.1:{port}/v1/chat/completions")
+        try:
+            msgs = [{"role": "user", "content": "hi"}]
+            # Параллельные запросы через одну сессию
+            results = await asyncio.gather(*(client.chat_once(msgs, model="m") for _ in range(20)))
+            assert {text for text, _ in results} == {"OK"}
+            parts = [d async for d in client.chat_stream(msgs, model="m")]
+            assert parts == ["A", "B"]
+            with pytest.raises(openrouter_module.OpenRouterError) as excinfo:
+                await client.chat_once(msgs, model="busy")
+            assert excinfo.value.status == 503
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
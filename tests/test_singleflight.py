@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import pytest
+
+from singleflight import AsyncGroup, Group, Watchers, make_key
+
+
+def test_threads_share_one_execution():
+    group = Group()
+    release = threading.Event()
+    runs = []
+    results = []
+
+    def fn():
+        runs.append(1)
+        release.wait(2)
+        return "ответ"
+
+    def worker():
+        results.append(group.do("k", fn))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    while group.calls < 8:
+        pass
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(runs) == 1
+    assert {r for r, _ in results} == {"ответ"}
+    assert sum(shared for _, shared in results) == 7
+    assert group.dedup_ratio == pytest.approx(7 / 8)
+
+
+def test_error_fans_out_and_key_is_released():
+    group = Group()
+
+    with pytest.raises(ValueError):
+        group.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    # Ключ освобождён — следующий вызов выполняется заново
+    assert group.do("k", lambda: 1) == (1, False)
+
+
+def test_async_group_coalesces_and_propagates_errors():
+    async def scenario():
+        group = AsyncGroup()
+        runs = []
+
+        async def slow():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return "ок"
+
+        results = await asyncio.gather(*(group.do("k", slow) for _ in range(5)))
+        assert len(runs) == 1 and {r for r, _ in results} == {"ок"}
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream")
+
+        outcome = await asyncio.gather(*(group.do("e", failing) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(o, RuntimeError) for o in outcome)
+        assert group.executions == 2
+
+    asyncio.run(scenario())
+
+
+def test_watcher_error_does_not_reach_publisher_or_other_watchers():
+    watchers = Watchers()
+    seen = []
+
+    def broken(value):
+        raise RuntimeError("edit failed")
+
+    with watchers.watch("k", broken), watchers.watch("k", seen.append):
+        watchers.publish("k", "часть")
+        watchers.publish("other", "чужое")
+    watchers.publish("k", "после")
+    assert seen == ["часть"]
+
+
+def test_make_key_depends_on_all_parts():
+    msgs = [{"role": "user", "content": "q"}]
+    assert make_key("m", msgs, 0.2) == make_key("m", [{"content": "q", "role": "user"}], 0.2)
+    assert make_key("m", msgs, 0.2) != make_key("m", msgs, 0.3)
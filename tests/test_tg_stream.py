@@ -0,0 +1,59 @@
+from tg_stream import ThrottledEditor
+
+
+class FakeClock:
+    def __init__(self):
+        self.t = 100.0
+
+    def __call__(self):
+        return self.t
+
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+
+    def edit_message_text(self, text, chat_id, message_id):
+        self.edits.append(text)
+
+
+class RateLimited(Exception):
+    error_code = 429
+    result_json = {"parameters": {"retry_after": 5}}
+
+
+def test_updates_are_throttled_and_finish_always_lands():
+    bot, clock = FakeBot(), FakeClock()
+    ed = ThrottledEditor(bot, 1, 10, min_interval=1.0, clock=clock)
+
+    assert ed.update("a")          # первая правка — сразу
+    assert not ed.update("ab")     # слишком рано
+    clock.t += 1.0
+    assert ed.update("abc")
+    assert not ed.update("abc")    # тот же текст не отправляем
+    clock.t += 1.0
+    assert ed.finish("abcd")
+    assert bot.edits == ["a", "abc", "abcd"]
+
+
+def test_group_chats_use_slower_interval():
+    ed = ThrottledEditor(FakeBot(), -100123, 1, clock=FakeClock())
+    assert ed.min_interval > ThrottledEditor(FakeBot(), 5, 1, clock=FakeClock()).min_interval
+
+
+def test_retry_after_is_honored():
+    clock = FakeClock()
+
+    class Bot(FakeBot):
+        def edit_message_text(self, text, chat_id, message_id):
+            if not self.edits and clock.t < 105:
+                raise RateLimited("Too Many Requests")
+            super().edit_message_text(text, chat_id, message_id)
+
+    bot = Bot()
+    ed = ThrottledEditor(bot, 1, 10, min_interval=1.0, clock=clock)
+    assert not ed.update("a")
+    clock.t += 4
+    assert not ed.update("ab")     # ещё действует retry_after
+    clock.t += 1
+    assert ed.update("abc")
@@ -0,0 +1,137 @@
+"""
+tg_stream.py — постепенный вывод длинного ответа через edit_message_text.
+
+Бот сразу отправляет сообщение-заглушку, а затем правит его по мере прихода
+текста. Telegram ограничивает частоту правок (≈1 в секунду на личный чат,
+≈20 в минуту на группу), поэтому правки прореживаются: промежуточный текст
+копится и уходит не чаще min_interval, а на 429 выдерживаем retry_after.
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+PRIVATE_EDIT_INTERVAL_S = 1.0
+GROUP_EDIT_INTERVAL_S = 3.0
+MAX_TEXT = 4000
+
+
+def edit_interval_for(chat_id: int) -> float:
+    # У групп и каналов id отрицательные, лимит у них строже
+    return PRIVATE_EDIT_INTERVAL_S if chat_id > 0 else GROUP_EDIT_INTERVAL_S
+
+
+class ThrottledEditor:
+    """
+    update(text) — «хочу показать такой текст»; правка уйдёт, если прошло
+    достаточно времени с предыдущей. finish(text) — итоговая правка, всегда;
+    вернёт True, если в сообщении теперь этот текст (False — не вышло: 429
+    не отпустил за attempts попыток или текст пустой).
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: int, *,
+                 min_interval: float | None = None, clock=time.monotonic):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.min_interval = edit_interval_for(chat_id) if min_interval is None else min_interval
+        self._clock = clock
+        self._next_at = 0.0  # первая правка — сразу, без ожидания
+        self._shown = None
+        self._limited = False
+        self.edits = 0
+
+    def update(self, text: str) -> bool:
+        if self._clock() < self._next_at:
+            return False
+        return self._edit(text)
+
+    def finish(self, text: str, attempts: int = 3) -> bool:
+        for _ in range(attempts):
+            wait = self._next_at - self._clock()
+            if wait > 0:
+                time.sleep(wait)
+            if self._edit(text):
+                return True
+            if not self._limited:
+                break
+        return self._landed(text)
+
+    def _edit(self, text: str) -> bool:
+        text = self._prepare(text)
+        if text is None:
+            return False
+        try:
+            self.bot.edit_message_text(text, self.chat_id, self.message_id)
+        except Exception as e:
+            if self._failed(e, text):
+                return False
+            raise
+        self._done(text)
+        return True
+
+    # --- общая логика для sync/async ---
+    def _prepare(self, text: str) -> str | None:
+        self._limited = False
+        text = text[:MAX_TEXT]
+        if not text.strip() or text == self._shown:
+            return None
+        return text
+
+    def _landed(self, text: str) -> bool:
+        # уже показан (тот же текст или «message is not modified») — тоже успех
+        return bool(text[:MAX_TEXT].strip()) and self._shown == text[:MAX_TEXT]
+
+    def _done(self, text: str) -> None:
+        self._shown = text
+        self.edits += 1
+        self._next_at = self._clock() + self.min_interval
+
+    def _failed(self, e: Exception, text: str) -> bool:
+        """True — ошибка ожидаемая (429 / текст не изменился), False — пробросить."""
+        if getattr(e, "error_code", None) == 429:
+            retry_after = (getattr(e, "result_json", None) or {}).get("parameters", {}).get("retry_after", 1)
+            self._next_at = self._clock() + float(retry_after)
+            self._limited = True
+            log.warning("edit_message_text 429, retry_after=%s", retry_after)
+            return True
+        if "message is not modified" in str(e):
+            self._shown = text
+            return True
+        return False
+
+
+class AsyncThrottledEditor(ThrottledEditor):
+    """То же для AsyncTeleBot: bot.edit_message_text — корутина, ожидание — asyncio.sleep."""
+
+    async def update(self, text: str) -> bool:
+        if self._clock() < self._next_at:
+            return False
+        return await self._edit(text)
+
+    async def finish(self, text: str, attempts: int = 3) -> bool:
+        for _ in range(attempts):
+            wait = self._next_at - self._clock()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if await self._edit(text):
+                return True
+            if not self._limited:
+                break
+        return self._landed(text)
+
+    async def _edit(self, text: str) -> bool:
+        text = self._prepare(text)
+        if text is None:
+            return False
+        try:
+            await self.bot.edit_message_text(text, self.chat_id, self.message_id)
+        except Exception as e:
+            if self._failed(e, text):
+                return False
+            raise
+        self._done(text)
+        return True